@@ -0,0 +1,125 @@
+import os
+from PIL import Image, ImageFont
+from core import metrics
+
+FONT_DIR = "resources/fonts"
+
+# Orden de preferencia de fuentes (la primera que exista en el directorio)
+ORBITRON_FONTS = ['Orbitron-Medium.ttf', 'Orbitron-Bold.ttf', 'Orbitron-Regular.ttf', 'Orbitron.ttf']
+BOLD_FONTS = ['bold.ttf', 'arial-bold.ttf', 'roboto-bold.ttf', 'font-bold.ttf']
+REGULAR_FONTS = ['regular.ttf', 'arial.ttf', 'roboto.ttf', 'font.ttf']
+
+
+class AssetManager:
+    """Caché de fuentes, plantillas ya escaladas y archivos compartida por todo el proceso"""
+
+    def __init__(self):
+        self.font_paths = {}   # {(font_dir, bold): ruta o None}
+        self.fonts = {}        # {(ruta, tamaño): FreeTypeFont}
+        self.templates = {}    # {(ruta, tamaño, ancho_máximo): Image RGBA}
+        self.files = {}        # {ruta: bytes}
+        self.hits = 0
+        self.misses = 0
+
+    def _hit(self, kind: str):
+        self.hits += 1
+        metrics.incr(f'assets.{kind}.hit')
+
+    def _miss(self, kind: str):
+        self.misses += 1
+        metrics.incr(f'assets.{kind}.miss')
+
+    def _resolve_font(self, bold: bool, font_dir: str):
+        """Ruta de la fuente a usar (se resuelve una sola vez por directorio)"""
+        key = (font_dir, bold)
+        if key not in self.font_paths:
+            candidates = ORBITRON_FONTS + (BOLD_FONTS if bold else REGULAR_FONTS)
+            self.font_paths[key] = next(
+                (f"{font_dir}/{name}" for name in candidates if os.path.exists(f"{font_dir}/{name}")),
+                None
+            )
+        return self.font_paths[key]
+
+    def get_font(self, size: int, bold: bool = False, font_dir: str = FONT_DIR):
+        """Fuente del tamaño indicado (Orbitron, genérica o la de por defecto de Pillow)"""
+        path = self._resolve_font(bold, font_dir)
+        key = (path, size)
+        font = self.fonts.get(key)
+        if font is not None:
+            self._hit('font')
+            return font
+
+        self._miss('font')
+        try:
+            font = ImageFont.truetype(path, size) if path else ImageFont.load_default()
+        except Exception as e:
+            print(f"Error cargando fuente: {e}")
+            font = ImageFont.load_default()
+        self.fonts[key] = font
+        return font
+
+    def get_template(self, path: str, size: tuple = None, max_width: int = None,
+                     resample=None) -> Image.Image:
+        """Copia de una plantilla RGBA ya escalada, lista para dibujar encima.
+
+        `size` fuerza unas dimensiones exactas; `max_width` reduce proporcionalmente
+        las imágenes más anchas. Lanza la excepción de Pillow si no se puede abrir.
+        """
+        key = (path, size, max_width)
+        template = self.templates.get(key)
+        if template is None:
+            self._miss('template')
+            image = Image.open(path)
+            if size is not None:
+                image = image.resize(size, resample) if resample is not None else image.resize(size)
+            elif max_width is not None and image.width > max_width:
+                new_size = (max_width, int(image.height * max_width / image.width))
+                image = image.resize(new_size, resample) if resample is not None else image.resize(new_size)
+            template = image.convert('RGBA')
+            self.templates[key] = template
+        else:
+            self._hit('template')
+        return template.copy()
+
+    def get_file(self, path: str):
+        """Contenido de un archivo (p. ej. imágenes que se envían tal cual), o None si no existe"""
+        data = self.files.get(path)
+        if data is not None:
+            self._hit('file')
+            return data
+
+        self._miss('file')
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        self.files[path] = data
+        return data
+
+    def memory_usage(self) -> int:
+        """Bytes aproximados que ocupan las plantillas, los archivos y las fuentes cargadas"""
+        total = sum(image.width * image.height * len(image.getbands()) for image in self.templates.values())
+        total += sum(len(data) for data in self.files.values())
+        for path in {path for path, _ in self.fonts if path}:
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'fonts': len(self.fonts),
+            'templates': len(self.templates),
+            'files': len(self.files),
+            'memory_bytes': self.memory_usage(),
+        }
+
+
+# Instancia única por proceso (cada proceso del pool de renderizado tiene la suya)
+assets = AssetManager()
+
+metrics.register_gauge('assets', assets.stats)
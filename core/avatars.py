@@ -0,0 +1,118 @@
+import asyncio
+import os
+from collections import OrderedDict
+from core import metrics
+from core.http import get_session
+
+# Configuración de la caché de avatares (variables de entorno opcionales)
+AVATAR_CACHE_BYTES = int(os.getenv("AVATAR_CACHE_BYTES", str(16 * 1024 * 1024)))  # presupuesto en memoria
+AVATAR_CACHE_DIR = os.getenv("AVATAR_CACHE_DIR", "")                             # directorio en disco (vacío = desactivado)
+
+
+class AvatarCache:
+    """Caché de avatares en dos niveles (memoria LRU + disco opcional) por hash de Discord y tamaño"""
+
+    def __init__(self, max_bytes: int = AVATAR_CACHE_BYTES, cache_dir: str = AVATAR_CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()   # {(hash, tamaño): bytes} del menos al más reciente
+        self.size = 0
+        self._inflight = {}            # {(hash, tamaño): Future} descargas en curso
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        metrics.register_gauge('avatars.memory_bytes', lambda: self.size)
+        metrics.register_gauge('avatars.entries', lambda: len(self.entries))
+
+    def _remember(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def _disk_path(self, key) -> str:
+        avatar_hash, size = key
+        return os.path.join(self.cache_dir, f"{avatar_hash}_{size}.png")
+
+    def _read_disk(self, key):
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data: bytes):
+        try:
+            path = self._disk_path(key)
+            with open(f"{path}.tmp", 'wb') as f:
+                f.write(data)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            print(f"Error guardando avatar en disco: {e}")
+
+    async def fetch(self, asset, size: int = 256):
+        """Bytes PNG del avatar/icono (`discord.Asset`) al tamaño pedido, o None si falla"""
+        if asset is None:
+            return None
+
+        key = (asset.key, size)
+        data = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+            metrics.incr('avatars.hit.memory')
+            return data
+
+        # Si otra petición ya está descargando este avatar, esperar a esa
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            data = await self._load(asset, key, size)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_result(None)
+            print(f"❌ Error descargando avatar: {e}")
+            return None
+        finally:
+            # Si esta petición se canceló, no dejar colgadas a las que esperan
+            if not future.done():
+                future.set_result(None)
+            del self._inflight[key]
+
+    async def _load(self, asset, key, size: int):
+        if self.cache_dir:
+            data = await asyncio.to_thread(self._read_disk, key)
+            if data is not None:
+                metrics.incr('avatars.hit.disk')
+                self._remember(key, data)
+                return data
+
+        metrics.incr('avatars.miss')
+        # Pedir al CDN una versión PNG estática y pequeña en vez del original
+        url = asset.with_static_format('png').with_size(size).url
+        session = await get_session()
+        with metrics.timer('avatars.download'):
+            async with session.get(url) as resp:
+                if resp.status != 200:
+                    return None
+                data = await resp.read()
+
+        self._remember(key, data)
+        if self.cache_dir:
+            await asyncio.to_thread(self._write_disk, key, data)
+        return data
+
+
+# Instancia compartida por todos los cogs
+avatars = AvatarCache()
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from core import metrics
+
+# Configuración de la caché de tarjetas (variables de entorno opcionales)
+CARD_CACHE_MAX = int(os.getenv("CARD_CACHE_MAX", "256"))        # tarjetas guardadas como máximo
+CARD_CACHE_TTL = float(os.getenv("CARD_CACHE_TTL", "600"))      # segundos de vida de cada tarjeta
+
+
+def card_digest(user_id: int, avatar_key: str, fields: dict) -> str:
+    """Resumen de todos los datos que determinan cómo se ve una tarjeta"""
+    payload = repr((user_id, avatar_key, sorted(fields.items())))
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class CardCache:
+    """LRU con TTL de tarjetas ya codificadas en PNG, indexada por el resumen de sus datos"""
+
+    def __init__(self, max_entries: int = CARD_CACHE_MAX, ttl: float = CARD_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()   # {digest: (user_id, expira, png)}
+        self.by_user = {}              # {user_id: {digest}}
+        self.size = 0
+
+        metrics.register_gauge('card_cache.entries', lambda: len(self.entries))
+        metrics.register_gauge('card_cache.bytes', lambda: self.size)
+
+    def _drop(self, digest: str):
+        user_id, _, png = self.entries.pop(digest)
+        self.size -= len(png)
+        digests = self.by_user.get(user_id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self.by_user[user_id]
+
+    def get(self, digest: str):
+        """PNG guardado para ese resumen, o None si no existe o ha caducado"""
+        entry = self.entries.get(digest)
+        if entry is None:
+            metrics.incr('card_cache.miss')
+            return None
+        if entry[1] < time.monotonic():
+            self._drop(digest)
+            metrics.incr('card_cache.miss')
+            return None
+
+        self.entries.move_to_end(digest)
+        metrics.incr('card_cache.hit')
+        return entry[2]
+
+    def put(self, user_id: int, digest: str, png: bytes):
+        """Guarda una tarjeta recién dibujada"""
+        if digest in self.entries:
+            self._drop(digest)
+        self.entries[digest] = (user_id, time.monotonic() + self.ttl, png)
+        self.by_user.setdefault(user_id, set()).add(digest)
+        self.size += len(png)
+
+        while len(self.entries) > self.max_entries:
+            self._drop(next(iter(self.entries)))
+
+    def invalidate(self, user_id: int):
+        """Descarta las tarjetas de un usuario (su XP o su balance han cambiado)"""
+        for digest in list(self.by_user.get(user_id, ())):
+            self._drop(digest)
+
+
+# Instancia compartida por levels y user/perfil
+card_cache = CardCache()
@@ -0,0 +1,107 @@
+import os
+import time
+from core import metrics
+
+# Configuración de los cooldowns (variables de entorno opcionales)
+COOLDOWN_MAX_ENTRIES = int(os.getenv("COOLDOWN_MAX_ENTRIES", "50000"))   # claves vivas por almacén
+COOLDOWN_RESOLUTION = float(os.getenv("COOLDOWN_RESOLUTION", "5"))       # segundos por casilla de la rueda
+
+
+class CooldownStore:
+    """Cooldowns por clave con memoria acotada (rueda de tiempo por casillas).
+
+    Cada clave vive en la casilla del segundo en que expira; al consultar se
+    barren las casillas ya vencidas, así que las claves de usuarios que no
+    vuelven a hablar desaparecen solas. Si se supera `max_entries` se expulsan
+    primero las que antes iban a expirar.
+    """
+
+    def __init__(self, name: str, max_entries: int = COOLDOWN_MAX_ENTRIES,
+                 resolution: float = COOLDOWN_RESOLUTION):
+        self.name = name
+        self.max_entries = max_entries
+        self.resolution = resolution
+        self.expires = {}     # {clave: instante de expiración (monotonic)}
+        self.wheel = {}       # {casilla: {clave}} (puede contener claves ya movidas a otra casilla)
+        self._next_slot = None
+        self.evictions = 0
+        self.expirations = 0
+
+        metrics.register_gauge(f'cooldowns.{name}.entries', lambda: len(self.expires))
+        metrics.register_gauge(f'cooldowns.{name}.evictions', lambda: self.evictions)
+
+    def _slot(self, instant: float) -> int:
+        return int(instant // self.resolution)
+
+    def _sweep(self, now: float):
+        """Borra las claves de las casillas vencidas (la actual se revisa en la siguiente vuelta)"""
+        current = self._slot(now)
+        if self._next_slot is None:
+            self._next_slot = current
+            return
+        if current <= self._next_slot:
+            return
+
+        # Tras mucho tiempo sin actividad es más barato recorrer solo las casillas existentes
+        if current - self._next_slot > len(self.wheel):
+            due = [slot for slot in self.wheel if slot < current]
+        else:
+            due = range(self._next_slot, current)
+
+        for slot in due:
+            for key in self.wheel.pop(slot, ()):
+                expires = self.expires.get(key)
+                if expires is not None and expires <= now:
+                    del self.expires[key]
+                    self.expirations += 1
+        self._next_slot = current
+
+    def _evict(self):
+        while len(self.expires) > self.max_entries and self.wheel:
+            slot = min(self.wheel)
+            keys = self.wheel[slot]
+            while keys and len(self.expires) > self.max_entries:
+                key = keys.pop()
+                if key in self.expires and self._slot(self.expires[key]) == slot:
+                    del self.expires[key]
+                    self.evictions += 1
+            if not keys:
+                del self.wheel[slot]
+
+    def hit(self, key, cooldown: float) -> bool:
+        """Comprueba y marca: True si `key` no estaba en cooldown (y empieza uno nuevo de `cooldown` s)"""
+        now = time.monotonic()
+        self._sweep(now)
+
+        expires = self.expires.get(key)
+        if expires is not None and expires > now:
+            return False
+
+        expires = now + cooldown
+        self.expires[key] = expires
+        self.wheel.setdefault(self._slot(expires), set()).add(key)
+        if len(self.expires) > self.max_entries:
+            self._evict()
+        return True
+
+    def remaining(self, key) -> float:
+        """Segundos que faltan para que `key` pueda volver a actuar (0 si no está en cooldown)"""
+        expires = self.expires.get(key)
+        if expires is None:
+            return 0.0
+        return max(0.0, expires - time.monotonic())
+
+    def reset(self, key):
+        """Quita el cooldown de `key` (su entrada en la rueda se descarta al barrer)"""
+        self.expires.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self.expires)
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self.expires),
+            'slots': len(self.wheel),
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
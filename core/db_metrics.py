@@ -0,0 +1,194 @@
+import asyncio
+import functools
+import os
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+from core import metrics
+
+# Configuración de la instrumentación (variables de entorno opcionales)
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "250"))    # umbral del log de consultas lentas
+DB_SLOW_QUERY_LOG_SIZE = int(os.getenv("DB_SLOW_QUERY_LOG_SIZE", "50"))
+
+# Cubetas para el número de filas devueltas
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+# Función de database.py que está ejecutando la consulta actual
+current_function = ContextVar('db_function', default='sin_funcion')
+
+# Últimas consultas lentas (la más reciente al final)
+slow_queries = deque(maxlen=DB_SLOW_QUERY_LOG_SIZE)
+
+
+def _redact(args) -> list:
+    """Sustituye los parámetros por su tipo (nunca se registran valores)"""
+    return [f"<{type(arg).__name__}>" for arg in args]
+
+
+def _compact(query: str) -> str:
+    return re.sub(r'\s+', ' ', query).strip()[:300]
+
+
+def _record(query: str, args, elapsed_ms: float, rows=None):
+    function = current_function.get()
+    metrics.histogram(f'db.{function}.execute').observe(elapsed_ms)
+    if rows is not None:
+        metrics.histogram(f'db.{function}.rows', ROW_BUCKETS).observe(rows)
+
+    if elapsed_ms >= DB_SLOW_QUERY_MS:
+        metrics.incr('db.slow_queries')
+        entry = {
+            'function': function,
+            'ms': round(elapsed_ms, 1),
+            'query': _compact(query),
+            'params': _redact(args),
+            'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        slow_queries.append(entry)
+        print(f"🐢 Consulta lenta en {function} ({entry['ms']} ms): {entry['query'][:120]}")
+
+
+def _row_count(result):
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    return 1
+
+
+class InstrumentedConnection:
+    """Envuelve una conexión de asyncpg midiendo cada consulta"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        # transaction(), copy_*, etc. se delegan tal cual
+        return getattr(self._conn, name)
+
+    async def _timed(self, method, query, args, count_rows: bool, **kwargs):
+        start = time.perf_counter()
+        result = await method(query, *args, **kwargs)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        _record(query, args, elapsed_ms, _row_count(result) if count_rows else None)
+        return result
+
+    async def execute(self, query, *args, **kwargs):
+        return await self._timed(self._conn.execute, query, args, False, **kwargs)
+
+    async def executemany(self, query, args, **kwargs):
+        start = time.perf_counter()
+        result = await self._conn.executemany(query, args, **kwargs)
+        _record(query, (), (time.perf_counter() - start) * 1000)
+        return result
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self._timed(self._conn.fetch, query, args, True, **kwargs)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self._timed(self._conn.fetchrow, query, args, True, **kwargs)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self._timed(self._conn.fetchval, query, args, True, **kwargs)
+
+
+class _InstrumentedAcquire:
+    """Context manager de `pool.acquire()` que mide la espera por una conexión"""
+
+    def __init__(self, owner, timeout):
+        self._owner = owner
+        self._timeout = timeout
+        self._conn = None
+
+    async def __aenter__(self):
+        owner = self._owner
+        owner.waiters += 1
+        start = time.perf_counter()
+        try:
+            self._conn = await owner._pool.acquire(timeout=self._timeout)
+        except asyncio.TimeoutError:
+            owner.acquire_timeouts += 1
+            metrics.incr('db.pool.acquire_timeout')
+            print(f"⚠️ Pool de base de datos saturado: {current_function.get()} esperó más de {self._timeout}s")
+            raise
+        finally:
+            owner.waiters -= 1
+        metrics.histogram(f'db.{current_function.get()}.acquire').observe((time.perf_counter() - start) * 1000)
+        return InstrumentedConnection(self._conn)
+
+    async def __aexit__(self, *exc):
+        await self._owner._pool.release(self._conn)
+        self._conn = None
+        return False
+
+
+class InstrumentedPool:
+    """Envuelve el pool de asyncpg: mide la espera de `acquire`, cada consulta y la ocupación del pool"""
+
+    def __init__(self, pool, acquire_timeout: float = None):
+        self._pool = pool
+        self.acquire_timeout = acquire_timeout
+        self.waiters = 0            # corrutinas esperando una conexión libre
+        self.acquire_timeouts = 0   # esperas que agotaron `acquire_timeout`
+
+        metrics.register_gauge('db.pool.size', pool.get_size)
+        metrics.register_gauge('db.pool.max_size', pool.get_max_size)
+        metrics.register_gauge('db.pool.idle', pool.get_idle_size)
+        metrics.register_gauge('db.pool.in_use', lambda: pool.get_size() - pool.get_idle_size())
+        metrics.register_gauge('db.pool.waiters', lambda: self.waiters)
+        metrics.register_gauge('db.pool.acquire_timeouts', lambda: self.acquire_timeouts)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    def acquire(self, timeout: float = None):
+        return _InstrumentedAcquire(self, timeout if timeout is not None else self.acquire_timeout)
+
+    async def _run(self, method: str, query, args):
+        async with self.acquire() as conn:
+            return await getattr(conn, method)(query, *args)
+
+    async def execute(self, query, *args):
+        return await self._run('execute', query, args)
+
+    async def fetch(self, query, *args):
+        return await self._run('fetch', query, args)
+
+    async def fetchrow(self, query, *args):
+        return await self._run('fetchrow', query, args)
+
+    async def fetchval(self, query, *args):
+        return await self._run('fetchval', query, args)
+
+
+def instrument(func):
+    """Atribuye las consultas de una corrutina de database.py a su nombre y mide su duración total"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = current_function.set(name)
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            metrics.histogram(f'db.{name}.total').observe((time.perf_counter() - start) * 1000)
+            current_function.reset(token)
+
+    return wrapper
+
+
+def snapshot() -> dict:
+    """Estadísticas de la base de datos agrupadas por función, más las consultas lentas"""
+    functions = {}
+    for name, values in metrics.snapshot()['histograms'].items():
+        if not name.startswith('db.'):
+            continue
+        function, _, kind = name[3:].rpartition('.')
+        functions.setdefault(function, {})[kind] = values
+    return {
+        'functions': functions,
+        'slow_queries': list(slow_queries),
+        'slow_query_ms': DB_SLOW_QUERY_MS,
+    }
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field, fields, replace
+from core import metrics
+from database import (
+    get_guild_config_row, update_guild_config, listen, unit_of_work,
+    get_level_roles, set_level_role, remove_level_role,
+)
+
+# Canal de NOTIFY que emiten los triggers de guild_config y level_roles (migraciones 4 y 8)
+GUILD_CONFIG_CHANNEL = 'guild_config_changed'
+# Multiplicador de un rol de bonus guardado solo como id (sin multiplicador propio)
+BONUS_ROLE_MULTIPLIER = 1.5
+LISTEN_RETRY_SECONDS = 30
+# Espera tras un error cargando la configuración de un servidor antes de volver a consultarla
+LOAD_RETRY_SECONDS = 10
+
+
+def _json(value, default):
+    """asyncpg devuelve JSONB como texto si no hay codec registrado"""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return default
+    return value
+
+
+def _bonus_roles(value) -> dict:
+    """Acepta [id, ...], [{"role_id": id, "multiplier": x}, ...] o {"id": x}"""
+    value = _json(value, [])
+    if isinstance(value, dict):
+        return {int(role_id): float(multiplier) for role_id, multiplier in value.items()}
+
+    bonus = {}
+    for item in value:
+        if isinstance(item, dict):
+            bonus[int(item['role_id'])] = float(item.get('multiplier', BONUS_ROLE_MULTIPLIER))
+        else:
+            bonus[int(item)] = BONUS_ROLE_MULTIPLIER
+    return bonus
+
+
+@dataclass(frozen=True)
+class GuildLevelConfig:
+    """Foto inmutable de la configuración de niveles de un servidor"""
+    guild_id: int
+    exists: bool = False                 # False = el servidor no tiene fila en guild_config
+    level_up_channel: int = None
+    xp_per_message: int = 15
+    xp_cooldown: int = 60
+    enabled_channels: frozenset = frozenset()
+    disabled_channels: frozenset = frozenset()
+    xp_multiplier: float = 1.0
+    voice_xp_enabled: bool = False
+    voice_xp_rate: int = 5
+    bonus_roles: dict = field(default_factory=dict, hash=False)   # {role_id: multiplicador}
+    announce_level_up: bool = True
+    stack_roles: bool = False
+    custom_rewards: dict = field(default_factory=dict, hash=False)
+    level_roles: dict = field(default_factory=dict, hash=False)     # {nivel: role_id} (tabla level_roles)
+
+    @classmethod
+    def from_row(cls, guild_id: int, row, level_roles: dict = None) -> 'GuildLevelConfig':
+        level_roles = dict(level_roles or {})
+        if row is None:
+            return cls(guild_id, level_roles=level_roles)
+
+        defaults = cls(guild_id)
+        known = {f.name for f in fields(cls)}
+        values = {key: row[key] for key in row.keys() if key in known and row[key] is not None}
+        values.update(
+            exists=True,
+            enabled_channels=frozenset(int(c) for c in _json(row['enabled_channels'], [])),
+            disabled_channels=frozenset(int(c) for c in _json(row['disabled_channels'], [])),
+            bonus_roles=_bonus_roles(row['bonus_roles']),
+            custom_rewards=_json(row['custom_rewards'], {}),
+            xp_multiplier=float(row['xp_multiplier'] if row['xp_multiplier'] is not None else defaults.xp_multiplier),
+            level_roles=level_roles,
+        )
+        return replace(defaults, **values)
+
+    def channel_allowed(self, channel_id: int) -> bool:
+        """Filtros de canales: la lista de permitidos (si existe) y luego la de bloqueados"""
+        if self.enabled_channels and channel_id not in self.enabled_channels:
+            return False
+        return channel_id not in self.disabled_channels
+
+
+class GuildConfigCache:
+    """Configuración de niveles por servidor en memoria, invalidada con LISTEN/NOTIFY"""
+
+    def __init__(self):
+        self.configs = {}       # {guild_id: GuildLevelConfig}
+        self._loading = {}      # {guild_id: Task} cargas en curso
+        self._failed = {}       # {guild_id: instante (monotonic) a partir del que se reintenta la carga}
+        self._listener = None
+        self._retry_task = None
+
+        metrics.register_gauge('guild_config.cached', lambda: len(self.configs))
+
+    # ────────────── ciclo de vida ──────────────
+
+    async def start(self):
+        """Abre la conexión de LISTEN (las fotos se cargan bajo demanda)"""
+        try:
+            self._listener = await listen(GUILD_CONFIG_CHANNEL, self._on_notify, self._on_listener_lost)
+            print("🛰️ Escuchando cambios de configuración de servidores")
+        except Exception as e:
+            print(f"❌ Error escuchando cambios de configuración: {e}")
+            self._schedule_reconnect()
+
+    async def stop(self):
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+            self._retry_task = None
+        if self._listener is not None:
+            listener, self._listener = self._listener, None
+            try:
+                await listener.close()
+            except Exception:
+                pass
+
+    def _on_listener_lost(self, _connection):
+        # Sin notificaciones la caché podría quedar obsoleta: vaciarla y reconectar
+        if self._listener is None:
+            return
+        print("⚠️ Conexión de LISTEN perdida; se vacía la caché de configuración")
+        self._listener = None
+        self.configs.clear()
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if self._retry_task is None or self._retry_task.done():
+            self._retry_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        await asyncio.sleep(LISTEN_RETRY_SECONDS)
+        self._retry_task = None
+        await self.start()
+        # Lo cargado mientras no había LISTEN pudo cambiar sin aviso
+        self.configs.clear()
+
+    def _on_notify(self, _connection, _pid, _channel, payload: str):
+        try:
+            guild_id = int(payload)
+        except ValueError:
+            return
+        metrics.incr('guild_config.notify')
+        if guild_id in self.configs:
+            self._schedule_load(guild_id)
+
+    # ────────────── lectura ──────────────
+
+    def peek(self, guild_id: int):
+        """Foto en memoria o None (sin esperar a la base de datos); pensado para on_message"""
+        config = self.configs.get(guild_id)
+        if config is None and not self._backing_off(guild_id):
+            self._schedule_load(guild_id)
+        return config
+
+    async def get(self, guild_id: int) -> GuildLevelConfig:
+        """Foto de la configuración, cargándola si no está en memoria"""
+        config = self.configs.get(guild_id)
+        if config is not None:
+            metrics.incr('guild_config.hit')
+            return config
+        if self._backing_off(guild_id):
+            return GuildLevelConfig(guild_id)
+        return await self._schedule_load(guild_id)
+
+    def _backing_off(self, guild_id: int) -> bool:
+        """True si la última carga falló hace menos de LOAD_RETRY_SECONDS (no saturar una BD caída)"""
+        retry_at = self._failed.get(guild_id)
+        if retry_at is None:
+            return False
+        if time.monotonic() < retry_at:
+            return True
+        del self._failed[guild_id]
+        return False
+
+    def _schedule_load(self, guild_id: int) -> asyncio.Task:
+        task = self._loading.get(guild_id)
+        if task is None:
+            metrics.incr('guild_config.load')
+            task = self._loading[guild_id] = asyncio.create_task(self._load(guild_id))
+            task.add_done_callback(lambda _: self._loading.pop(guild_id, None))
+        return task
+
+    async def _load(self, guild_id: int) -> GuildLevelConfig:
+        try:
+            async with unit_of_work() as conn:
+                row = await get_guild_config_row(guild_id, conn=conn)
+                level_roles = await get_level_roles(guild_id, conn=conn)
+            config = GuildLevelConfig.from_row(guild_id, row, level_roles)
+        except Exception as e:
+            print(f"❌ Error cargando configuración del servidor {guild_id}: {e}")
+            metrics.incr('guild_config.load_error')
+            self._failed[guild_id] = time.monotonic() + LOAD_RETRY_SECONDS
+            return GuildLevelConfig(guild_id)
+        self._failed.pop(guild_id, None)
+        self.configs[guild_id] = config
+        return config
+
+    # ────────────── escritura ──────────────
+
+    async def update(self, guild_id: int, **changes) -> GuildLevelConfig:
+        """Aplica los cambios con un único UPDATE y sustituye la foto en memoria"""
+        row = await update_guild_config(guild_id, **changes)
+        current = await self.get(guild_id)
+        config = GuildLevelConfig.from_row(guild_id, row, current.level_roles)
+        self.configs[guild_id] = config
+        return config
+
+    async def set_level_role(self, guild_id: int, level: int, role_id: int) -> GuildLevelConfig:
+        """Asigna el rol de un nivel y sustituye la foto en memoria"""
+        await set_level_role(guild_id, level, role_id)
+        current = await self.get(guild_id)
+        config = replace(current, level_roles={**current.level_roles, level: role_id})
+        self.configs[guild_id] = config
+        return config
+
+    async def remove_level_role(self, guild_id: int, level: int) -> GuildLevelConfig:
+        """Quita el rol de un nivel y sustituye la foto en memoria"""
+        await remove_level_role(guild_id, level)
+        current = await self.get(guild_id)
+        level_roles = {lvl: role_id for lvl, role_id in current.level_roles.items() if lvl != level}
+        config = replace(current, level_roles=level_roles)
+        self.configs[guild_id] = config
+        return config
+
+    def invalidate(self, guild_id: int):
+        self.configs.pop(guild_id, None)
+
+
+# Instancia compartida por todos los cogs
+guild_configs = GuildConfigCache()
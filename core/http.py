@@ -0,0 +1,27 @@
+import os
+import aiohttp
+
+# Configuración del cliente HTTP compartido (variables de entorno opcionales)
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "20"))       # conexiones simultáneas máximas
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))           # segundos por petición
+
+_session = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Sesión HTTP compartida por todo el bot (reutiliza conexiones)"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT),
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+        )
+    return _session
+
+
+async def close_session():
+    """Cierra la sesión compartida (al apagar el bot)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
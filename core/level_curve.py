@@ -0,0 +1,80 @@
+from array import array
+from bisect import bisect_right
+
+# XP necesaria para pasar de cada nivel al siguiente (índice 0 = nivel 1). Fuente de verdad del sistema de niveles
+LEVEL_XP_TABLE = (
+    1000, 1050, 1100, 1150, 1200, 1250, 1300, 1355, 1405, 1455,
+    1505, 1555, 1605, 1660, 1710, 1760, 1810, 1860, 1910, 1960,
+    2010, 2060, 2110, 2160, 2210, 2260, 2310, 2360, 2410, 2460,
+    2510, 2560, 2610, 2660, 2710, 2760, 2810, 2860, 2910, 2960,
+    3010, 3060, 3110, 3160, 3210, 3275, 3325, 3375, 3425, 3475,
+    3525, 3575, 3625, 3675, 3725, 3775, 3825, 3875, 3925, 3975,
+    4025, 4075, 4125, 4175, 4225, 4275, 4325, 4375, 4425, 4475,
+    4525, 4575, 4625, 4675, 4725, 4775, 4825, 4875, 4925, 4975,
+    5025, 5075, 5125, 5175, 5225, 5275, 5325, 5375, 5425, 5475,
+    5525, 5575, 5625, 5675, 5725, 5775, 5825, 5875, 5925, 5975,
+    6025, 6075, 6125, 6175, 6225, 6275, 6325, 6375, 6425, 6475,
+    6525, 6575, 6625, 6675, 6725, 6775, 6825, 6875, 6925, 6975,
+    7025, 7075, 7125, 7175, 7225, 7275, 7325, 7375, 7425, 7475,
+    7525, 7575, 7625, 7675, 7725, 7775, 7825, 7875, 7925, 7975,
+    8025, 8075, 8125, 8175, 8225, 8275, 8325, 8375, 8425, 8475,
+    8525, 8575, 8625, 8675, 8725, 8775, 8825, 8875, 8925, 8975,
+    9025, 9075, 9125, 9175, 9225, 9275, 9325, 9375, 9425, 9475,
+    9525, 9575, 9625, 9675, 9725, 9775, 9825, 9875, 9925, 9975,
+    10025, 10075, 10125, 10175, 10225, 10275, 10325, 10375, 10425, 10475,
+    10525, 10575, 10625, 10675, 10725, 10775, 10825, 10875, 10925, 11675,
+)
+
+class LevelCurve:
+    """Curva de niveles precalculada: umbrales acumulados en un array y búsquedas por bisección"""
+
+    def __init__(self, xp_per_level):
+        self.xp_per_level = array('q', xp_per_level)
+        self.max_level = len(self.xp_per_level)
+
+        # thresholds[i] = XP total para alcanzar el nivel i + 1 (nivel 1 = 0)
+        self.thresholds = array('q', [0] * self.max_level)
+        total = 0
+        for index in range(1, self.max_level):
+            total += self.xp_per_level[index - 1]
+            self.thresholds[index] = total
+
+    def level_for(self, total_xp: int) -> int:
+        """Nivel alcanzado con esa XP total (O(log n))"""
+        return max(1, bisect_right(self.thresholds, total_xp))
+
+    def progress(self, total_xp: int) -> tuple:
+        """(nivel, XP dentro del nivel, XP necesaria para el siguiente)"""
+        level = self.level_for(total_xp)
+        return level, total_xp - self.thresholds[level - 1], self.xp_per_level[level - 1]
+
+    def total_for_level(self, level: int) -> int:
+        """XP total necesaria para alcanzar `level`"""
+        level = min(max(1, level), self.max_level)
+        return self.thresholds[level - 1]
+
+    def levels_for(self, xps) -> list:
+        """Niveles de muchas XP a la vez (leaderboards, recálculos): se ordenan y se recorre la curva una vez"""
+        xps = list(xps)
+        levels = [1] * len(xps)
+        level = 1
+        for index in sorted(range(len(xps)), key=xps.__getitem__):
+            while level < self.max_level and self.thresholds[level] <= xps[index]:
+                level += 1
+            levels[index] = level
+        return levels
+
+    def threshold_list(self) -> list:
+        """Umbrales como lista de enteros (parámetro bigint[] de las consultas SQL)"""
+        return self.thresholds.tolist()
+
+
+_curve = None
+
+
+def get_curve() -> LevelCurve:
+    """Curva compartida por todos los servidores (LEVEL_XP_TABLE)"""
+    global _curve
+    if _curve is None:
+        _curve = LevelCurve(LEVEL_XP_TABLE)
+    return _curve
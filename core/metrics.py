@@ -0,0 +1,103 @@
+import time
+
+# Cubetas (en milisegundos) de los histogramas de duración
+DEFAULT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_histograms = {}
+_counters = {}
+_gauges = {}
+
+
+class Histogram:
+    """Histograma de valores (normalmente duraciones en ms) con cubetas fijas"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.buckets = [0] * (len(self.bounds) + 1)  # la última cubeta es "+inf"
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        """Registra un valor"""
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, q: float) -> float:
+        """Percentil aproximado (límite superior de la cubeta que lo contiene)"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index, amount in enumerate(self.buckets):
+            seen += amount
+            if seen >= target:
+                return float(self.bounds[index]) if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'avg': round(self.total / self.count, 2) if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': round(self.max, 2),
+        }
+
+
+class timer:
+    """Context manager que registra en un histograma la duración del bloque en ms"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        histogram(self.name).observe((time.perf_counter() - self.start) * 1000)
+        return False
+
+
+def histogram(name: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+    """Obtiene (o crea) el histograma con ese nombre"""
+    hist = _histograms.get(name)
+    if hist is None:
+        hist = _histograms[name] = Histogram(buckets)
+    return hist
+
+
+def incr(name: str, amount: int = 1):
+    """Incrementa un contador"""
+    _counters[name] = _counters.get(name, 0) + amount
+
+
+def register_gauge(name: str, func):
+    """Registra una función sin argumentos que devuelve el valor actual de un indicador"""
+    _gauges[name] = func
+
+
+def snapshot() -> dict:
+    """Foto de todas las métricas (serializable a JSON)"""
+    gauges = {}
+    for name, func in _gauges.items():
+        try:
+            gauges[name] = func()
+        except Exception as e:
+            gauges[name] = f"error: {e}"
+
+    return {
+        'histograms': {name: hist.snapshot() for name, hist in sorted(_histograms.items())},
+        'counters': dict(sorted(_counters.items())),
+        'gauges': gauges,
+    }
@@ -0,0 +1,440 @@
+import asyncpg
+
+# Candado consultivo para que dos instancias del bot no migren a la vez
+MIGRATIONS_LOCK_ID = 720_611_014
+
+
+class Migration:
+    """Cambio de esquema numerado.
+
+    `statements` se ejecutan dentro de una transacción junto con el registro en
+    `schema_version`. `indexes` ({nombre: definición}) se crean con CONCURRENTLY,
+    que no admite transacciones, así que la migración no debe mezclar ambos.
+    """
+
+    def __init__(self, version: int, description: str, statements=(), indexes=None, drop_indexes=()):
+        self.version = version
+        self.description = description
+        self.statements = tuple(statements)
+        self.indexes = dict(indexes or {})
+        self.drop_indexes = tuple(drop_indexes)
+
+    @property
+    def concurrent(self) -> bool:
+        return bool(self.indexes or self.drop_indexes)
+
+
+MIGRATIONS = [
+    Migration(1, "esquema inicial", [
+        # Tabla de bumps (sistema de bump tracker)
+        """
+        CREATE TABLE IF NOT EXISTS bumps (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            guild_id BIGINT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, guild_id)
+        )
+        """,
+        # Tabla de conteo de bumps
+        """
+        CREATE TABLE IF NOT EXISTS bump_counts (
+            user_id BIGINT NOT NULL,
+            guild_id BIGINT NOT NULL,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, guild_id)
+        )
+        """,
+        # Tabla de usuarios del sistema económico
+        """
+        CREATE TABLE IF NOT EXISTS usuarios (
+            user_id BIGINT PRIMARY KEY,
+            saldo DECIMAL(10,2) DEFAULT 0.00,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Tabla de productos en la tienda
+        """
+        CREATE TABLE IF NOT EXISTS productos (
+            id SERIAL PRIMARY KEY,
+            nombre TEXT UNIQUE NOT NULL,
+            precio DECIMAL(10,2) NOT NULL,
+            cantidad INTEGER NOT NULL,
+            role_id BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Tabla de inventario de usuarios
+        """
+        CREATE TABLE IF NOT EXISTS inventario (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            producto_nombre TEXT NOT NULL,
+            cantidad INTEGER DEFAULT 1,
+            precio_compra DECIMAL(10,2),
+            fecha_compra TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES usuarios (user_id)
+        )
+        """,
+        # Tabla de transacciones (historial económico)
+        """
+        CREATE TABLE IF NOT EXISTS transacciones (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            tipo TEXT NOT NULL,
+            monto DECIMAL(10,2),
+            descripcion TEXT,
+            ejecutado_por BIGINT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES usuarios (user_id)
+        )
+        """,
+        # Tabla principal de invitaciones
+        """
+        CREATE TABLE IF NOT EXISTS invites (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            invited_by_id BIGINT NOT NULL,
+            guild_id BIGINT NOT NULL,
+            invite_code TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE
+        )
+        """,
+        # === TABLAS DEL SISTEMA DE NIVELES ===
+        """
+        CREATE TABLE IF NOT EXISTS levels_users (
+            user_id BIGINT NOT NULL,
+            guild_id BIGINT NOT NULL,
+            xp BIGINT DEFAULT 0,
+            level INTEGER DEFAULT 1,
+            last_xp_time BIGINT DEFAULT 0,
+            total_messages INTEGER DEFAULT 0,
+            -- columnas nuevas para leaderboards
+            weekly_xp BIGINT DEFAULT 0,
+            monthly_xp BIGINT DEFAULT 0,
+            weekly_reset TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            monthly_reset TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            badges JSONB DEFAULT '[]'::jsonb,
+            join_date BIGINT DEFAULT 0,
+            voice_time INTEGER DEFAULT 0,
+            -- período (AAAASS / AAAAMM) al que pertenecen weekly_xp / monthly_xp
+            weekly_period INTEGER DEFAULT 0,
+            monthly_period INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, guild_id)
+        )
+        """,
+        # Columnas de período para tablas creadas antes de existir (sin DEFAULT para rellenarlas abajo)
+        'ALTER TABLE levels_users ADD COLUMN IF NOT EXISTS weekly_period INTEGER',
+        'ALTER TABLE levels_users ADD COLUMN IF NOT EXISTS monthly_period INTEGER',
+        # Rellenar los períodos de filas antiguas a partir de sus fechas de reset (solo filas sin período)
+        """
+        UPDATE levels_users SET
+            weekly_period = COALESCE(weekly_period, COALESCE(
+                (EXTRACT(ISOYEAR FROM weekly_reset) * 100 + EXTRACT(WEEK FROM weekly_reset))::int, 0)),
+            monthly_period = COALESCE(monthly_period, COALESCE(
+                (EXTRACT(YEAR FROM monthly_reset) * 100 + EXTRACT(MONTH FROM monthly_reset))::int, 0))
+        WHERE weekly_period IS NULL OR monthly_period IS NULL
+        """,
+        # Tabla de configuración de roles por nivel
+        """
+        CREATE TABLE IF NOT EXISTS level_roles (
+            guild_id BIGINT NOT NULL,
+            level INTEGER NOT NULL,
+            role_id BIGINT NOT NULL,
+            PRIMARY KEY (guild_id, level)
+        )
+        """,
+        # Tabla de configuración del servidor para niveles
+        """
+        CREATE TABLE IF NOT EXISTS guild_config (
+            guild_id BIGINT PRIMARY KEY,
+            level_up_channel BIGINT,
+            xp_per_message INTEGER DEFAULT 15,
+            xp_cooldown INTEGER DEFAULT 60,
+            enabled_channels JSONB DEFAULT '[]'::jsonb,
+            disabled_channels JSONB DEFAULT '[]'::jsonb,
+            xp_multiplier DECIMAL(3,1) DEFAULT 1.0,
+            level_formula TEXT DEFAULT 'exponential',
+            voice_xp_enabled BOOLEAN DEFAULT FALSE,
+            voice_xp_rate INTEGER DEFAULT 5,
+            bonus_roles JSONB DEFAULT '[]'::jsonb,
+            announce_level_up BOOLEAN DEFAULT TRUE,
+            stack_roles BOOLEAN DEFAULT FALSE,
+            custom_rewards JSONB DEFAULT '{}'::jsonb
+        )
+        """,
+        # Tabla de insignias
+        """
+        CREATE TABLE IF NOT EXISTS badges (
+            badge_id TEXT PRIMARY KEY,
+            name TEXT,
+            description TEXT,
+            emoji TEXT,
+            requirement_type TEXT,
+            requirement_value INTEGER,
+            rarity TEXT DEFAULT 'common',
+            hidden BOOLEAN DEFAULT FALSE
+        )
+        """,
+        # Tabla de recompensas personalizadas
+        """
+        CREATE TABLE IF NOT EXISTS custom_rewards (
+            guild_id BIGINT NOT NULL,
+            level INTEGER NOT NULL,
+            reward_type TEXT NOT NULL,
+            reward_data TEXT,
+            PRIMARY KEY (guild_id, level, reward_type)
+        )
+        """,
+        # Tabla de sesiones de voz
+        """
+        CREATE TABLE IF NOT EXISTS voice_sessions (
+            user_id BIGINT NOT NULL,
+            guild_id BIGINT NOT NULL,
+            join_time BIGINT NOT NULL,
+            leave_time BIGINT DEFAULT 0,
+            xp_earned INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, guild_id, join_time)
+        )
+        """,
+        # === TABLAS DEL SISTEMA DE PARTNERS ===
+        """
+        CREATE TABLE IF NOT EXISTS partners (
+            id SERIAL PRIMARY KEY,
+            author_id BIGINT NOT NULL,
+            author_name TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS partner_config (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+        """,
+        # Inicializar contador si no existe
+        """
+        INSERT INTO partner_config (key, value)
+        VALUES ('partner_count', 0)
+        ON CONFLICT (key) DO NOTHING
+        """,
+        # === TABLAS DEL SISTEMA DE TICKETS (antes en tickets.db) ===
+        """
+        CREATE TABLE IF NOT EXISTS tickets (
+            id SERIAL PRIMARY KEY,
+            channel_id BIGINT UNIQUE NOT NULL,
+            user_id BIGINT NOT NULL,
+            category TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            closed_at TIMESTAMP,
+            claimed_by BIGINT,
+            closed_by BIGINT,
+            status TEXT DEFAULT 'abierto',
+            priority TEXT DEFAULT 'normal'
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ticket_messages (
+            id SERIAL PRIMARY KEY,
+            ticket_id INTEGER REFERENCES tickets(id),
+            user_id BIGINT,
+            message_content TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # === PLANIFICADOR DE TAREAS (recordatorios, sorteos, expiraciones) ===
+        """
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            job_key TEXT,
+            run_at BIGINT NOT NULL,
+            payload JSONB DEFAULT '{}'::jsonb,
+            attempts INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (name, job_key)
+        )
+        """,
+    ]),
+
+    Migration(2, "índices iniciales", indexes={
+        # Invitaciones
+        'idx_invites_user_id': 'invites(user_id)',
+        'idx_invites_invited_by_id': 'invites(invited_by_id)',
+        'idx_invites_guild_id': 'invites(guild_id)',
+        'idx_invites_active': 'invites(guild_id, is_active)',
+        # Niveles (leaderboards semanal/mensual: índices parciales por período)
+        'idx_levels_users_xp': 'levels_users(guild_id, xp DESC)',
+        'idx_levels_users_level': 'levels_users(guild_id, level DESC)',
+        'idx_levels_users_weekly_period': 'levels_users(guild_id, weekly_period, weekly_xp DESC, user_id) WHERE weekly_xp > 0',
+        'idx_levels_users_monthly_period': 'levels_users(guild_id, monthly_period, monthly_xp DESC, user_id) WHERE monthly_xp > 0',
+        # Partners
+        'idx_partners_author_id': 'partners(author_id)',
+        'idx_partners_created_at': 'partners(created_at DESC)',
+        # Tickets
+        'idx_tickets_user_status': 'tickets(user_id, status)',
+        'idx_tickets_open': "tickets(created_at DESC) WHERE status = 'abierto'",
+        'idx_tickets_claimed_by': 'tickets(claimed_by) WHERE claimed_by IS NOT NULL',
+    }, drop_indexes=[
+        # Reemplazados por los índices por período
+        'idx_levels_users_weekly',
+        'idx_levels_users_monthly',
+    ]),
+
+    Migration(3, "índice de temporizadores por fecha", indexes={
+        'idx_scheduled_jobs_run_at': 'scheduled_jobs(run_at)',
+    }),
+
+    Migration(4, "NOTIFY al cambiar guild_config", [
+        """
+        CREATE OR REPLACE FUNCTION notify_guild_config_change() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('guild_config_changed', OLD.guild_id::text);
+            ELSE
+                PERFORM pg_notify('guild_config_changed', NEW.guild_id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        'DROP TRIGGER IF EXISTS guild_config_changed ON guild_config',
+        """
+        CREATE TRIGGER guild_config_changed
+        AFTER INSERT OR UPDATE OR DELETE ON guild_config
+        FOR EACH ROW EXECUTE PROCEDURE notify_guild_config_change()
+        """,
+    ]),
+
+    Migration(5, "multiplicadores de XP por rol", [
+        """
+        CREATE TABLE IF NOT EXISTS xp_multipliers (
+            role_id BIGINT PRIMARY KEY,
+            guild_id BIGINT,
+            multiplier REAL NOT NULL,
+            expires_at BIGINT NOT NULL
+        )
+        """,
+        # Los multiplicadores antes vivían como temporizadores del planificador
+        """
+        INSERT INTO xp_multipliers (role_id, multiplier, expires_at)
+        SELECT (payload->>'role_id')::bigint, (payload->>'multiplier')::real, run_at
+        FROM scheduled_jobs WHERE name = 'xp_multiplier_expiry'
+        ON CONFLICT (role_id) DO NOTHING
+        """,
+        "DELETE FROM scheduled_jobs WHERE name = 'xp_multiplier_expiry'",
+    ]),
+
+    Migration(6, "última actividad de las sesiones de voz", [
+        'ALTER TABLE voice_sessions ADD COLUMN IF NOT EXISTS last_seen BIGINT DEFAULT 0',
+    ]),
+
+    Migration(7, "índice de sesiones de voz abiertas", indexes={
+        'idx_voice_sessions_open': 'voice_sessions(guild_id, user_id) WHERE leave_time = 0',
+    }),
+
+    # Los roles por nivel forman parte de la foto de configuración: mismo canal de NOTIFY
+    Migration(8, "NOTIFY al cambiar level_roles", [
+        'DROP TRIGGER IF EXISTS level_roles_changed ON level_roles',
+        """
+        CREATE TRIGGER level_roles_changed
+        AFTER INSERT OR UPDATE OR DELETE ON level_roles
+        FOR EACH ROW EXECUTE PROCEDURE notify_guild_config_change()
+        """,
+    ]),
+
+    # Todos los servidores usan la curva de la tabla (core.level_curve); las filas
+    # existentes conservan su valor, que el bot ya no lee
+    Migration(9, "curva de niveles 'table' por defecto", [
+        "ALTER TABLE guild_config ALTER COLUMN level_formula SET DEFAULT 'table'",
+    ]),
+
+    # Pagos de sorteos: uno por sorteo aunque el temporizador se ejecute más de una vez
+    Migration(10, "pagos de sorteos", [
+        """
+        CREATE TABLE IF NOT EXISTS raffle_payouts (
+            raffle_id TEXT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            amount DECIMAL(10,2) NOT NULL,
+            paid_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+]
+
+
+async def _current_version(conn) -> int:
+    try:
+        return await conn.fetchval('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    except asyncpg.UndefinedTableError:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        return 0
+
+
+async def _apply_concurrent(conn, migration: Migration):
+    for name in migration.drop_indexes:
+        await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+    for name, definition in migration.indexes.items():
+        # Un CREATE INDEX CONCURRENTLY interrumpido deja el índice inválido: borrarlo y repetir
+        invalid = await conn.fetchval("""
+            SELECT NOT i.indisvalid FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = $1
+        """, name)
+        if invalid:
+            await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+        await conn.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}')
+
+    await conn.execute(
+        'INSERT INTO schema_version (version, description) VALUES ($1, $2)',
+        migration.version, migration.description
+    )
+
+
+async def _apply(conn, migration: Migration):
+    if migration.concurrent:
+        await _apply_concurrent(conn, migration)
+        return
+
+    async with conn.transaction():
+        for statement in migration.statements:
+            await conn.execute(statement)
+        await conn.execute(
+            'INSERT INTO schema_version (version, description) VALUES ($1, $2)',
+            migration.version, migration.description
+        )
+
+
+async def run_migrations(conn) -> int:
+    """Aplica las migraciones pendientes y devuelve la versión final del esquema.
+
+    En un arranque sin cambios solo se hace una consulta (la versión actual).
+    """
+    latest = MIGRATIONS[-1].version
+    version = await _current_version(conn)
+    if version >= latest:
+        return version
+
+    await conn.execute('SELECT pg_advisory_lock($1)', MIGRATIONS_LOCK_ID)
+    try:
+        # Otra instancia pudo migrar mientras esperábamos el candado
+        version = await _current_version(conn)
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            print(f"🧱 Aplicando migración {migration.version}: {migration.description}")
+            await _apply(conn, migration)
+            version = migration.version
+    finally:
+        await conn.execute('SELECT pg_advisory_unlock($1)', MIGRATIONS_LOCK_ID)
+
+    return version
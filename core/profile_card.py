@@ -0,0 +1,153 @@
+"""Dibujo de la tarjeta de perfil (se ejecuta en los procesos del pool de renderizado)"""
+import io
+from PIL import Image, ImageDraw
+from core.assets import assets
+
+# Subir al cambiar el diseño para que la caché de tarjetas no sirva imágenes antiguas
+CARD_TEMPLATE_VERSION = 1
+
+CARD_WIDTH, CARD_HEIGHT = 820, 950
+AVATAR_SIZE = 220
+
+# Tamaño que se pide al CDN de Discord (potencia de 2 inmediatamente superior)
+PROFILE_AVATAR_SIZE = 256
+
+BACKGROUND_PATH = "resources/images/perfil/perfil.png"
+
+# Colores exactos de la imagen
+CYAN_BRIGHT = (0, 255, 255)   # Cyan brillante
+DARKER_BLUE = (10, 20, 35)    # Azul muy oscuro para la barra
+WHITE_TEXT = (255, 255, 255)  # Texto blanco
+
+
+def load_avatar(avatar_bytes) -> Image.Image:
+    """Abre el avatar descargado (o uno gris por defecto)"""
+    if avatar_bytes:
+        try:
+            return Image.open(io.BytesIO(avatar_bytes)).convert('RGBA')
+        except Exception:
+            pass
+    return Image.new('RGBA', (128, 128), (100, 100, 100, 255))
+
+
+def create_circle_avatar(avatar_img: Image.Image, size: int) -> Image.Image:
+    """Convierte el avatar en circular"""
+    avatar_img = avatar_img.resize((size, size), Image.Resampling.LANCZOS)
+
+    # Crear máscara circular
+    mask = Image.new('L', (size, size), 0)
+    ImageDraw.Draw(mask).ellipse((0, 0, size, size), fill=255)
+
+    # Aplicar máscara
+    result = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+    result.paste(avatar_img, (0, 0))
+    result.putalpha(mask)
+    return result
+
+
+def draw_progress_bar(draw, x: int, y: int, width: int, height: int,
+                      progress: float, bg_color: tuple, fill_color: tuple, radius: int = 15):
+    """Dibuja una barra de progreso con el estilo de la imagen"""
+    draw.rounded_rectangle([(x, y), (x + width, y + height)], radius=radius, fill=bg_color)
+
+    if progress > 0:
+        progress_width = int(width * progress)
+        if progress_width > radius * 2:
+            draw.rounded_rectangle([(x, y), (x + progress_width, y + height)], radius=radius, fill=fill_color)
+
+
+def load_background(path: str = BACKGROUND_PATH) -> Image.Image:
+    """Fondo de la tarjeta ya escalado (o azul oscuro si no existe)"""
+    try:
+        return assets.get_template(path, size=(CARD_WIDTH, CARD_HEIGHT))
+    except Exception as e:
+        print(f"No se pudo cargar la imagen de fondo: {e}")
+        return Image.new('RGBA', (CARD_WIDTH, CARD_HEIGHT), (20, 35, 60, 255))
+
+
+def render_profile_card(spec: dict) -> bytes:
+    """Dibuja la tarjeta de perfil y la devuelve codificada en PNG.
+
+    `spec` solo contiene datos serializables: avatar (bytes o None), username,
+    level, current_xp, next_level_xp, balance, rank y role_text.
+    """
+    width = CARD_WIDTH
+    background = load_background()
+    draw = ImageDraw.Draw(background)
+
+    # Avatar en la parte superior
+    avatar_size = AVATAR_SIZE
+    avatar_circular = create_circle_avatar(load_avatar(spec.get('avatar')), avatar_size)
+    avatar_x = (width - avatar_size) - 542
+    avatar_y = 49
+
+    # Borde cyan alrededor del avatar
+    draw.ellipse(
+        [(avatar_x - 5, avatar_y - 5), (avatar_x + avatar_size + 5, avatar_y + avatar_size + 5)],
+        outline=CYAN_BRIGHT,
+        width=0
+    )
+    background.paste(avatar_circular, (avatar_x, avatar_y), avatar_circular)
+
+    font_huge = assets.get_font(54, bold=True)    # Para el nombre
+    font_medium = assets.get_font(60, bold=True)  # Para dinero y rank
+    font_small = assets.get_font(20)              # Para detalles
+    font_role = assets.get_font(45, bold=True)    # Para nivel y rol de rango
+
+    # === INFORMACIÓN DEL USUARIO ===
+    info_y = avatar_y + 40
+
+    username = spec['username']
+    if len(username) > 15:
+        username = username[:12] + "..."
+    bbox = draw.textbbox((0, 0), username, font=font_huge)
+    username_x = (width - (bbox[2] - bbox[0])) - 190
+    draw.text((username_x, info_y + 10), username, font=font_huge, fill=CYAN_BRIGHT)
+
+    level_text = f"{spec['level']}"
+    bbox = draw.textbbox((0, 0), level_text, font=font_role)
+    level_x = (width - (bbox[2] - bbox[0])) - 93
+    level_y = info_y + 112
+    draw.text((level_x, level_y), level_text, font=font_role, fill=CYAN_BRIGHT)
+
+    # Rol de rango a la misma altura del nivel pero 295px más a la izquierda
+    role_text = spec['role_text']
+    if len(role_text) > 12:
+        role_text = role_text[:9] + "..."
+    draw.text((level_x - 295, level_y - 2), role_text, font=font_role, fill=CYAN_BRIGHT)
+
+    # === BARRA DE PROGRESO ===
+    progress_y = info_y + 240
+    current_xp, next_level_xp = spec['current_xp'], spec['next_level_xp']
+    progress = current_xp / next_level_xp if next_level_xp > 0 else 1.0
+
+    bar_width = width - 119
+    bar_height = 46
+    bar_x = 57
+    draw_progress_bar(
+        draw, bar_x, progress_y, bar_width, bar_height, progress,
+        bg_color=DARKER_BLUE,
+        fill_color=CYAN_BRIGHT,
+        radius=18
+    )
+
+    exp_label_y = progress_y + bar_height + 15
+    draw.text((bar_x, exp_label_y), "EXP", font=font_small, fill=WHITE_TEXT)
+    draw.text((bar_x + 60, exp_label_y), f"{current_xp}/{next_level_xp}", font=font_small, fill=WHITE_TEXT)
+
+    # === DINERO Y RANK ===
+    money_y = progress_y + bar_height + 367
+
+    money_text = f"{spec['balance']:.2f}"
+    bbox = draw.textbbox((0, 0), money_text, font=font_medium)
+    money_x = (width - (bbox[2] - bbox[0])) - 428
+    draw.text((money_x, money_y), money_text, font=font_medium, fill=CYAN_BRIGHT)
+
+    rank_text = f"#{spec['rank']}"
+    bbox = draw.textbbox((0, 0), rank_text, font=font_medium)
+    rank_x = (width - (bbox[2] - bbox[0])) - 150
+    draw.text((rank_x, money_y + 35), rank_text, font=font_medium, fill=CYAN_BRIGHT)
+
+    buffer = io.BytesIO()
+    background.save(buffer, format='PNG')
+    return buffer.getvalue()
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from core import metrics
+
+# Configuración del pool de renderizado (variables de entorno opcionales)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))          # procesos que dibujan imágenes
+RENDER_MAX_QUEUE = int(os.getenv("RENDER_MAX_QUEUE", "8"))      # trabajos en espera antes de rechazar
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "15"))       # segundos máximos por imagen
+
+
+class RenderBusy(Exception):
+    """El pool de renderizado está saturado; hay que responder 'ocupado' al usuario"""
+
+
+class RenderPool:
+    """Ejecuta funciones de dibujo (Pillow) en procesos separados para no bloquear el event loop"""
+
+    def __init__(self, workers: int = RENDER_WORKERS, max_queue: int = RENDER_MAX_QUEUE,
+                 timeout: float = RENDER_TIMEOUT):
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, max_queue)
+        self.timeout = timeout
+        self.in_flight = 0
+        self._executor = None
+
+        metrics.register_gauge('render.in_flight', lambda: self.in_flight)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _release(self, _future):
+        self.in_flight -= 1
+
+    async def render(self, name: str, func, *args) -> bytes:
+        """Ejecuta `func(*args)` en el pool y devuelve su resultado.
+
+        `func` debe ser una función de módulo y los argumentos serializables.
+        Lanza RenderBusy si la cola está llena y asyncio.TimeoutError si tarda demasiado.
+        """
+        if self.in_flight >= self.capacity:
+            metrics.incr(f'render.{name}.busy')
+            raise RenderBusy()
+
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        future = loop.run_in_executor(self._get_executor(), func, *args)
+
+        # El hueco se libera cuando el proceso termina de verdad (aunque haya expirado el timeout)
+        self.in_flight += 1
+        future.add_done_callback(self._release)
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            metrics.incr(f'render.{name}.timeout')
+            raise
+        except Exception:
+            metrics.incr(f'render.{name}.error')
+            raise
+
+        metrics.histogram(f'render.{name}').observe((time.perf_counter() - start) * 1000)
+        return result
+
+    def shutdown(self):
+        """Cierra los procesos del pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_render_pool = None
+
+
+def get_render_pool() -> RenderPool:
+    """Pool de renderizado compartido por todos los cogs"""
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = RenderPool()
+    return _render_pool
+
+
+def shutdown_render_pool():
+    """Cierra el pool compartido (al apagar el bot)"""
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown()
+        _render_pool = None
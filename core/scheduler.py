@@ -0,0 +1,182 @@
+import asyncio
+import heapq
+import os
+import time
+from core import metrics
+from database import (
+    save_scheduled_job,
+    delete_scheduled_job,
+    cancel_scheduled_job,
+    retry_scheduled_job,
+    get_scheduled_jobs
+)
+
+# Configuración del planificador (variables de entorno opcionales)
+SCHEDULER_MAX_ATTEMPTS = int(os.getenv("SCHEDULER_MAX_ATTEMPTS", "5"))        # reintentos antes de descartar
+SCHEDULER_RETRY_SECONDS = int(os.getenv("SCHEDULER_RETRY_SECONDS", "60"))     # espera base entre reintentos
+SCHEDULER_NO_HANDLER_DELAY = 5   # segundos a esperar si el cog del temporizador aún no está cargado
+
+
+class ScheduledJob:
+    __slots__ = ('id', 'name', 'key', 'run_at', 'payload', 'attempts')
+
+    def __init__(self, job_id: int, name: str, key, run_at: int, payload: dict, attempts: int = 0):
+        self.id = job_id
+        self.name = name
+        self.key = key
+        self.run_at = run_at
+        self.payload = payload
+        self.attempts = attempts
+
+
+class Scheduler:
+    """Temporizadores persistentes en PostgreSQL con un único heap en memoria.
+
+    Los cogs registran un handler por nombre (`register`) y programan trabajos con
+    `schedule`. Un trabajo solo se borra de la base de datos cuando su handler
+    termina sin error, así que tras un reinicio se vuelve a ejecutar (al menos una vez).
+    """
+
+    def __init__(self):
+        self.handlers = {}     # {nombre: coroutine function(payload)}
+        self.jobs = {}         # {id: ScheduledJob}
+        self.heap = []         # [(run_at, id)] (las entradas obsoletas se ignoran al sacarlas)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = set()
+
+        metrics.register_gauge('scheduler.pending', lambda: len(self.jobs))
+
+    # ────────────── registro de handlers ──────────────
+
+    def register(self, name: str, handler):
+        """Asocia un handler a un tipo de trabajo (normalmente desde el __init__ de un cog)"""
+        self.handlers[name] = handler
+        self._wakeup.set()
+
+    def unregister(self, name: str):
+        """Quita el handler (cog_unload); sus trabajos esperan a que se vuelva a registrar"""
+        self.handlers.pop(name, None)
+
+    # ────────────── ciclo de vida ──────────────
+
+    async def start(self):
+        """Carga los trabajos pendientes de la base de datos e inicia el bucle"""
+        if self._task is not None and not self._task.done():
+            return
+        for job_id, name, key, run_at, payload, attempts in await get_scheduled_jobs():
+            self._push(ScheduledJob(job_id, name, key, run_at, payload, attempts))
+        print(f"⏰ Planificador iniciado con {len(self.jobs)} temporizadores pendientes")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detiene el bucle (los trabajos siguen guardados en la base de datos)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # ────────────── API para los cogs ──────────────
+
+    async def schedule(self, name: str, delay: float, payload: dict = None, key: str = None) -> int:
+        """Programa `name` dentro de `delay` segundos. Con `key`, reemplaza el trabajo anterior con esa clave"""
+        run_at = int(time.time() + delay)
+        payload = payload or {}
+        job_id = await save_scheduled_job(name, run_at, payload, key)
+        self._push(ScheduledJob(job_id, name, key, run_at, payload))
+        return job_id
+
+    async def cancel(self, name: str, key: str) -> bool:
+        """Cancela el trabajo `name` con clave `key`"""
+        job_id = await cancel_scheduled_job(name, key)
+        if job_id is None:
+            return False
+        self.jobs.pop(job_id, None)
+        return True
+
+    def pending(self, name: str) -> list:
+        """Trabajos pendientes de un tipo, ordenados por fecha de ejecución"""
+        return sorted((job for job in self.jobs.values() if job.name == name), key=lambda job: job.run_at)
+
+    # ────────────── bucle interno ──────────────
+
+    def _push(self, job: ScheduledJob):
+        self.jobs[job.id] = job
+        heapq.heappush(self.heap, (job.run_at, job.id))
+        self._wakeup.set()
+
+    def _pop_due(self, now: float) -> list:
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            run_at, job_id = heapq.heappop(self.heap)
+            job = self.jobs.get(job_id)
+            # Entrada obsoleta: el trabajo se canceló, se reprogramó o ya está en la lista
+            if job is None or job.run_at != run_at or job in due:
+                continue
+            due.append(job)
+        return due
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            for job in self._pop_due(now):
+                task = asyncio.create_task(self._fire(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, job: ScheduledJob):
+        handler = self.handlers.get(job.name)
+        if handler is None:
+            # El cog aún no está cargado (arranque o !reload): reintentar en unos segundos
+            job.run_at = int(time.time() + SCHEDULER_NO_HANDLER_DELAY)
+            self._push(job)
+            return
+
+        try:
+            with metrics.timer(f'scheduler.{job.name}'):
+                await handler(job.payload)
+        except Exception as e:
+            print(f"❌ Error ejecutando temporizador {job.name} ({job.id}): {e}")
+            metrics.incr(f'scheduler.{job.name}.error')
+            await self._retry(job)
+            return
+
+        # Si se reprogramó con la misma clave mientras se ejecutaba, conservar el nuevo
+        if self.jobs.get(job.id) is job:
+            self.jobs.pop(job.id, None)
+            try:
+                await delete_scheduled_job(job.id)
+            except Exception as e:
+                print(f"❌ Error borrando temporizador {job.name} ({job.id}): {e}")
+
+    async def _retry(self, job: ScheduledJob):
+        if self.jobs.get(job.id) is not job:
+            return
+        job.attempts += 1
+        try:
+            if job.attempts >= SCHEDULER_MAX_ATTEMPTS:
+                print(f"⚠️ Temporizador {job.name} ({job.id}) descartado tras {job.attempts} intentos")
+                self.jobs.pop(job.id, None)
+                await delete_scheduled_job(job.id)
+                return
+
+            # Espera creciente entre reintentos
+            job.run_at = int(time.time() + SCHEDULER_RETRY_SECONDS * 2 ** (job.attempts - 1))
+            self._push(job)
+            await retry_scheduled_job(job.id, job.run_at)
+        except Exception as e:
+            print(f"❌ Error reprogramando temporizador {job.name} ({job.id}): {e}")
+
+
+# Instancia compartida por todos los cogs
+scheduler = Scheduler()
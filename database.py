@@ -2,236 +2,77 @@ import os
 import asyncpg
 import asyncio
 import json
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from decimal import Decimal, ROUND_HALF_UP
+from core.db_metrics import InstrumentedPool, instrument, current_function
+from core.migrations import run_migrations
 
 DB_URL = os.getenv("DATABASE_URL")
 
+# Configuración del pool de conexiones (variables de entorno opcionales)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_MAX_INACTIVE = float(os.getenv("DB_POOL_MAX_INACTIVE", "300"))     # segundos antes de cerrar una conexión ociosa
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))          # segundos máximos por consulta
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "10"))          # segundos esperando una conexión libre
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))  # 0 si hay PgBouncer en modo transacción
+DB_INIT_SQL = os.getenv("DB_INIT_SQL", "")                                 # SQL a ejecutar en cada conexión nueva
+
 pool = None
 
+async def _init_connection(conn):
+    """Se ejecuta una vez por cada conexión que abre el pool"""
+    if DB_INIT_SQL:
+        await conn.execute(DB_INIT_SQL)
+
 async def create_pool():
-    return await asyncpg.create_pool(DB_URL, ssl="require")
+    return await asyncpg.create_pool(
+        DB_URL,
+        ssl="require",
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        server_settings={'application_name': 'discord-bot'},
+        init=_init_connection
+    )
 
 async def connect_db():
     global pool
-    pool = await create_pool()
+    pool = InstrumentedPool(await create_pool(), acquire_timeout=DB_ACQUIRE_TIMEOUT)
+    print(f"🗄️ Pool de base de datos: {DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} conexiones")
     
+    # Esquema versionado: en un arranque sin cambios solo se consulta la versión
     async with pool.acquire() as conn:
-        # Tabla de bumps (sistema de bump tracker)
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS bumps (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            guild_id BIGINT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user_id, guild_id)
-        );
-        """)
-        
-        # Tabla de conteo de bumps
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS bump_counts (
-            user_id BIGINT NOT NULL,
-            guild_id BIGINT NOT NULL,
-            count INTEGER DEFAULT 0,
-            PRIMARY KEY (user_id, guild_id)
-        );
-        """)
-        
-        # Tabla de usuarios del sistema económico
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS usuarios (
-            user_id BIGINT PRIMARY KEY,
-            saldo DECIMAL(10,2) DEFAULT 0.00,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """)
-        
-        # Tabla de productos en la tienda
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS productos (
-            id SERIAL PRIMARY KEY,
-            nombre TEXT UNIQUE NOT NULL,
-            precio DECIMAL(10,2) NOT NULL,
-            cantidad INTEGER NOT NULL,
-            role_id BIGINT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """)
-        
-        # Tabla de inventario de usuarios
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS inventario (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            producto_nombre TEXT NOT NULL,
-            cantidad INTEGER DEFAULT 1,
-            precio_compra DECIMAL(10,2),
-            fecha_compra TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES usuarios (user_id)
-        );
-        """)
-        
-        # Tabla de transacciones (historial económico)
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS transacciones (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            tipo TEXT NOT NULL,
-            monto DECIMAL(10,2),
-            descripcion TEXT,
-            ejecutado_por BIGINT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES usuarios (user_id)
-        );
-        """)
-        
-        # Tabla principal de invitaciones
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS invites (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            invited_by_id BIGINT NOT NULL,
-            guild_id BIGINT NOT NULL,
-            invite_code TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_active BOOLEAN DEFAULT TRUE
-        );
-        """)
-        
-        # === TABLAS DEL SISTEMA DE NIVELES ===
-
-        # Tabla principal de usuarios para el sistema de niveles
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS levels_users (
-            user_id BIGINT NOT NULL,
-            guild_id BIGINT NOT NULL,
-            xp BIGINT DEFAULT 0,
-            level INTEGER DEFAULT 1,
-            last_xp_time BIGINT DEFAULT 0,
-            total_messages INTEGER DEFAULT 0,
-            -- columnas nuevas para leaderboards
-            weekly_xp BIGINT DEFAULT 0,
-            monthly_xp BIGINT DEFAULT 0,
-            weekly_reset TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            monthly_reset TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            badges JSONB DEFAULT '[]'::jsonb,
-            join_date BIGINT DEFAULT 0,
-            voice_time INTEGER DEFAULT 0,
-            PRIMARY KEY (user_id, guild_id)
-        );
-        """)
-
-        # Tabla de configuración de roles por nivel
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS level_roles (
-            guild_id BIGINT NOT NULL,
-            level INTEGER NOT NULL,
-            role_id BIGINT NOT NULL,
-            PRIMARY KEY (guild_id, level)
-        );
-        """)
-
-        # Tabla de configuración del servidor para niveles
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS guild_config (
-            guild_id BIGINT PRIMARY KEY,
-            level_up_channel BIGINT,
-            xp_per_message INTEGER DEFAULT 15,
-            xp_cooldown INTEGER DEFAULT 60,
-            enabled_channels JSONB DEFAULT '[]'::jsonb,
-            disabled_channels JSONB DEFAULT '[]'::jsonb,
-            xp_multiplier DECIMAL(3,1) DEFAULT 1.0,
-            level_formula TEXT DEFAULT 'exponential',
-            voice_xp_enabled BOOLEAN DEFAULT FALSE,
-            voice_xp_rate INTEGER DEFAULT 5,
-            bonus_roles JSONB DEFAULT '[]'::jsonb,
-            announce_level_up BOOLEAN DEFAULT TRUE,
-            stack_roles BOOLEAN DEFAULT FALSE,
-            custom_rewards JSONB DEFAULT '{}'::jsonb
-        );
-        """)
-
-        # Tabla de insignias mejorada
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS badges (
-            badge_id TEXT PRIMARY KEY,
-            name TEXT,
-            description TEXT,
-            emoji TEXT,
-            requirement_type TEXT,
-            requirement_value INTEGER,
-            rarity TEXT DEFAULT 'common',
-            hidden BOOLEAN DEFAULT FALSE
-        );
-        """)
+        version = await run_migrations(conn)
+    print(f"🧱 Esquema de base de datos en la versión {version}")
+
+@asynccontextmanager
+async def _use_connection(conn=None):
+    """Reutiliza la conexión recibida o toma una del pool (evita adquirir dos conexiones anidadas)"""
+    if conn is not None:
+        yield conn
+    else:
+        async with pool.acquire() as conn:
+            yield conn
 
-        # Tabla de recompensas personalizadas
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS custom_rewards (
-            guild_id BIGINT NOT NULL,
-            level INTEGER NOT NULL,
-            reward_type TEXT NOT NULL,
-            reward_data TEXT,
-            PRIMARY KEY (guild_id, level, reward_type)
-        );
-        """)
+@asynccontextmanager
+async def unit_of_work():
+    """Una sola conexión y transacción para varias llamadas seguidas:
 
-        # Tabla de sesiones de voz
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS voice_sessions (
-            user_id BIGINT NOT NULL,
-            guild_id BIGINT NOT NULL,
-            join_time BIGINT NOT NULL,
-            leave_time BIGINT DEFAULT 0,
-            xp_earned INTEGER DEFAULT 0,
-            PRIMARY KEY (user_id, guild_id, join_time)
-        );
-        """)
-
-        # === TABLAS DEL SISTEMA DE PARTNERS ===
-        
-        # Tabla para partners
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS partners (
-            id SERIAL PRIMARY KEY,
-            author_id BIGINT NOT NULL,
-            author_name TEXT NOT NULL,
-            content TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """)
-        
-        # Tabla para configuración del contador de partners
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS partner_config (
-            key TEXT PRIMARY KEY,
-            value INTEGER
-        );
-        """)
-        
-        # Inicializar contador si no existe
-        await conn.execute("""
-        INSERT INTO partner_config (key, value) 
-        VALUES ('partner_count', 0) 
-        ON CONFLICT (key) DO NOTHING;
-        """)
-        
-        # Índices para mejor rendimiento
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_invites_user_id ON invites(user_id)')
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_invites_invited_by_id ON invites(invited_by_id)')
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_invites_guild_id ON invites(guild_id)')
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_invites_active ON invites(guild_id, is_active)')
-        
-        # Índices para el sistema de niveles
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_levels_users_xp ON levels_users(guild_id, xp DESC)')
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_levels_users_level ON levels_users(guild_id, level DESC)')
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_levels_users_weekly ON levels_users(guild_id, weekly_xp DESC)')
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_levels_users_monthly ON levels_users(guild_id, monthly_xp DESC)')
-        
-        # Índices para el sistema de partners
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_partners_author_id ON partners(author_id)')
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_partners_created_at ON partners(created_at DESC)')
+        async with unit_of_work() as conn:
+            data = await get_user_level_data(user_id, guild_id, conn=conn)
+            rank = await get_user_rank(user_id, guild_id, conn=conn)
+    """
+    token = current_function.set('unit_of_work')
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                yield conn
+    finally:
+        current_function.reset(token)
 
 async def fetch(query, *args):
     async with pool.acquire() as conn:
@@ -295,9 +136,9 @@ async def get_all_bumps(guild_id: int) -> list:
 # FUNCIONES PARA EL SISTEMA ECONÓMICO
 # ==========================================
 
-async def get_user_balance(user_id: int) -> Decimal:
+async def get_user_balance(user_id: int, conn=None) -> Decimal:
     """Obtiene el saldo de un usuario"""
-    async with pool.acquire() as conn:
+    async with _use_connection(conn) as conn:
         result = await conn.fetchrow('SELECT saldo FROM usuarios WHERE user_id = $1', user_id)
         
         if result is None:
@@ -328,6 +169,35 @@ async def update_user_balance(user_id: int, new_balance: Decimal, admin_id: int,
                 VALUES ($1, $2, $3, $4, $5)
             """, user_id, operation_type, float(new_balance), description, admin_id)
 
+async def pay_raffle_prize(raffle_id: str, user_id: int, amount: Decimal, admin_id: int) -> tuple:
+    """Paga el premio de un sorteo una sola vez: el pago queda registrado por `raffle_id` en la misma
+    transacción que el saldo. Devuelve (id del ganador, True si se pagó ahora); si el sorteo ya
+    estaba pagado devuelve el ganador original sin tocar el saldo."""
+    async with unit_of_work() as conn:
+        inserted = await conn.fetchval("""
+            INSERT INTO raffle_payouts (raffle_id, user_id, amount)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (raffle_id) DO NOTHING
+            RETURNING user_id
+        """, raffle_id, user_id, float(amount))
+        if inserted is None:
+            winner_id = await conn.fetchval('SELECT user_id FROM raffle_payouts WHERE raffle_id = $1', raffle_id)
+            return winner_id, False
+        
+        new_balance = await conn.fetchval("""
+            INSERT INTO usuarios (user_id, saldo) VALUES ($1, $2)
+            ON CONFLICT (user_id) DO UPDATE SET saldo = usuarios.saldo + EXCLUDED.saldo
+            RETURNING saldo
+        """, user_id, float(amount))
+        await conn.executemany("""
+            INSERT INTO transacciones (user_id, tipo, monto, descripcion, ejecutado_por)
+            VALUES ($1, $2, $3, $4, $5)
+        """, [
+            (user_id, 'PREMIO_SORTEO', float(new_balance), f'Premio por ganar sorteo de €{amount}', admin_id),
+            (user_id, 'PREMIO', float(amount), f'Ganador del sorteo - €{amount}', None),
+        ])
+    return user_id, True
+
 async def add_transaction(user_id: int, tipo: str, monto: float, descripcion: str, ejecutado_por: int = None):
     """Registra una transacción"""
     async with pool.acquire() as conn:
@@ -689,39 +559,40 @@ async def get_invites_stats(guild_id: int) -> dict:
 # FUNCIONES PARA EL SISTEMA DE NIVELES
 # ==========================================
 
-def get_monday_of_week():
-    """Obtiene el lunes de la semana actual en horario de España (UTC+1) - SIN timezone info para PostgreSQL"""
-    from datetime import datetime, timedelta, timezone
+def get_week_period() -> int:
+    """Identificador de la semana ISO actual (año * 100 + semana) en horario de España (UTC+1)"""
+    from datetime import timedelta
     
-    # Horario de España (UTC+1)
     spain_tz = timezone(timedelta(hours=1))
-    now = datetime.now(spain_tz)
-    
-    # Obtener el lunes de esta semana
-    days_since_monday = now.weekday()
-    monday = now - timedelta(days=days_since_monday)
-    monday = monday.replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    # IMPORTANTE: Remover timezone info para PostgreSQL TIMESTAMP
-    return monday.replace(tzinfo=None)
+    year, week, _ = datetime.now(spain_tz).isocalendar()
+    return year * 100 + week
 
-def get_first_of_month():
-    """Obtiene el primer día del mes actual en horario de España (UTC+1) - SIN timezone info para PostgreSQL"""
-    from datetime import datetime, timedelta, timezone
+def get_month_period() -> int:
+    """Identificador del mes actual (año * 100 + mes) en horario de España (UTC+1)"""
+    from datetime import timedelta
     
-    # Horario de España (UTC+1)
     spain_tz = timezone(timedelta(hours=1))
     now = datetime.now(spain_tz)
-    
-    # Primer día del mes
-    first_day = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    # IMPORTANTE: Remover timezone info para PostgreSQL TIMESTAMP
-    return first_day.replace(tzinfo=None)
-
-async def get_user_level_data(user_id: int, guild_id: int) -> dict:
+    return now.year * 100 + now.month
+
+# XP semanal/mensual en un upsert: si la fila es de otro período su XP cuenta como 0 (sin resets masivos)
+_PERIOD_XP_UPDATE_SQL = """
+                weekly_xp = CASE
+                    WHEN levels_users.weekly_period = EXCLUDED.weekly_period
+                    THEN levels_users.weekly_xp + EXCLUDED.weekly_xp
+                    ELSE EXCLUDED.weekly_xp
+                END,
+                monthly_xp = CASE
+                    WHEN levels_users.monthly_period = EXCLUDED.monthly_period
+                    THEN levels_users.monthly_xp + EXCLUDED.monthly_xp
+                    ELSE EXCLUDED.monthly_xp
+                END,
+                weekly_period = EXCLUDED.weekly_period,
+                monthly_period = EXCLUDED.monthly_period"""
+
+async def get_user_level_data(user_id: int, guild_id: int, conn=None) -> dict:
     """Obtiene los datos de niveles de un usuario - VERSIÓN MEJORADA"""
-    async with pool.acquire() as conn:
+    async with _use_connection(conn) as conn:
         try:
             result = await conn.fetchrow("""
                 SELECT * FROM levels_users WHERE user_id = $1 AND guild_id = $2
@@ -731,7 +602,7 @@ async def get_user_level_data(user_id: int, guild_id: int) -> dict:
                 return dict(result)
             else:
                 # Si el usuario no existe, crearlo automáticamente
-                await ensure_user_exists(user_id, guild_id)
+                await ensure_user_exists(user_id, guild_id, conn=conn)
                 # Intentar obtener de nuevo
                 result = await conn.fetchrow("""
                     SELECT * FROM levels_users WHERE user_id = $1 AND guild_id = $2
@@ -759,83 +630,227 @@ async def get_user_level_data(user_id: int, guild_id: int) -> dict:
             print(f"Error en get_user_level_data: {e}")
             return None
 
+async def get_user_xp(user_id: int, guild_id: int, conn=None) -> int:
+    """Obtiene solo la XP total de un usuario (0 si no existe), sin crearlo"""
+    async with _use_connection(conn) as conn:
+        result = await conn.fetchval(
+            'SELECT xp FROM levels_users WHERE user_id = $1 AND guild_id = $2',
+            user_id, guild_id
+        )
+        return result or 0
+
 async def update_user_xp(user_id: int, guild_id: int, xp_gain: int, weekly_xp: int = 0, monthly_xp: int = 0):
     """Actualiza la XP de un usuario - VERSIÓN CORREGIDA que siempre crea el usuario si no existe"""
     import time
     current_time = int(time.time())
-    monday = get_monday_of_week()
-    first_day = get_first_of_month()
     
     async with pool.acquire() as conn:
         try:
-            # Intentar obtener el usuario actual primero
-            existing_user = await conn.fetchrow("""
-                SELECT xp, weekly_xp, monthly_xp, weekly_reset, monthly_reset 
-                FROM levels_users 
-                WHERE user_id = $1 AND guild_id = $2
-            """, user_id, guild_id)
-            
-            if existing_user:
-                # Usuario existe, actualizar
-                current_xp = existing_user['xp']
-                current_weekly_xp = existing_user['weekly_xp']
-                current_monthly_xp = existing_user['monthly_xp']
-                weekly_reset = existing_user['weekly_reset']
-                monthly_reset = existing_user['monthly_reset']
-                
-                # Verificar si necesita reset semanal (comparar datetime sin timezone)
-                if weekly_reset is None or weekly_reset < monday:
-                    new_weekly_xp = weekly_xp  # Resetear XP semanal
-                    weekly_reset_to_use = monday
-                else:
-                    new_weekly_xp = current_weekly_xp + weekly_xp
-                    weekly_reset_to_use = weekly_reset
-                
-                # Verificar si necesita reset mensual (comparar datetime sin timezone)
-                if monthly_reset is None or monthly_reset < first_day:
-                    new_monthly_xp = monthly_xp  # Resetear XP mensual
-                    monthly_reset_to_use = first_day
-                else:
-                    new_monthly_xp = current_monthly_xp + monthly_xp
-                    monthly_reset_to_use = monthly_reset
-                
-                # Actualizar usuario existente
-                await conn.execute("""
-                    UPDATE levels_users SET 
-                        xp = $1,
-                        last_xp_time = $2,
-                        total_messages = total_messages + 1,
-                        weekly_xp = $3,
-                        monthly_xp = $4,
-                        weekly_reset = $5,
-                        monthly_reset = $6
-                    WHERE user_id = $7 AND guild_id = $8
-                """, current_xp + xp_gain, current_time, new_weekly_xp, new_monthly_xp, 
-                    weekly_reset_to_use, monthly_reset_to_use, user_id, guild_id)
-                
-            else:
-                # Usuario no existe, crear nuevo registro
-                await conn.execute("""
-                    INSERT INTO levels_users (
-                        user_id, guild_id, xp, level, last_xp_time, total_messages, 
-                        weekly_xp, monthly_xp, badges, join_date, voice_time, 
-                        weekly_reset, monthly_reset
-                    ) VALUES ($1, $2, $3, 1, $4, 1, $5, $6, '[]'::jsonb, $7, 0, $8, $9)
-                """, user_id, guild_id, xp_gain, current_time, weekly_xp, monthly_xp, 
-                    current_time, monday, first_day)
+            await conn.execute(f"""
+                INSERT INTO levels_users (
+                    user_id, guild_id, xp, level, last_xp_time, total_messages, 
+                    weekly_xp, monthly_xp, badges, join_date, voice_time, 
+                    weekly_period, monthly_period
+                ) VALUES ($1, $2, $3, 1, $4, 1, $5, $6, '[]'::jsonb, $4, 0, $7, $8)
+                ON CONFLICT (user_id, guild_id) DO UPDATE SET
+                    xp = levels_users.xp + EXCLUDED.xp,
+                    last_xp_time = EXCLUDED.last_xp_time,
+                    total_messages = levels_users.total_messages + 1,{_PERIOD_XP_UPDATE_SQL}
+            """, user_id, guild_id, xp_gain, current_time, weekly_xp, monthly_xp,
+                get_week_period(), get_month_period())
                 
         except Exception as e:
             print(f"Error en update_user_xp: {e}")
             raise e
 
-async def ensure_user_exists(user_id: int, guild_id: int):
+# Nivel calculado en SQL: cantidad de umbrales de XP acumulada (nivel 1 = 0) alcanzados
+_LEVEL_FROM_XP_SQL = "(SELECT COUNT(*) FROM unnest($%d::bigint[]) AS t(min_xp) WHERE t.min_xp <= %s)::int"
+
+async def bulk_add_user_xp(entries: list, level_thresholds: list):
+    """Aplica en lote XP acumulada: entries = [(user_id, guild_id, xp, mensajes)].
+    El nivel se calcula en SQL sobre la XP resultante (otras vías pueden haber sumado XP a la vez)"""
+    if not entries:
+        return
+
+    import time
+    current_time = int(time.time())
+    week_period = get_week_period()
+    month_period = get_month_period()
+
+    async with pool.acquire() as conn:
+        # Un único upsert por fila, enviado en un solo lote (executemany)
+        await conn.executemany(f"""
+            INSERT INTO levels_users (
+                user_id, guild_id, xp, level, last_xp_time, total_messages,
+                weekly_xp, monthly_xp, badges, join_date, voice_time,
+                weekly_period, monthly_period
+            ) VALUES ($1, $2, $3, {_LEVEL_FROM_XP_SQL % (8, '$3')}, $5, $4, $3, $3, '[]'::jsonb, $5, 0, $6, $7)
+            ON CONFLICT (user_id, guild_id) DO UPDATE SET
+                xp = levels_users.xp + EXCLUDED.xp,
+                level = {_LEVEL_FROM_XP_SQL % (8, 'levels_users.xp + EXCLUDED.xp')},
+                last_xp_time = EXCLUDED.last_xp_time,
+                total_messages = levels_users.total_messages + EXCLUDED.total_messages,{_PERIOD_XP_UPDATE_SQL}
+        """, [
+            (user_id, guild_id, xp, messages, current_time, week_period, month_period, level_thresholds)
+            for user_id, guild_id, xp, messages in entries
+        ])
+
+async def grant_user_xp(user_id: int, guild_id: int, xp_amount: int, level_thresholds: list, messages: int = 1) -> dict:
+    """Suma XP en una sola consulta (crea el usuario, aplica los resets semanal/mensual
+    y cuenta el mensaje) y devuelve la XP y el nivel anteriores y nuevos"""
+    import time
+    current_time = int(time.time())
+
+    async with pool.acquire() as conn:
+        result = await conn.fetchrow(f"""
+            WITH upserted AS (
+                INSERT INTO levels_users (
+                    user_id, guild_id, xp, level, last_xp_time, total_messages,
+                    weekly_xp, monthly_xp, badges, join_date, voice_time,
+                    weekly_period, monthly_period
+                ) VALUES ($1, $2, $3, {_LEVEL_FROM_XP_SQL % (8, '$3')}, $4, $5, $3, $3, '[]'::jsonb, $4, 0, $6, $7)
+                ON CONFLICT (user_id, guild_id) DO UPDATE SET
+                    xp = levels_users.xp + EXCLUDED.xp,
+                    level = {_LEVEL_FROM_XP_SQL % (8, 'levels_users.xp + EXCLUDED.xp')},
+                    last_xp_time = EXCLUDED.last_xp_time,
+                    total_messages = levels_users.total_messages + EXCLUDED.total_messages,{_PERIOD_XP_UPDATE_SQL}
+                RETURNING xp, level
+            )
+            SELECT xp - $3 AS old_xp,
+                   xp AS new_xp,
+                   {_LEVEL_FROM_XP_SQL % (8, 'xp - $3')} AS old_level,
+                   level AS new_level
+            FROM upserted
+        """, user_id, guild_id, xp_amount, current_time, messages,
+            get_week_period(), get_month_period(), level_thresholds)
+
+        return dict(result)
+
+async def bulk_grant_user_xp(entries: list, level_thresholds: list, messages: int = 1) -> list:
+    """Versión en lote de grant_user_xp con una sola sentencia (unnest):
+    entries = [(user_id, guild_id, xp)] o [(user_id, guild_id, xp, segundos_de_voz)] sin repetir usuario;
+    devuelve [(user_id, guild_id, old_xp, new_xp)]"""
+    if not entries:
+        return []
+
+    import time
+    current_time = int(time.time())
+    user_ids, guild_ids, amounts, *voice = (list(column) for column in zip(*entries))
+    voice_seconds = voice[0] if voice else [0] * len(entries)
+
+    async with pool.acquire() as conn:
+        results = await conn.fetch(f"""
+            WITH grants AS (
+                SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $9::int[])
+                    AS g(user_id, guild_id, xp, voice_time)
+            ), upserted AS (
+                INSERT INTO levels_users (
+                    user_id, guild_id, xp, level, last_xp_time, total_messages,
+                    weekly_xp, monthly_xp, badges, join_date, voice_time,
+                    weekly_period, monthly_period
+                )
+                SELECT g.user_id, g.guild_id, g.xp, {_LEVEL_FROM_XP_SQL % (7, 'g.xp')}, $4, $8,
+                       g.xp, g.xp, '[]'::jsonb, $4, g.voice_time, $5, $6
+                FROM grants g
+                ON CONFLICT (user_id, guild_id) DO UPDATE SET
+                    xp = levels_users.xp + EXCLUDED.xp,
+                    level = {_LEVEL_FROM_XP_SQL % (7, 'levels_users.xp + EXCLUDED.xp')},
+                    last_xp_time = EXCLUDED.last_xp_time,
+                    total_messages = levels_users.total_messages + EXCLUDED.total_messages,
+                    voice_time = levels_users.voice_time + EXCLUDED.voice_time,{_PERIOD_XP_UPDATE_SQL}
+                RETURNING user_id, guild_id, xp
+            )
+            SELECT u.user_id, u.guild_id, u.xp - g.xp AS old_xp, u.xp AS new_xp
+            FROM upserted u JOIN grants g USING (user_id, guild_id)
+        """, user_ids, guild_ids, amounts, current_time,
+            get_week_period(), get_month_period(), level_thresholds, messages, voice_seconds)
+
+        return [(row['user_id'], row['guild_id'], row['old_xp'], row['new_xp']) for row in results]
+
+async def add_voice_time(entries: list):
+    """Suma tiempo en voz sin XP: entries = [(user_id, guild_id, segundos)] (solo usuarios con fila)"""
+    if not entries:
+        return
+    user_ids, guild_ids, seconds = (list(column) for column in zip(*entries))
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE levels_users u
+            SET voice_time = u.voice_time + t.seconds
+            FROM unnest($1::bigint[], $2::bigint[], $3::int[]) AS t(user_id, guild_id, seconds)
+            WHERE u.user_id = t.user_id AND u.guild_id = t.guild_id
+        """, user_ids, guild_ids, seconds)
+
+async def save_voice_sessions(sessions: list):
+    """Guarda en lote sesiones de voz abiertas o cerradas:
+    sessions = [(user_id, guild_id, join_time, leave_time, xp_earned, last_seen)] (leave_time 0 = abierta)"""
+    if not sessions:
+        return
+    async with pool.acquire() as conn:
+        await conn.executemany("""
+            INSERT INTO voice_sessions (user_id, guild_id, join_time, leave_time, xp_earned, last_seen)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT (user_id, guild_id, join_time) DO UPDATE SET
+                leave_time = EXCLUDED.leave_time,
+                xp_earned = EXCLUDED.xp_earned,
+                last_seen = EXCLUDED.last_seen
+        """, sessions)
+
+async def get_open_voice_sessions() -> list:
+    """Sesiones de voz que quedaron abiertas: [(user_id, guild_id, join_time, xp_earned, last_seen)]"""
+    async with pool.acquire() as conn:
+        results = await conn.fetch("""
+            SELECT user_id, guild_id, join_time, xp_earned, last_seen
+            FROM voice_sessions WHERE leave_time = 0
+        """)
+        return [(row['user_id'], row['guild_id'], row['join_time'], row['xp_earned'], row['last_seen'])
+                for row in results]
+
+async def set_user_total_xp(user_id: int, guild_id: int, xp: int, level_thresholds: list) -> dict:
+    """Establece la XP total (y su nivel) en una sola consulta y devuelve los valores anteriores y nuevos"""
+    return await _write_user_total_xp(user_id, guild_id, xp, level_thresholds, '$3', '$3')
+
+async def remove_user_xp(user_id: int, guild_id: int, amount: int, level_thresholds: list) -> dict:
+    """Quita XP (sin bajar de 0) en una sola consulta y devuelve los valores anteriores y nuevos"""
+    return await _write_user_total_xp(user_id, guild_id, amount, level_thresholds, '0', 'GREATEST(levels_users.xp - $3, 0)')
+
+async def _write_user_total_xp(user_id: int, guild_id: int, value: int, level_thresholds: list,
+                               insert_xp_sql: str, update_xp_sql: str) -> dict:
+    """Sobrescribe la XP de un usuario con las expresiones dadas (fila nueva / fila existente),
+    bloqueando la fila para leer el valor anterior"""
+
+    async with pool.acquire() as conn:
+        result = await conn.fetchrow(f"""
+            WITH previous AS (
+                SELECT xp FROM levels_users
+                WHERE user_id = $1 AND guild_id = $2
+                FOR UPDATE
+            ), upserted AS (
+                INSERT INTO levels_users (
+                    user_id, guild_id, xp, level, last_xp_time, total_messages,
+                    weekly_xp, monthly_xp, badges, join_date, voice_time,
+                    weekly_period, monthly_period
+                ) VALUES ($1, $2, {insert_xp_sql}, {_LEVEL_FROM_XP_SQL % (4, insert_xp_sql)},
+                          0, 0, 0, 0, '[]'::jsonb, 0, 0, $5, $6)
+                ON CONFLICT (user_id, guild_id) DO UPDATE SET
+                    xp = {update_xp_sql},
+                    level = {_LEVEL_FROM_XP_SQL % (4, update_xp_sql)}
+                RETURNING xp, level
+            )
+            SELECT COALESCE((SELECT xp FROM previous), 0) AS old_xp,
+                   upserted.xp AS new_xp,
+                   {_LEVEL_FROM_XP_SQL % (4, 'COALESCE((SELECT xp FROM previous), 0)')} AS old_level,
+                   upserted.level AS new_level
+            FROM upserted
+        """, user_id, guild_id, value, level_thresholds, get_week_period(), get_month_period())
+
+        return dict(result)
+
+async def ensure_user_exists(user_id: int, guild_id: int, conn=None):
     """Asegura que un usuario existe en la base de datos, creándolo si es necesario"""
     import time
     current_time = int(time.time())
-    monday = get_monday_of_week()
-    first_day = get_first_of_month()
     
-    async with pool.acquire() as conn:
+    async with _use_connection(conn) as conn:
         try:
             # Verificar si el usuario existe
             existing = await conn.fetchrow("""
@@ -848,10 +863,10 @@ async def ensure_user_exists(user_id: int, guild_id: int):
                     INSERT INTO levels_users (
                         user_id, guild_id, xp, level, last_xp_time, total_messages, 
                         weekly_xp, monthly_xp, badges, join_date, voice_time, 
-                        weekly_reset, monthly_reset
+                        weekly_period, monthly_period
                     ) VALUES ($1, $2, 0, 1, 0, 0, 0, 0, '[]'::jsonb, $3, 0, $4, $5)
                     ON CONFLICT (user_id, guild_id) DO NOTHING
-                """, user_id, guild_id, current_time, monday, first_day)
+                """, user_id, guild_id, current_time, get_week_period(), get_month_period())
                 
                 print(f"Usuario {user_id} creado en guild {guild_id}")
                 return True
@@ -861,77 +876,33 @@ async def ensure_user_exists(user_id: int, guild_id: int):
             print(f"Error en ensure_user_exists: {e}")
             return False
 
-async def set_user_xp(user_id: int, guild_id: int, xp: int):
-    """Establece la XP exacta de un usuario - VERSIÓN MEJORADA"""
-    import time
-    current_time = int(time.time())
-    
-    async with pool.acquire() as conn:
-        try:
-            # Primero asegurar que el usuario existe
-            await ensure_user_exists(user_id, guild_id)
-            
-            # Actualizar la XP
-            result = await conn.execute("""
-                UPDATE levels_users SET xp = $1 WHERE user_id = $2 AND guild_id = $3
-            """, xp, user_id, guild_id)
-            
-            # Si no se actualizó ninguna fila, algo salió mal
-            if result == "UPDATE 0":
-                print(f"Advertencia: No se pudo actualizar XP para usuario {user_id}")
-                
-        except Exception as e:
-            print(f"Error en set_user_xp: {e}")
-            raise e
-
-async def set_user_level(user_id: int, guild_id: int, level: int):
-    """Establece el nivel exacto de un usuario - VERSIÓN MEJORADA"""
-    async with pool.acquire() as conn:
-        try:
-            # Primero asegurar que el usuario existe
-            await ensure_user_exists(user_id, guild_id)
-            
-            # Actualizar el nivel
-            result = await conn.execute("""
-                UPDATE levels_users SET level = $1 WHERE user_id = $2 AND guild_id = $3
-            """, level, user_id, guild_id)
-            
-            # Si no se actualizó ninguna fila, algo salió mal
-            if result == "UPDATE 0":
-                print(f"Advertencia: No se pudo actualizar nivel para usuario {user_id}")
-                
-        except Exception as e:
-            print(f"Error en set_user_level: {e}")
-            raise e
-
-async def add_user_xp(user_id: int, guild_id: int, xp_amount: int):
-    """Agrega XP a un usuario específico - VERSIÓN MEJORADA"""
-    import time
-    current_time = int(time.time())
-    
-    # Usar la función update_user_xp mejorada
-    await update_user_xp(user_id, guild_id, xp_amount, xp_amount, xp_amount)
-
-async def get_user_rank(user_id: int, guild_id: int, rank_type: str = 'total') -> int:
+async def get_user_rank(user_id: int, guild_id: int, rank_type: str = 'total', conn=None) -> int:
     """Obtiene el ranking de un usuario específico - VERSIÓN MEJORADA"""
-    async with pool.acquire() as conn:
+    async with _use_connection(conn) as conn:
         try:
             # Primero asegurar que el usuario existe
-            await ensure_user_exists(user_id, guild_id)
+            await ensure_user_exists(user_id, guild_id, conn=conn)
             
-            if rank_type == 'weekly':
-                order_by = 'weekly_xp'
-            elif rank_type == 'monthly':
-                order_by = 'monthly_xp'
+            if rank_type in ('weekly', 'monthly'):
+                # Solo cuentan las filas del período vigente; las demás valen 0
+                column = f'{rank_type}_xp'
+                period_column = 'weekly_period' if rank_type == 'weekly' else 'monthly_period'
+                period = get_week_period() if rank_type == 'weekly' else get_month_period()
+                
+                result = await conn.fetchrow(f"""
+                    SELECT COUNT(*) + 1 as rank FROM levels_users 
+                    WHERE guild_id = $1 AND {period_column} = $3 AND {column} > COALESCE((
+                        SELECT {column} FROM levels_users
+                        WHERE user_id = $2 AND guild_id = $1 AND {period_column} = $3
+                    ), 0)
+                """, guild_id, user_id, period)
             else:
-                order_by = 'xp'
-            
-            result = await conn.fetchrow(f"""
-                SELECT COUNT(*) + 1 as rank FROM levels_users 
-                WHERE guild_id = $1 AND {order_by} > (
-                    SELECT {order_by} FROM levels_users WHERE user_id = $2 AND guild_id = $3
-                )
-            """, guild_id, user_id, guild_id)
+                result = await conn.fetchrow("""
+                    SELECT COUNT(*) + 1 as rank FROM levels_users 
+                    WHERE guild_id = $1 AND xp > (
+                        SELECT xp FROM levels_users WHERE user_id = $2 AND guild_id = $3
+                    )
+                """, guild_id, user_id, guild_id)
             
             return result['rank'] if result else 1
             
@@ -939,90 +910,47 @@ async def get_user_rank(user_id: int, guild_id: int, rank_type: str = 'total') -
             print(f"Error en get_user_rank: {e}")
             return 1
 
-async def get_leaderboard(guild_id: int, limit: int = 10) -> list:
-    """Obtiene el ranking global por XP total - VERSIÓN MEJORADA"""
+async def get_guild_xp_snapshot(guild_id: int) -> list:
+    """Obtiene la XP total, semanal y mensual vigente de todos los usuarios de un servidor"""
     async with pool.acquire() as conn:
-        try:
-            results = await conn.fetch("""
-                SELECT user_id, xp FROM levels_users 
-                WHERE guild_id = $1 AND xp > 0
-                ORDER BY xp DESC, level DESC 
-                LIMIT $2
-            """, guild_id, limit)
-            
-            return [{'user_id': row['user_id'], 'xp': row['xp']} for row in results]
-            
-        except Exception as e:
-            print(f"Error en get_leaderboard: {e}")
-            return []
-
-async def get_weekly_leaderboard(guild_id: int, limit: int = 10) -> list:
-    """Obtiene el ranking semanal por XP ganada - VERSIÓN MEJORADA"""
-    monday = get_monday_of_week()
-    
+        results = await conn.fetch("""
+            SELECT user_id,
+                   xp,
+                   CASE WHEN weekly_period = $2 THEN weekly_xp ELSE 0 END AS weekly_xp,
+                   CASE WHEN monthly_period = $3 THEN monthly_xp ELSE 0 END AS monthly_xp
+            FROM levels_users
+            WHERE guild_id = $1
+        """, guild_id, get_week_period(), get_month_period())
+
+        return [(row['user_id'], row['xp'], row['weekly_xp'], row['monthly_xp']) for row in results]
+
+async def get_guild_xp_checksum(guild_id: int) -> tuple:
+    """(usuarios, XP total, XP semanal, XP mensual) de un servidor, para detectar desviaciones del índice"""
     async with pool.acquire() as conn:
-        try:
-            results = await conn.fetch("""
-                SELECT user_id, 
-                       CASE 
-                           WHEN weekly_reset IS NULL OR weekly_reset < $2 THEN 0 
-                           ELSE weekly_xp 
-                       END as weekly_xp
-                FROM levels_users 
-                WHERE guild_id = $1 AND (
-                    (weekly_reset IS NOT NULL AND weekly_reset >= $2 AND weekly_xp > 0) OR
-                    (weekly_reset IS NULL OR weekly_reset < $2)
-                )
-                ORDER BY CASE 
-                             WHEN weekly_reset IS NULL OR weekly_reset < $2 THEN 0 
-                             ELSE weekly_xp 
-                         END DESC
-                LIMIT $3
-            """, guild_id, monday, limit)
-            
-            return [{'user_id': row['user_id'], 'xp': row['weekly_xp']} for row in results if row['weekly_xp'] > 0]
-            
-        except Exception as e:
-            print(f"Error en get_weekly_leaderboard: {e}")
-            return []
+        row = await conn.fetchrow("""
+            SELECT COUNT(*) AS users,
+                   COALESCE(SUM(xp), 0) AS xp,
+                   COALESCE(SUM(CASE WHEN weekly_period = $2 THEN weekly_xp ELSE 0 END), 0) AS weekly_xp,
+                   COALESCE(SUM(CASE WHEN monthly_period = $3 THEN monthly_xp ELSE 0 END), 0) AS monthly_xp
+            FROM levels_users
+            WHERE guild_id = $1
+        """, guild_id, get_week_period(), get_month_period())
 
-async def get_monthly_leaderboard(guild_id: int, limit: int = 10) -> list:
-    """Obtiene el ranking mensual por XP ganada - VERSIÓN MEJORADA"""
-    first_day = get_first_of_month()
-    
-    async with pool.acquire() as conn:
-        try:
-            results = await conn.fetch("""
-                SELECT user_id, 
-                       CASE 
-                           WHEN monthly_reset IS NULL OR monthly_reset < $2 THEN 0 
-                           ELSE monthly_xp 
-                       END as monthly_xp
-                FROM levels_users 
-                WHERE guild_id = $1 AND (
-                    (monthly_reset IS NOT NULL AND monthly_reset >= $2 AND monthly_xp > 0) OR
-                    (monthly_reset IS NULL OR monthly_reset < $2)
-                )
-                ORDER BY CASE 
-                             WHEN monthly_reset IS NULL OR monthly_reset < $2 THEN 0 
-                             ELSE monthly_xp 
-                         END DESC
-                LIMIT $3
-            """, guild_id, first_day, limit)
-            
-            return [{'user_id': row['user_id'], 'xp': row['monthly_xp']} for row in results if row['monthly_xp'] > 0]
-            
-        except Exception as e:
-            print(f"Error en get_monthly_leaderboard: {e}")
-            return []
+        return (row['users'], int(row['xp']), int(row['weekly_xp']), int(row['monthly_xp']))
 
 async def get_levels_leaderboard(guild_id: int, limit: int = 10, leaderboard_type: str = 'total') -> list:
     """Obtiene el leaderboard del servidor"""
     async with pool.acquire() as conn:
+        args = [guild_id, limit]
+        period_filter = ''
         if leaderboard_type == 'weekly':
             order_by = 'weekly_xp'
+            period_filter = 'AND weekly_period = $3'
+            args.append(get_week_period())
         elif leaderboard_type == 'monthly':
             order_by = 'monthly_xp'
+            period_filter = 'AND monthly_period = $3'
+            args.append(get_month_period())
         elif leaderboard_type == 'messages':
             order_by = 'total_messages'
         elif leaderboard_type == 'voice':
@@ -1033,45 +961,14 @@ async def get_levels_leaderboard(guild_id: int, limit: int = 10, leaderboard_typ
         results = await conn.fetch(f"""
             SELECT user_id, xp, level, {order_by}, total_messages, voice_time 
             FROM levels_users 
-            WHERE guild_id = $1 AND {order_by} > 0
+            WHERE guild_id = $1 AND {order_by} > 0 {period_filter}
             ORDER BY {order_by} DESC, level DESC 
             LIMIT $2
-        """, guild_id, limit)
+        """, *args)
         
         return [(row['user_id'], row['xp'], row['level'], row[order_by], 
                 row['total_messages'], row['voice_time']) for row in results]
 
-async def get_guild_level_config(guild_id: int) -> dict:
-    """Obtiene la configuración del servidor para niveles"""
-    async with pool.acquire() as conn:
-        result = await conn.fetchrow('SELECT * FROM guild_config WHERE guild_id = $1', guild_id)
-        
-        if result:
-            config = dict(result)
-            # Convertir campos JSON
-            config['enabled_channels'] = config['enabled_channels'] if config['enabled_channels'] else []
-            config['disabled_channels'] = config['disabled_channels'] if config['disabled_channels'] else []
-            config['bonus_roles'] = config['bonus_roles'] if config['bonus_roles'] else []
-            config['custom_rewards'] = config['custom_rewards'] if config['custom_rewards'] else {}
-            return config
-        
-        return {
-            'guild_id': guild_id,
-            'level_up_channel': None,
-            'xp_per_message': 15,
-            'xp_cooldown': 60,
-            'enabled_channels': [],
-            'disabled_channels': [],
-            'xp_multiplier': 1.0,
-            'level_formula': 'exponential',
-            'voice_xp_enabled': False,
-            'voice_xp_rate': 5,
-            'bonus_roles': [],
-            'announce_level_up': True,
-            'stack_roles': False,
-            'custom_rewards': {}
-        }
-
 async def set_level_role(guild_id: int, level: int, role_id: int):
     """Configura un rol para un nivel específico"""
     async with pool.acquire() as conn:
@@ -1087,16 +984,25 @@ async def remove_level_role(guild_id: int, level: int):
     async with pool.acquire() as conn:
         await conn.execute('DELETE FROM level_roles WHERE guild_id = $1 AND level = $2', guild_id, level)
 
-async def get_level_roles(guild_id: int) -> dict:
+async def seed_level_roles(guild_id: int, level_roles: dict, conn=None):
+    """Inserta varios roles de nivel de una vez sin pisar los ya configurados"""
+    async with _use_connection(conn) as conn:
+        await conn.execute("""
+            INSERT INTO level_roles (guild_id, level, role_id)
+            SELECT $1, level, role_id FROM unnest($2::int[], $3::bigint[]) AS t(level, role_id)
+            ON CONFLICT (guild_id, level) DO NOTHING
+        """, guild_id, list(level_roles), list(level_roles.values()))
+
+async def get_level_roles(guild_id: int, conn=None) -> dict:
     """Obtiene todos los roles configurados por nivel"""
-    async with pool.acquire() as conn:
+    async with _use_connection(conn) as conn:
         results = await conn.fetch('SELECT level, role_id FROM level_roles WHERE guild_id = $1 ORDER BY level', guild_id)
         return {row['level']: row['role_id'] for row in results}
 
-async def add_badge(user_id: int, guild_id: int, badge_id: str) -> bool:
+async def add_badge(user_id: int, guild_id: int, badge_id: str, conn=None) -> bool:
     """Agrega una insignia a un usuario"""
-    async with pool.acquire() as conn:
-        user_data = await get_user_level_data(user_id, guild_id)
+    async with _use_connection(conn) as conn:
+        user_data = await get_user_level_data(user_id, guild_id, conn=conn)
         if not user_data:
             return False
         
@@ -1148,53 +1054,109 @@ async def get_level_server_stats(guild_id: int) -> dict:
             'level_distribution': level_distribution
         }
 
-async def update_guild_config(guild_id: int, **kwargs):
-    """Actualiza la configuración de un servidor"""
+# Columnas de guild_config que se pueden modificar (las JSONB se serializan)
+GUILD_CONFIG_FIELDS = {
+    'level_up_channel', 'xp_per_message', 'xp_cooldown', 'enabled_channels', 'disabled_channels',
+    'xp_multiplier', 'voice_xp_enabled', 'voice_xp_rate', 'bonus_roles',
+    'announce_level_up', 'stack_roles', 'custom_rewards'
+}
+GUILD_CONFIG_JSON_FIELDS = {'enabled_channels', 'disabled_channels', 'bonus_roles', 'custom_rewards'}
+
+async def get_guild_config_row(guild_id: int, conn=None):
+    """Fila cruda de guild_config (None si el servidor no tiene configuración)"""
+    async with _use_connection(conn) as conn:
+        return await conn.fetchrow('SELECT * FROM guild_config WHERE guild_id = $1', guild_id)
+
+async def update_guild_config(guild_id: int, conn=None, **kwargs):
+    """Actualiza la configuración de un servidor con una sola sentencia y devuelve la fila resultante"""
+    unknown = set(kwargs) - GUILD_CONFIG_FIELDS
+    if unknown:
+        raise ValueError(f"Campos de configuración desconocidos: {', '.join(sorted(unknown))}")
+    
+    columns = list(kwargs)
+    values = [json.dumps(kwargs[c]) if c in GUILD_CONFIG_JSON_FIELDS else kwargs[c] for c in columns]
+    placeholders = ', '.join(f'${i}' for i in range(2, len(columns) + 2))
+    
+    if columns:
+        updates = ', '.join(f'{c} = EXCLUDED.{c}' for c in columns)
+        conflict = f'DO UPDATE SET {updates}'
+        insert_columns = ', ' + ', '.join(columns)
+        insert_values = ', ' + placeholders
+    else:
+        # Sin cambios: solo asegurar que la fila existe (el UPDATE vacío devuelve la fila)
+        conflict = 'DO UPDATE SET guild_id = EXCLUDED.guild_id'
+        insert_columns = insert_values = ''
+    
+    async with _use_connection(conn) as conn:
+        return await conn.fetchrow(f"""
+            INSERT INTO guild_config (guild_id{insert_columns}) VALUES ($1{insert_values})
+            ON CONFLICT (guild_id) {conflict}
+            RETURNING *
+        """, guild_id, *values)
+
+async def listen(channel: str, callback, on_lost=None):
+    """Conexión dedicada (fuera del pool) que escucha un canal de NOTIFY; hay que cerrarla al terminar"""
+    conn = await asyncpg.connect(DB_URL, ssl="require")
+    await conn.add_listener(channel, callback)
+    if on_lost is not None:
+        conn.add_termination_listener(on_lost)
+    return conn
+
+async def get_xp_multipliers() -> list:
+    """Multiplicadores de XP por rol aún vigentes: [(role_id, multiplier, expires_at)]"""
+    async with pool.acquire() as conn:
+        results = await conn.fetch(
+            'SELECT role_id, multiplier, expires_at FROM xp_multipliers WHERE expires_at > EXTRACT(EPOCH FROM NOW())'
+        )
+        return [(row['role_id'], float(row['multiplier']), row['expires_at']) for row in results]
+
+async def save_xp_multiplier(role_id: int, guild_id: int, multiplier: float, expires_at: int):
+    """Guarda (o reemplaza) el multiplicador de un rol"""
     async with pool.acquire() as conn:
-        # Primero insertar configuración base si no existe
         await conn.execute("""
-            INSERT INTO guild_config (guild_id) VALUES ($1)
-            ON CONFLICT (guild_id) DO NOTHING
-        """, guild_id)
-        
-        # Actualizar campos específicos
-        for field, value in kwargs.items():
-            if field in ['enabled_channels', 'disabled_channels', 'bonus_roles', 'custom_rewards']:
-                # Campos JSON
-                await conn.execute(f"""
-                    UPDATE guild_config SET {field} = $1 WHERE guild_id = $2
-                """, json.dumps(value), guild_id)
-            else:
-                # Campos regulares
-                await conn.execute(f"""
-                    UPDATE guild_config SET {field} = $1 WHERE guild_id = $2
-                """, value, guild_id)
+            INSERT INTO xp_multipliers (role_id, guild_id, multiplier, expires_at)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (role_id) DO UPDATE SET
+                guild_id = EXCLUDED.guild_id,
+                multiplier = EXCLUDED.multiplier,
+                expires_at = EXCLUDED.expires_at
+        """, role_id, guild_id, multiplier, expires_at)
+
+async def delete_xp_multipliers(role_ids: list):
+    """Borra los multiplicadores caducados de esos roles"""
+    async with pool.acquire() as conn:
+        await conn.execute(
+            'DELETE FROM xp_multipliers WHERE role_id = ANY($1::bigint[]) AND expires_at <= EXTRACT(EPOCH FROM NOW())',
+            role_ids
+        )
 
 async def reset_weekly_xp(guild_id: int = None):
-    """Resetea la XP semanal"""
-    monday = get_monday_of_week()
-    
+    """Resetea la XP semanal del período actual (los períodos anteriores ya cuentan como 0)"""
     async with pool.acquire() as conn:
         if guild_id:
             await conn.execute("""
-                UPDATE levels_users SET weekly_xp = 0, weekly_reset = $1 
-                WHERE guild_id = $2
-            """, monday, guild_id)
+                UPDATE levels_users SET weekly_xp = 0 
+                WHERE guild_id = $2 AND weekly_period = $1 AND weekly_xp > 0
+            """, get_week_period(), guild_id)
         else:
-            await conn.execute('UPDATE levels_users SET weekly_xp = 0, weekly_reset = $1', monday)
+            await conn.execute(
+                'UPDATE levels_users SET weekly_xp = 0 WHERE weekly_period = $1 AND weekly_xp > 0',
+                get_week_period()
+            )
 
 async def reset_monthly_xp(guild_id: int = None):
-    """Resetea la XP mensual"""
-    first_day = get_first_of_month()
-    
+    """Resetea la XP mensual del período actual (los períodos anteriores ya cuentan como 0)"""
     async with pool.acquire() as conn:
         if guild_id:
             await conn.execute("""
-                UPDATE levels_users SET monthly_xp = 0, monthly_reset = $1 
-                WHERE guild_id = $2
-            """, first_day, guild_id)
+                UPDATE levels_users SET monthly_xp = 0 
+                WHERE guild_id = $2 AND monthly_period = $1 AND monthly_xp > 0
+            """, get_month_period(), guild_id)
         else:
-            await conn.execute('UPDATE levels_users SET monthly_xp = 0, monthly_reset = $1', first_day)
+            await conn.execute(
+                'UPDATE levels_users SET monthly_xp = 0 WHERE monthly_period = $1 AND monthly_xp > 0',
+                get_month_period()
+            )
 
 # ==========================================
 # FUNCIONES PARA EL SISTEMA DE PARTNERS
@@ -1291,4 +1253,241 @@ async def get_partner_by_id(partner_id: int) -> tuple:
         
         if result:
             return (result['id'], result['author_name'], result['content'], result['created_at'])
-        return None
\ No newline at end of file
+        return None
+
+# ==========================================
+# FUNCIONES DEL PLANIFICADOR DE TAREAS
+# ==========================================
+
+async def save_scheduled_job(name: str, run_at: int, payload: dict, job_key: str = None) -> int:
+    """Guarda un temporizador (si ya existe uno con el mismo nombre y clave, lo reemplaza) y devuelve su id"""
+    async with pool.acquire() as conn:
+        return await conn.fetchval("""
+            INSERT INTO scheduled_jobs (name, job_key, run_at, payload)
+            VALUES ($1, $2, $3, $4::jsonb)
+            ON CONFLICT (name, job_key)
+            DO UPDATE SET run_at = EXCLUDED.run_at, payload = EXCLUDED.payload, attempts = 0
+            RETURNING id
+        """, name, job_key, run_at, json.dumps(payload))
+
+async def delete_scheduled_job(job_id: int):
+    """Elimina un temporizador ya ejecutado"""
+    async with pool.acquire() as conn:
+        await conn.execute('DELETE FROM scheduled_jobs WHERE id = $1', job_id)
+
+async def cancel_scheduled_job(name: str, job_key: str):
+    """Cancela un temporizador por nombre y clave; devuelve su id o None"""
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            'DELETE FROM scheduled_jobs WHERE name = $1 AND job_key = $2 RETURNING id', name, job_key
+        )
+
+async def retry_scheduled_job(job_id: int, run_at: int):
+    """Reprograma un temporizador que falló y suma un intento"""
+    async with pool.acquire() as conn:
+        await conn.execute(
+            'UPDATE scheduled_jobs SET run_at = $2, attempts = attempts + 1 WHERE id = $1', job_id, run_at
+        )
+
+async def get_scheduled_jobs() -> list:
+    """Todos los temporizadores pendientes: [(id, name, job_key, run_at, payload, attempts)]"""
+    async with pool.acquire() as conn:
+        results = await conn.fetch('SELECT id, name, job_key, run_at, payload, attempts FROM scheduled_jobs')
+        return [
+            (row['id'], row['name'], row['job_key'], row['run_at'],
+             json.loads(row['payload'] or '{}'), row['attempts'])
+            for row in results
+        ]
+
+# ==========================================
+# FUNCIONES PARA EL SISTEMA DE TICKETS
+# ==========================================
+
+TICKET_COLUMNS = 'id, channel_id, user_id, category, created_at, closed_at, claimed_by, closed_by, status, priority'
+
+async def create_ticket_record(channel_id: int, user_id: int, category: str, status: str = 'abierto'):
+    """Crea el registro de un ticket"""
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            INSERT INTO tickets (channel_id, user_id, category, status)
+            VALUES ($1, $2, $3, $4)
+        """, channel_id, user_id, category, status)
+
+async def update_ticket_claim(channel_id: int, claimed_by: int):
+    """Actualiza quién reclamó el ticket"""
+    async with pool.acquire() as conn:
+        await conn.execute('UPDATE tickets SET claimed_by = $1 WHERE channel_id = $2', claimed_by, channel_id)
+
+async def close_ticket_record(channel_id: int, closed_by: int):
+    """Marca un ticket como cerrado"""
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE tickets 
+            SET status = 'cerrado', closed_at = CURRENT_TIMESTAMP, closed_by = $1
+            WHERE channel_id = $2
+        """, closed_by, channel_id)
+
+async def get_user_open_tickets(user_id: int) -> list:
+    """Tickets abiertos de un usuario: [(channel_id, category)]"""
+    async with pool.acquire() as conn:
+        results = await conn.fetch("""
+            SELECT channel_id, category FROM tickets 
+            WHERE user_id = $1 AND status = 'abierto'
+        """, user_id)
+        return [(row['channel_id'], row['category']) for row in results]
+
+async def get_ticket(channel_id: int) -> tuple:
+    """Ticket completo de un canal (mismo orden de columnas que la tabla) o None"""
+    async with pool.acquire() as conn:
+        result = await conn.fetchrow(f'SELECT {TICKET_COLUMNS} FROM tickets WHERE channel_id = $1', channel_id)
+        return tuple(result) if result else None
+
+async def get_open_tickets() -> list:
+    """Tickets abiertos: [(channel_id, user_id, category, created_at, claimed_by)], los más recientes primero"""
+    async with pool.acquire() as conn:
+        results = await conn.fetch("""
+            SELECT channel_id, user_id, category, created_at, claimed_by 
+            FROM tickets 
+            WHERE status = 'abierto' 
+            ORDER BY created_at DESC
+        """)
+        return [tuple(row) for row in results]
+
+async def get_ticket_stats(user_id: int = None) -> dict:
+    """Estadísticas por categoría (de un usuario o generales) y, si son generales, top de usuarios y staff"""
+    async with pool.acquire() as conn:
+        user_filter = 'WHERE user_id = $1' if user_id else ''
+        categories = await conn.fetch(f"""
+            SELECT category, COUNT(*) AS total, 
+                   COUNT(*) FILTER (WHERE status = 'abierto') AS abiertos,
+                   COUNT(*) FILTER (WHERE status = 'cerrado') AS cerrados
+            FROM tickets {user_filter} GROUP BY category
+        """, *([user_id] if user_id else []))
+        
+        stats = {
+            'categories': [(row['category'], row['total'], row['abiertos'], row['cerrados']) for row in categories],
+            'top_users': [],
+            'top_staff': []
+        }
+        if user_id:
+            return stats
+        
+        top_users = await conn.fetch("""
+            SELECT user_id, COUNT(*) AS total_tickets 
+            FROM tickets 
+            GROUP BY user_id 
+            ORDER BY total_tickets DESC 
+            LIMIT 5
+        """)
+        top_staff = await conn.fetch("""
+            SELECT claimed_by, COUNT(*) AS claims 
+            FROM tickets 
+            WHERE claimed_by IS NOT NULL 
+            GROUP BY claimed_by 
+            ORDER BY claims DESC 
+            LIMIT 5
+        """)
+        stats['top_users'] = [(row['user_id'], row['total_tickets']) for row in top_users]
+        stats['top_staff'] = [(row['claimed_by'], row['claims']) for row in top_staff]
+        return stats
+
+async def count_tickets() -> tuple:
+    """Devuelve (total de tickets, tickets abiertos)"""
+    async with pool.acquire() as conn:
+        result = await conn.fetchrow("""
+            SELECT COUNT(*) AS total, COUNT(*) FILTER (WHERE status = 'abierto') AS abiertos
+            FROM tickets
+        """)
+        return result['total'], result['abiertos']
+
+def _read_sqlite_tickets(path: str) -> tuple:
+    """Lee tickets.db (se ejecuta en un hilo: sqlite3 es bloqueante)"""
+    import sqlite3
+    conn = sqlite3.connect(path)
+    try:
+        tickets = conn.execute(f'SELECT {TICKET_COLUMNS} FROM tickets').fetchall()
+        try:
+            messages = conn.execute(
+                'SELECT ticket_id, user_id, message_content, timestamp FROM ticket_messages'
+            ).fetchall()
+        except sqlite3.OperationalError:
+            messages = []
+        return tickets, messages
+    finally:
+        conn.close()
+
+def _parse_sqlite_timestamp(value):
+    return datetime.fromisoformat(value) if value else None
+
+async def migrate_sqlite_tickets(path: str = 'tickets.db') -> int:
+    """Copia una sola vez los tickets del antiguo tickets.db a PostgreSQL y renombra el archivo"""
+    if not os.path.exists(path):
+        return 0
+    
+    tickets, messages = await asyncio.to_thread(_read_sqlite_tickets, path)
+    
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            rows = [
+                (id_, channel_id, user_id, category, _parse_sqlite_timestamp(created_at),
+                 _parse_sqlite_timestamp(closed_at), claimed_by, closed_by, status or 'abierto', priority or 'normal')
+                for (id_, channel_id, user_id, category, created_at,
+                     closed_at, claimed_by, closed_by, status, priority) in tickets
+            ]
+            
+            # {id en SQLite: id en PostgreSQL}; se conserva el id siempre que esté libre
+            id_map = {}
+            collided = []
+            for row in rows:
+                new_id = await conn.fetchval(f"""
+                    INSERT INTO tickets ({TICKET_COLUMNS})
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
+                """, *row)
+                if new_id is not None:
+                    id_map[row[0]] = new_id
+                else:
+                    collided.append(row)
+            
+            # Ajustar la secuencia tras insertar ids explícitos
+            await conn.execute("""
+                SELECT setval(pg_get_serial_sequence('tickets', 'id'), COALESCE(MAX(id), 0) + 1, false)
+                FROM tickets
+            """)
+            
+            # Id ocupado por otro ticket: insertar con un id nuevo, salvo que el canal ya esté
+            # migrado (ticket repetido); sus mensajes se omiten en ese caso
+            columns = TICKET_COLUMNS.split(', ', 1)[1]
+            for row in collided:
+                new_id = await conn.fetchval(f"""
+                    INSERT INTO tickets ({columns})
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
+                """, *row[1:])
+                if new_id is not None:
+                    id_map[row[0]] = new_id
+            
+            await conn.executemany("""
+                INSERT INTO ticket_messages (ticket_id, user_id, message_content, timestamp)
+                VALUES ($1, $2, $3, $4)
+            """, [
+                (id_map[ticket_id], user_id, content, _parse_sqlite_timestamp(timestamp))
+                for ticket_id, user_id, content, timestamp in messages
+                if ticket_id in id_map
+            ])
+    
+    os.replace(path, f"{path}.migrated")
+    return len(id_map)
+
+
+# ==========================================
+# INSTRUMENTACIÓN
+# ==========================================
+
+# Medir cada función pública de este módulo (las consultas se atribuyen a la función que las lanza)
+for _name, _func in list(globals().items()):
+    if (not _name.startswith('_') and asyncio.iscoroutinefunction(_func)
+            and getattr(_func, '__module__', None) == __name__):
+        globals()[_name] = instrument(_func)
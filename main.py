@@ -1,8 +1,15 @@
 import os
+import io
+import json
 import asyncio
 from discord.ext import commands
 from dotenv import load_dotenv
 from database import connect_db
+from core.render_pool import shutdown_render_pool
+from core.http import close_session
+from core.scheduler import scheduler
+from core.guild_config import guild_configs
+from core import db_metrics, metrics
 
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
@@ -97,6 +104,45 @@ async def reload_cogs(ctx):
     await load_cogs()
     await ctx.send("✅ Módulos recargados")
 
+@bot.command(name="dbstats")
+@commands.is_owner()
+async def db_stats(ctx, top: int = 10):
+    """Funciones de la base de datos más lentas (p95) y exportación JSON completa"""
+    stats = db_metrics.snapshot()
+    ranking = sorted(
+        ((name, values['total']) for name, values in stats['functions'].items() if 'total' in values),
+        key=lambda item: item[1]['p95'],
+        reverse=True
+    )[:max(1, min(top, 25))]
+
+    embed = discord.Embed(
+        title="🗄️ Latencia de la base de datos",
+        description=f"Consultas lentas (≥ {stats['slow_query_ms']:.0f} ms) registradas: **{len(stats['slow_queries'])}**",
+        color=0x00ffff
+    )
+    if ranking:
+        lines = [
+            f"`{name}` · p95 **{values['p95']:.0f}ms** · p99 {values['p99']:.0f}ms · n={values['count']}"
+            for name, values in ranking
+        ]
+        embed.add_field(name="Top por p95", value="\n".join(lines)[:1024], inline=False)
+    else:
+        embed.add_field(name="Top por p95", value="Sin datos todavía", inline=False)
+
+    gauges = metrics.snapshot()['gauges']
+    if 'db.pool.size' in gauges:
+        embed.add_field(
+            name="Pool",
+            value=(f"En uso **{gauges['db.pool.in_use']}** / {gauges['db.pool.max_size']} · "
+                   f"libres {gauges['db.pool.idle']} · en espera {gauges['db.pool.waiters']} · "
+                   f"timeouts {gauges['db.pool.acquire_timeouts']}"),
+            inline=False
+        )
+
+    export = json.dumps({'database': stats, 'metrics': metrics.snapshot()}, indent=2, default=str)
+    file = discord.File(io.BytesIO(export.encode()), filename="dbstats.json")
+    await ctx.send(embed=embed, file=file)
+
 @bot.event
 async def on_command_error(ctx, error):
     if isinstance(error, commands.CommandNotFound):
@@ -154,6 +200,8 @@ async def main():
     try:
         await connect_db()
         print("✅ Base de datos conectada")
+        await scheduler.start()
+        await guild_configs.start()
         async with bot:
             await bot.start(TOKEN)
     except discord.LoginFailure:
@@ -165,6 +213,10 @@ async def main():
     except Exception as e:
         print(f"❌ Error inesperado: {e}")
     finally:
+        await scheduler.stop()
+        await guild_configs.stop()
+        shutdown_render_pool()
+        await close_session()
         print("👋 Bot desconectado")
 
 if __name__ == "__main__":
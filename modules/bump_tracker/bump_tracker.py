@@ -1,8 +1,8 @@
 import discord
 from discord.ext import commands
-import asyncio
 from datetime import datetime, timezone
 from database import add_bump, get_bumps, get_all_bumps
+from core.scheduler import scheduler
 
 # Configuración del Bump Tracker
 DISBOARD_BOT_ID = 302050872383242240
@@ -15,8 +15,13 @@ EMBED_COLOR = 0x00ffff
 class BumpTracker(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.tasks: dict[int, asyncio.Task] = {}
         self.pending_bumps: dict[int, int] = {}  # guild_id → user_id que ejecutó el bump
+        
+        # Los recordatorios se guardan en el planificador persistente (sobreviven a reinicios)
+        scheduler.register('bump_reminder', self._recordatorio)
+
+    async def cog_unload(self):
+        scheduler.unregister('bump_reminder')
 
     # ────────────────────────────────────────
     # Comando de ayuda para bumps
@@ -270,28 +275,27 @@ class BumpTracker(commands.Cog):
         except Exception as e:
             print(f"[BUMP DEBUG] ❌ Error enviando mensaje de agradecimiento: {e}")
 
-        # Programar recordatorio
+        # Programar recordatorio (reemplaza el anterior del servidor si existe)
         try:
-            # Cancelar tarea previa si existe
-            if task := self.tasks.get(guild_id):
-                task.cancel()
-                print(f"[BUMP DEBUG] Tarea anterior cancelada")
-            
-            # Crear nueva tarea de recordatorio
-            self.tasks[guild_id] = self.bot.loop.create_task(self._recordatorio(message.channel))
+            await scheduler.schedule(
+                'bump_reminder', COUNTDOWN, {'channel_id': message.channel.id}, key=str(guild_id)
+            )
             print(f"[BUMP DEBUG] ✅ Recordatorio programado para 2 horas")
         except Exception as e:
             print(f"[BUMP DEBUG] ❌ Error programando recordatorio: {e}")
 
-    async def _recordatorio(self, channel: discord.TextChannel):
-        try:
-            print(f"[BUMP DEBUG] Recordatorio iniciado, esperando {COUNTDOWN} segundos...")
-            await asyncio.sleep(COUNTDOWN)
-            print(f"[BUMP DEBUG] Tiempo de espera completado, enviando recordatorio")
-        except asyncio.CancelledError:
-            print(f"[BUMP DEBUG] Recordatorio cancelado")
+    async def _recordatorio(self, payload: dict):
+        """Handler del planificador: envía el recordatorio de bump (o el de prueba)"""
+        channel = self.bot.get_channel(payload['channel_id'])
+        if channel is None:
+            print(f"[BUMP DEBUG] Canal {payload['channel_id']} no encontrado, recordatorio descartado")
             return
-
+        
+        if payload.get('test'):
+            await self._recordatorio_test(channel)
+            return
+        
+        print(f"[BUMP DEBUG] Tiempo de espera completado, enviando recordatorio")
         try:
             role = channel.guild.get_role(ROLE_ID_TO_PING)
             mention = role.mention if role else "@here"
@@ -309,6 +313,7 @@ class BumpTracker(commands.Cog):
             print(f"[BUMP DEBUG] ✅ Recordatorio enviado exitosamente")
         except Exception as e:
             print(f"[BUMP DEBUG] ❌ Error enviando recordatorio: {e}")
+            raise  # el planificador lo reintentará
 
     # ────────────────────────────────────────
     # Función auxiliar para obtener ranking
@@ -500,7 +505,7 @@ class BumpTracker(commands.Cog):
         
         # Estado actual
         pending_count = len(self.pending_bumps)
-        active_tasks = len([t for t in self.tasks.values() if not t.done()])
+        active_tasks = len(scheduler.pending('bump_reminder'))
         
         embed.add_field(
             name="📊 Estado Actual",
@@ -597,12 +602,10 @@ class BumpTracker(commands.Cog):
             )
             await ctx.send(embed=thanks)
             
-            # Cancelar tarea previa si existe y crear nueva (con countdown reducido para test)
-            if task := self.tasks.get(guild_id):
-                task.cancel()
-            
-            # Crear tarea de recordatorio de prueba (30 segundos para test)
-            self.tasks[guild_id] = self.bot.loop.create_task(self._recordatorio_test(ctx.channel))
+            # Reemplazar el recordatorio del servidor por uno de prueba (30 segundos)
+            await scheduler.schedule(
+                'bump_reminder', 30, {'channel_id': ctx.channel.id, 'test': True}, key=str(guild_id)
+            )
             
             await ctx.send("✅ **Test iniciado** - Recordatorio en 30 segundos")
             print(f"[BUMP DEBUG] Test bump ejecutado por {user_id}")
@@ -613,13 +616,7 @@ class BumpTracker(commands.Cog):
 
     async def _recordatorio_test(self, channel: discord.TextChannel):
         """Recordatorio de prueba con tiempo reducido"""
-        try:
-            print(f"[BUMP DEBUG] Test recordatorio iniciado, esperando 30 segundos...")
-            await asyncio.sleep(30)  # 30 segundos para test
-            print(f"[BUMP DEBUG] Test recordatorio - tiempo completado")
-        except asyncio.CancelledError:
-            print(f"[BUMP DEBUG] Test recordatorio cancelado")
-            return
+        print(f"[BUMP DEBUG] Test recordatorio - tiempo completado")
 
         try:
             role = channel.guild.get_role(ROLE_ID_TO_PING)
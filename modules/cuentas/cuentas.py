@@ -1,8 +1,9 @@
 import discord
 from discord.ext import commands
 import asyncio
-import os
+import io
 import logging
+from core.assets import assets
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -179,10 +180,10 @@ class Cuentas(commands.Cog):
             )
             
             # Intentar enviar con imagen si existe
-            image_path = f"resources/images/{config['imagen']}"
-            if os.path.exists(image_path):
+            image_bytes = assets.get_file(f"resources/images/{config['imagen']}")
+            if image_bytes:
                 embed.set_image(url=f"attachment://{config['imagen']}")
-                file = discord.File(image_path, filename=config['imagen'])
+                file = discord.File(io.BytesIO(image_bytes), filename=config['imagen'])
                 message = await channel.send(file=file, embed=embed, view=view)
             else:
                 logger.info(f"ℹ️ Imagen {config['imagen']} no encontrada, enviando sin imagen")
@@ -8,6 +8,7 @@ import asyncio
 import os
 import re
 import database
+from core.card_cache import card_cache
 
 class ConfirmPurchaseView(View):
     def __init__(self, user_id, producto, precio):
@@ -37,6 +38,8 @@ class ConfirmPurchaseView(View):
         success, message = await database.purchase_product(self.user_id, self.producto, self.precio)
         
         if success:
+            # El balance aparece en la tarjeta de perfil (se invalida ya confirmada la compra)
+            card_cache.invalidate(self.user_id)
             nuevo_saldo = await database.get_user_balance(self.user_id)
             embed = discord.Embed(
                 title="✅ Compra exitosa",
@@ -141,6 +144,7 @@ class Economia(commands.Cog):
                 'DEPOSITO', 
                 f'Depósito de {monto_decimal:.2f}€ por {ctx.author}'
             )
+            card_cache.invalidate(usuario.id)
             
             embed = discord.Embed(
                 title="✅ Dinero agregado",
@@ -194,6 +198,7 @@ class Economia(commands.Cog):
                 'RETIRO', 
                 f'Retiro de {monto_decimal:.2f}€ por {ctx.author}'
             )
+            card_cache.invalidate(usuario.id)
             
             embed = discord.Embed(
                 title="✅ Dinero retirado",
@@ -231,6 +236,7 @@ class Economia(commands.Cog):
                 'AJUSTE', 
                 f'Saldo establecido a {monto_decimal:.2f}€ por {ctx.author}'
             )
+            card_cache.invalidate(usuario.id)
             
             embed = discord.Embed(
                 title="✅ Saldo establecido",
@@ -774,6 +780,7 @@ class Economia(commands.Cog):
                         'TRANSFERENCIA_SALIDA', 
                         f'Transferencia de {monto_decimal:.2f}€ a {usuario} (aprobada por {staff_user})'
                     )
+                    card_cache.invalidate(ctx.author.id)
                     
                     await database.update_user_balance(
                         usuario.id, 
@@ -782,6 +789,7 @@ class Economia(commands.Cog):
                         'TRANSFERENCIA_ENTRADA', 
                         f'Transferencia de {monto_decimal:.2f}€ desde {ctx.author} (aprobada por {staff_user})'
                     )
+                    card_cache.invalidate(usuario.id)
                     
                     embed = discord.Embed(
                         title="✅ Transferencia aprobada",
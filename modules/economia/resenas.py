@@ -6,6 +6,7 @@ import datetime
 from typing import Dict, Set, Optional, List
 from decimal import Decimal
 import database
+from core.card_cache import card_cache
 
 class MontoModal(discord.ui.Modal):
     def __init__(self, canal_id: int, usuario_id: int, precio_total: float):
@@ -109,6 +110,7 @@ class ConfirmarTerminar(discord.ui.View):
                 'PAGO_RESEÑA',
                 f'Pago por reseña completada: {self.monto_pagar:.2f}€'
             )
+            card_cache.invalidate(self.usuario_id)
             
         except Exception as e:
             print(f"Error actualizando saldo: {e}")
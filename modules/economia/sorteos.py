@@ -2,9 +2,13 @@ import discord
 from discord.ext import commands
 import asyncio
 import random
-from database import update_user_balance, get_user_balance, add_transaction
+import hashlib
+import time
+from database import pay_raffle_prize
 from decimal import Decimal
 from datetime import datetime
+from core.scheduler import scheduler
+from core.card_cache import card_cache
 
 class Sorteos(commands.Cog):
     def __init__(self, bot):
@@ -15,6 +19,16 @@ class Sorteos(commands.Cog):
         self.rol_participante_id = 1400106792196898890
         self.participantes_requeridos = 10
         
+        # Las esperas del sorteo (10 min hasta el ganador, 5 min hasta la nueva ronda) son
+        # temporizadores persistentes: si el bot se reinicia, el sorteo continúa donde iba
+        scheduler.register('sorteo_ganador', self.elegir_ganador)
+        scheduler.register('sorteo_nueva_ronda', self.nueva_ronda)
+        self.sorteo_activo = bool(scheduler.pending('sorteo_ganador') or scheduler.pending('sorteo_nueva_ronda'))
+
+    async def cog_unload(self):
+        scheduler.unregister('sorteo_ganador')
+        scheduler.unregister('sorteo_nueva_ronda')
+        
     def crear_embed_espera(self):
         """Crea el embed de espera para el sorteo"""
         embed = discord.Embed(
@@ -172,30 +186,53 @@ class Sorteos(commands.Cog):
                 embed=embed_inicio
             )
             
-            # Esperar 10 minutos (600 segundos)
-            await asyncio.sleep(600)
+            # Elegir ganador dentro de 10 minutos (600 segundos)
+            await scheduler.schedule(
+                'sorteo_ganador', 600,
+                {
+                    'canal_id': canal.id,
+                    'participantes': [p.id for p in participantes],
+                    'sorteo_id': f"{canal.id}-{int(time.time())}",
+                },
+                key='sorteo'
+            )
             
-            # Elegir ganador aleatorio
-            ganador = random.choice(participantes)
+        except Exception as e:
+            print(f"Error en sorteo: {e}")
+            self.sorteo_activo = False
+
+    async def elegir_ganador(self, payload: dict):
+        """Handler del planificador: elige el ganador y paga el premio"""
+        self.sorteo_activo = True
+        canal = self.bot.get_channel(payload['canal_id'])
+        if canal is None:
+            print(f"❌ Canal de sorteo {payload['canal_id']} no encontrado")
+            self.sorteo_activo = False
+            return
+        
+        try:
+            rol = canal.guild.get_role(self.rol_participante_id)
+            participantes = [
+                member for member in map(canal.guild.get_member, payload['participantes']) if member
+            ]
+            if not participantes:
+                print("⚠️ Ningún participante sigue en el servidor, sorteo cancelado")
+                await self.nueva_ronda(payload)
+                return
             
-            # Agregar dinero al ganador
-            saldo_actual = await get_user_balance(ganador.id)
-            nuevo_saldo = saldo_actual + Decimal('1.00')
-            await update_user_balance(
-                ganador.id, 
-                nuevo_saldo, 
-                self.bot.user.id, 
-                'PREMIO_SORTEO', 
-                'Premio por ganar sorteo de €1.00'
-            )
+            # Identificador del sorteo (los temporizadores antiguos no lo traen: se deriva del payload)
+            sorteo_id = payload.get('sorteo_id') or hashlib.sha1(
+                f"{payload['canal_id']}:{payload['participantes']}".encode()
+            ).hexdigest()
             
-            # Registrar transacción
-            await add_transaction(
-                ganador.id, 
-                'PREMIO', 
-                1.00, 
-                'Ganador del sorteo - €1.00'
+            # Elegir ganador aleatorio y pagar el premio una sola vez: si el temporizador
+            # se repite tras un reinicio, se conserva el ganador ya pagado
+            ganador_id, pagado = await pay_raffle_prize(
+                sorteo_id, random.choice(participantes).id, Decimal('1.00'), self.bot.user.id
             )
+            if pagado:
+                card_cache.invalidate(ganador_id)
+            ganador = canal.guild.get_member(ganador_id) or await self.bot.fetch_user(ganador_id)
             
             # ✅ ENVIAR LOG AL CANAL PERMANENTE
             await self.enviar_log_ganador(ganador, len(participantes))
@@ -218,13 +255,23 @@ class Sorteos(commands.Cog):
             )
             
             # Esperar 5 minutos antes de limpiar y empezar nueva ronda
-            await asyncio.sleep(300)  # 300 segundos = 5 minutos
-            await canal.purge(limit=100)
-            
-            # Enviar embed para nueva ronda
-            embed_nueva_ronda = self.crear_embed_espera()
-            await canal.send(embed=embed_nueva_ronda)
+            await scheduler.schedule('sorteo_nueva_ronda', 300, {'canal_id': canal.id}, key='sorteo')
             
+        except Exception as e:
+            print(f"Error en sorteo: {e}")
+            self.sorteo_activo = False
+            raise  # el planificador lo reintentará (el pago no se repite)
+
+    async def nueva_ronda(self, payload: dict):
+        """Handler del planificador: limpia el canal y abre una nueva ronda"""
+        try:
+            canal = self.bot.get_channel(payload['canal_id'])
+            if canal:
+                await canal.purge(limit=100)
+                
+                # Enviar embed para nueva ronda
+                embed_nueva_ronda = self.crear_embed_espera()
+                await canal.send(embed=embed_nueva_ronda)
         except Exception as e:
             print(f"Error en sorteo: {e}")
         finally:
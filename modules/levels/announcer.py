@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+import discord
+from core import metrics
+
+# Configuración de los anuncios (variables de entorno opcionales)
+ANNOUNCE_COALESCE_SECONDS = float(os.getenv("ANNOUNCE_COALESCE_SECONDS", "3"))   # ventana para juntar subidas
+ANNOUNCE_MIN_INTERVAL = float(os.getenv("ANNOUNCE_MIN_INTERVAL", "1.2"))         # segundos entre envíos por canal
+ANNOUNCE_PACK_THRESHOLD = int(os.getenv("ANNOUNCE_PACK_THRESHOLD", "3"))         # cola a partir de la que se agrupa
+ANNOUNCE_PACK_MAX = int(os.getenv("ANNOUNCE_PACK_MAX", "10"))                    # usuarios por mensaje agrupado
+
+
+class Announcement:
+    __slots__ = ('member', 'old_level', 'new_level')
+
+    def __init__(self, member, old_level: int, new_level: int):
+        self.member = member
+        self.old_level = old_level
+        self.new_level = new_level
+
+
+class LevelUpAnnouncer:
+    """Cola de anuncios de subida de nivel por canal, separada del cálculo de XP.
+
+    Las subidas del mismo usuario dentro de la ventana se fusionan (del nivel más
+    bajo al más alto), cada canal envía de uno en uno respetando un intervalo
+    mínimo y, si la cola crece, varios usuarios se anuncian en un solo mensaje.
+    """
+
+    def __init__(self, build_embed):
+        # Función (member, new_level, old_level) -> discord.Embed para los anuncios individuales
+        self.build_embed = build_embed
+        self.queues = {}    # {channel_id: {(guild_id, user_id): Announcement}} en orden de llegada
+        self.channels = {}  # {channel_id: canal}
+        self.workers = {}   # {channel_id: Task}
+
+        metrics.register_gauge('announcer.queued', lambda: sum(len(queue) for queue in self.queues.values()))
+        metrics.register_gauge('announcer.channels', lambda: len(self.workers))
+
+    def enqueue(self, channel, member, old_level: int, new_level: int):
+        """Encola un anuncio sin esperar al envío"""
+        queue = self.queues.setdefault(channel.id, {})
+        self.channels[channel.id] = channel
+        key = (member.guild.id, member.id)
+
+        pending = queue.get(key)
+        if pending is not None:
+            pending.member = member
+            pending.old_level = min(pending.old_level, old_level)
+            pending.new_level = max(pending.new_level, new_level)
+            metrics.incr('announcer.coalesced')
+        else:
+            queue[key] = Announcement(member, old_level, new_level)
+
+        worker = self.workers.get(channel.id)
+        if worker is None or worker.done():
+            self.workers[channel.id] = asyncio.create_task(self._worker(channel.id))
+
+    async def close(self):
+        """Detiene los envíos pendientes (cog_unload)"""
+        for worker in self.workers.values():
+            worker.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        self.workers.clear()
+        self.queues.clear()
+        self.channels.clear()
+
+    def _take(self, queue: dict) -> list:
+        count = min(len(queue), ANNOUNCE_PACK_MAX) if len(queue) >= ANNOUNCE_PACK_THRESHOLD else 1
+        keys = list(queue)[:count]
+        return [queue.pop(key) for key in keys]
+
+    def _packed_embed(self, batch: list) -> discord.Embed:
+        lines = [
+            f"{item.member.mention} · nivel **{item.old_level}** → **{item.new_level}**"
+            for item in batch
+        ]
+        return discord.Embed(
+            title="⬆️ Subidas de nivel",
+            description="\n".join(lines),
+            color=0x0099ff
+        )
+
+    async def _worker(self, channel_id: int):
+        # Esperar un momento para fusionar ráfagas (p. ej. un tick de XP automático)
+        await asyncio.sleep(ANNOUNCE_COALESCE_SECONDS)
+        queue = self.queues.get(channel_id)
+        channel = self.channels.get(channel_id)
+
+        while queue:
+            batch = self._take(queue)
+            if len(batch) == 1:
+                item = batch[0]
+                content, embed = item.member.mention, self.build_embed(item.member, item.new_level, item.old_level)
+            else:
+                metrics.incr('announcer.packed', len(batch))
+                content, embed = " ".join(item.member.mention for item in batch), self._packed_embed(batch)
+
+            start = time.perf_counter()
+            try:
+                await channel.send(content=content, embed=embed)
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    # Limitado por Discord: devolver a la cola y esperar
+                    for item in batch:
+                        queue.setdefault((item.member.guild.id, item.member.id), item)
+                    metrics.incr('announcer.rate_limited')
+                    await asyncio.sleep(getattr(e, 'retry_after', None) or 5)
+                    continue
+                metrics.incr('announcer.error')
+                print(f"Error enviando anuncio de nivel: {e}")
+            except Exception as e:
+                metrics.incr('announcer.error')
+                print(f"Error enviando anuncio de nivel: {e}")
+            finally:
+                metrics.histogram('announcer.send').observe((time.perf_counter() - start) * 1000)
+
+            await asyncio.sleep(ANNOUNCE_MIN_INTERVAL)
+
+        self.queues.pop(channel_id, None)
+        self.channels.pop(channel_id, None)
+        self.workers.pop(channel_id, None)
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import time
+import discord
+from core import metrics
+
+# Configuración del leaderboard (variables de entorno opcionales)
+LEADERBOARD_PAGE_SIZE = int(os.getenv("LEADERBOARD_PAGE_SIZE", "10"))      # usuarios por página
+LEADERBOARD_MAX_PAGES = int(os.getenv("LEADERBOARD_MAX_PAGES", "10"))      # páginas que se preparan
+LEADERBOARD_TTL = float(os.getenv("LEADERBOARD_TTL", "120"))               # vida máxima de una foto
+LEADERBOARD_MIN_AGE = float(os.getenv("LEADERBOARD_MIN_AGE", "15"))        # edad mínima antes de rehacerla por XP nueva
+LEADERBOARD_VIEW_TIMEOUT = int(os.getenv("LEADERBOARD_VIEW_TIMEOUT", "120"))
+
+MEDALS = ["🥇", "🥈", "🥉"]
+
+
+class LeaderboardPages:
+    """Foto de un leaderboard: líneas ya formateadas de los miembros presentes, en orden"""
+
+    __slots__ = ('lines', 'version', 'built_at')
+
+    def __init__(self, lines: list, version: int):
+        self.lines = lines
+        self.version = version
+        self.built_at = time.monotonic()
+
+    @property
+    def page_count(self) -> int:
+        return max(1, -(-len(self.lines) // LEADERBOARD_PAGE_SIZE))
+
+    def page(self, number: int) -> list:
+        start = number * LEADERBOARD_PAGE_SIZE
+        return self.lines[start:start + LEADERBOARD_PAGE_SIZE]
+
+
+class LeaderboardCache:
+    """Páginas del leaderboard por servidor y período, construidas desde el índice de rankings.
+
+    Se piden más filas de las necesarias para compensar a quienes ya no están en el
+    servidor, así cada página sale completa. Una foto se rehace al superar el TTL o,
+    si el ranking cambió (XP nueva), cuando tiene al menos LEADERBOARD_MIN_AGE segundos.
+    """
+
+    def __init__(self, ranking, curve):
+        self.ranking = ranking
+        self.curve = curve
+        self.pages = {}      # {(guild_id, period): LeaderboardPages}
+        self._building = {}  # {(guild_id, period): Task} construcciones en curso
+
+        metrics.register_gauge('leaderboard.cached', lambda: len(self.pages))
+
+    def _fresh(self, guild_id: int, cached: LeaderboardPages) -> bool:
+        age = time.monotonic() - cached.built_at
+        if age >= LEADERBOARD_TTL:
+            return False
+        return cached.version == self.ranking.version(guild_id) or age < LEADERBOARD_MIN_AGE
+
+    async def get(self, guild: discord.Guild, period: str = 'total') -> LeaderboardPages:
+        """Páginas del leaderboard desde la caché (o construidas si están obsoletas)"""
+        key = (guild.id, period)
+        cached = self.pages.get(key)
+        if cached is not None and self._fresh(guild.id, cached):
+            metrics.incr('leaderboard.hit')
+            return cached
+
+        task = self._building.get(key)
+        if task is None:
+            task = self._building[key] = asyncio.create_task(self._build(guild, period))
+            task.add_done_callback(lambda _: self._building.pop(key, None))
+        return await task
+
+    def invalidate(self, guild_id: int):
+        for key in [key for key in self.pages if key[0] == guild_id]:
+            del self.pages[key]
+
+    async def _build(self, guild: discord.Guild, period: str) -> LeaderboardPages:
+        with metrics.timer('leaderboard.build'):
+            wanted = LEADERBOARD_PAGE_SIZE * LEADERBOARD_MAX_PAGES
+            version = self.ranking.version(guild.id)
+            rows = []
+            offset = 0
+            while len(rows) < wanted:
+                # Pedir el doble de lo que falta: los que se fueron del servidor no cuentan
+                chunk = (wanted - len(rows)) * 2
+                batch = await self.ranking.top(guild.id, limit=chunk, period=period, offset=offset)
+                offset += len(batch)
+                for entry in batch:
+                    member = guild.get_member(entry['user_id'])
+                    if member is not None and not member.bot:
+                        rows.append((member.display_name, entry['xp']))
+                if len(batch) < chunk:
+                    break
+            rows = rows[:wanted]
+
+            levels = self.curve.levels_for(xp for _, xp in rows)
+            lines = []
+            for position, ((name, xp), level) in enumerate(zip(rows, levels), 1):
+                position_emoji = MEDALS[position - 1] if position <= 3 else f"`{position}.`"
+                lines.append(f"{position_emoji} **{discord.utils.escape_markdown(name)}** - Nivel {level} ({xp:,} XP)")
+
+            pages = LeaderboardPages(lines, version)
+            self.pages[(guild.id, period)] = pages
+            return pages
+
+
+def leaderboard_embed(title: str, pages: LeaderboardPages, number: int) -> discord.Embed:
+    """Embed de una página del leaderboard"""
+    embed = discord.Embed(
+        title=title,
+        description="\n".join(pages.page(number)) or "No se encontraron usuarios válidos.",
+        color=0x00ffff
+    )
+    embed.set_footer(text=f"Página {number + 1}/{pages.page_count} · {len(pages.lines)} usuarios")
+    return embed
+
+
+class LeaderboardView(discord.ui.View):
+    """Botones de paginación; cada página sale de la caché, sin volver a consultar"""
+
+    def __init__(self, cache: LeaderboardCache, guild: discord.Guild, period: str, title: str,
+                 author_id: int, pages: LeaderboardPages):
+        super().__init__(timeout=LEADERBOARD_VIEW_TIMEOUT)
+        self.cache = cache
+        self.guild = guild
+        self.period = period
+        self.title = title
+        self.author_id = author_id
+        self.page = 0
+        self.message = None
+        self._update_buttons(pages)
+
+    def _update_buttons(self, pages: LeaderboardPages):
+        self.previous_page.disabled = self.page <= 0
+        self.next_page.disabled = self.page >= pages.page_count - 1
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("❌ Usa `!lb` para ver tu propio ranking.", ephemeral=True)
+            return False
+        return True
+
+    async def _show(self, interaction: discord.Interaction, step: int):
+        try:
+            pages = await self.cache.get(self.guild, self.period)
+            self.page = min(max(0, self.page + step), pages.page_count - 1)
+            self._update_buttons(pages)
+            await interaction.response.edit_message(embed=leaderboard_embed(self.title, pages, self.page), view=self)
+        except Exception as e:
+            print(f"Error paginando el leaderboard: {e}")
+            await interaction.response.send_message("❌ Ocurrió un error al cambiar de página.", ephemeral=True)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, -1)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, 1)
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
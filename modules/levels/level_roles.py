@@ -0,0 +1,107 @@
+import asyncio
+import os
+from bisect import bisect_right
+import discord
+from core import metrics
+
+# Configuración de la resincronización de roles (variables de entorno opcionales)
+RESYNC_CONCURRENCY = int(os.getenv("RESYNC_CONCURRENCY", "3"))    # miembros editados a la vez
+RESYNC_DELAY = float(os.getenv("RESYNC_DELAY", "0.5"))            # pausa de cada worker entre ediciones
+
+
+class LevelRoleIndex:
+    """Roles por nivel de un servidor: niveles ordenados (bisección) y conjunto de ids de roles de nivel"""
+
+    def __init__(self, level_roles: dict):
+        items = sorted(level_roles.items())
+        self.levels = [level for level, _ in items]
+        self.role_ids = [role_id for _, role_id in items]
+        self.all_ids = frozenset(self.role_ids)
+
+    def target(self, level: int, stack: bool = False) -> frozenset:
+        """Roles de nivel que corresponden a `level`: el del mayor nivel alcanzado (o todos si se acumulan)"""
+        index = bisect_right(self.levels, level)
+        if index == 0:
+            return frozenset()
+        if stack:
+            return frozenset(self.role_ids[:index])
+        return frozenset((self.role_ids[index - 1],))
+
+    def reached(self, old_level: int, new_level: int):
+        """Rol del mayor nivel configurado en (old_level, new_level] (o None): el que se obtiene al subir"""
+        index = bisect_right(self.levels, new_level)
+        if index and self.levels[index - 1] > old_level:
+            return self.role_ids[index - 1]
+        return None
+
+    def role_for(self, level: int):
+        """Rol configurado exactamente para ese nivel (o None)"""
+        index = bisect_right(self.levels, level)
+        if index and self.levels[index - 1] == level:
+            return self.role_ids[index - 1]
+        return None
+
+
+# Servidores sin roles de nivel configurados (no se toca ningún rol)
+EMPTY_ROLE_INDEX = LevelRoleIndex({})
+
+
+def needs_sync(member: discord.Member, index: LevelRoleIndex, target: frozenset) -> bool:
+    """True si los roles de nivel del miembro no coinciden con `target` (sin llamadas a la API)"""
+    current = frozenset(role.id for role in member.roles if role.id in index.all_ids)
+    return current != target
+
+
+async def sync_member_roles(member: discord.Member, index: LevelRoleIndex, target: frozenset, reason: str) -> bool:
+    """Deja al miembro con exactamente los roles de nivel de `target` en una sola llamada (member.edit)"""
+    if not needs_sync(member, index, target):
+        return False
+
+    guild = member.guild
+    roles = [role for role in member.roles if not role.is_default() and role.id not in index.all_ids]
+    for role_id in target:
+        role = guild.get_role(role_id)
+        if role is None:
+            print(f"No se encontró el rol de nivel {role_id}")
+            continue
+        roles.append(role)
+
+    await member.edit(roles=roles, reason=reason)
+    metrics.incr('level_roles.edits')
+    return True
+
+
+async def resync_members(members: list, index: LevelRoleIndex, targets: dict, progress=None) -> dict:
+    """Reconcilia en lote: `targets` = {member_id: frozenset}. Concurrencia acotada y pausa ante límites de Discord"""
+    pending = [member for member in members if needs_sync(member, index, targets[member.id])]
+    stats = {'checked': len(members), 'changed': 0, 'failed': 0, 'pending': len(pending)}
+    queue = asyncio.Queue()
+    for member in pending:
+        queue.put_nowait(member)
+
+    async def worker():
+        while not queue.empty():
+            member = queue.get_nowait()
+            for attempt in range(3):
+                try:
+                    if await sync_member_roles(member, index, targets[member.id], "Resincronización de roles de nivel"):
+                        stats['changed'] += 1
+                    break
+                except discord.HTTPException as e:
+                    if e.status == 429 and attempt < 2:
+                        await asyncio.sleep(getattr(e, 'retry_after', None) or 5)
+                        continue
+                    stats['failed'] += 1
+                    print(f"Error resincronizando roles de {member}: {e}")
+                    break
+                except Exception as e:
+                    stats['failed'] += 1
+                    print(f"Error resincronizando roles de {member}: {e}")
+                    break
+            stats['pending'] -= 1
+            if progress is not None:
+                await progress(stats)
+            await asyncio.sleep(RESYNC_DELAY)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, RESYNC_CONCURRENCY))))
+    return stats
@@ -1,7 +1,5 @@
 import discord
 from discord.ext import commands, tasks
-from PIL import Image, ImageDraw, ImageFont
-import aiohttp
 import io
 import os
 import asyncio
@@ -11,17 +9,63 @@ from datetime import datetime, timedelta
 from database import (
     get_user_level_data, 
     get_user_balance, 
-    get_user_rank,
-    get_guild_level_config,
-    add_user_xp,
-    set_user_xp,
-    set_user_level,
-    get_leaderboard,
-    get_weekly_leaderboard,
-    get_monthly_leaderboard,
-    update_user_xp
+    update_user_xp,
+    grant_user_xp,
+    bulk_grant_user_xp,
+    add_voice_time,
+    get_guild_xp_snapshot,
+    seed_level_roles,
+    set_user_total_xp,
+    remove_user_xp
 )
-import math
+from modules.levels.xp_buffer import XPBuffer, XP_FLUSH_INTERVAL
+from modules.levels.ranking import RankingIndex, RANKING_RECONCILE_MINUTES
+from modules.levels.multipliers import MultiplierIndex, MULTIPLIER_SWEEP_SECONDS
+from modules.levels.voice import VoiceTracker
+from modules.levels.announcer import LevelUpAnnouncer
+from modules.levels.leaderboard import LeaderboardCache, LeaderboardView, leaderboard_embed
+from modules.levels.level_roles import LevelRoleIndex, EMPTY_ROLE_INDEX, sync_member_roles, resync_members
+from core.render_pool import get_render_pool, RenderBusy
+from core.profile_card import render_profile_card, PROFILE_AVATAR_SIZE, CARD_TEMPLATE_VERSION
+from core.card_cache import card_cache, card_digest
+from core.avatars import avatars
+from core.guild_config import guild_configs, GuildLevelConfig
+from core.cooldowns import CooldownStore
+from core.level_curve import get_curve
+from core import metrics
+
+# Subidas de nivel del XP automático que se anuncian a la vez
+LEVEL_UP_CONCURRENCY = int(os.getenv("LEVEL_UP_CONCURRENCY", "5"))
+
+# Valores del sistema antiguo para servidores sin fila en guild_config
+LEGACY_XP_COOLDOWN = 60
+LEGACY_XP_RANGE = (5, 51, 5)
+
+# Servidor original: sus roles se copian a level_roles la primera vez que el bot ve un servidor
+# que los tiene y no ha configurado otros; el canal se usa si el servidor no tiene uno propio
+LEGACY_LEVEL_UP_CHANNEL = 1400106793249538048
+LEGACY_LEVEL_ROLES = {
+    10: 1400106792196898893,
+    20: 1400106792196898894,
+    30: 1400106792196898895,
+    40: 1400106792226127914,
+    50: 1400106792226127915,
+    60: 1400106792226127916,
+    70: 1400106792226127917,
+    80: 1400106792226127918,
+    90: 1400106792226127919,
+    100: 1400106792226127920,
+    110: 1400106792226127921,
+    120: 1400106792226127922,
+    130: 1400106792226127923,
+    140: 1400106792280658061,
+    150: 1400106792280658062,
+    160: 1400106792280658063,
+    170: 1400106792280658064,
+    180: 1400106792280658065,
+    190: 1400106792280658066,
+    200: 1400106792280658067
+}
 
 class LevelsSystem(commands.Cog):
     def __init__(self, bot):
@@ -29,95 +73,61 @@ class LevelsSystem(commands.Cog):
         self.font_path = "resources/fonts" 
         self.bg_path = "resources/images/perfil"
         
-        # Canal para anuncios de level up
-        self.level_up_channel_id = 1400106793249538048
-        
-        # Roles por niveles
-        self.level_roles = {
-            10: 1400106792196898893,
-            20: 1400106792196898894,
-            30: 1400106792196898895,
-            40: 1400106792226127914,
-            50: 1400106792226127915,
-            60: 1400106792226127916,
-            70: 1400106792226127917,
-            80: 1400106792226127918,
-            90: 1400106792226127919,
-            100: 1400106792226127920,
-            110: 1400106792226127921,
-            120: 1400106792226127922,
-            130: 1400106792226127923,
-            140: 1400106792280658061,
-            150: 1400106792280658062,
-            160: 1400106792280658063,
-            170: 1400106792280658064,
-            180: 1400106792280658065,
-            190: 1400106792280658066,
-            200: 1400106792280658067
-        }
+        # Roles por nivel de cada servidor (tabla level_roles, en la foto de configuración)
+        self.role_indexes = {}   # {guild_id: (dict de roles, LevelRoleIndex)}
+        self.resyncing = set()   # servidores con una resincronización de roles en curso
         
-        # Multiplicadores de XP por rol
-        self.xp_multipliers = {}  # {role_id: {'multiplier': float, 'expires': datetime}}
+        # Multiplicadores de XP por rol (tabla xp_multipliers; se cargan en cog_load)
+        self.multipliers = MultiplierIndex()
         
         # Usuarios activos para dar XP
         self.active_users = set()
         
-        # Tabla de XP por niveles (ÚNICA FUENTE DE VERDAD)
-        self.xp_table = {
-            1: 1000, 2: 1050, 3: 1100, 4: 1150, 5: 1200, 6: 1250, 7: 1300, 8: 1355,
-            9: 1405, 10: 1455, 11: 1505, 12: 1555, 13: 1605, 14: 1660, 15: 1710,
-            16: 1760, 17: 1810, 18: 1860, 19: 1910, 20: 1960, 21: 2010, 22: 2060,
-            23: 2110, 24: 2160, 25: 2210, 26: 2260, 27: 2310, 28: 2360, 29: 2410,
-            30: 2460, 31: 2510, 32: 2560, 33: 2610, 34: 2660, 35: 2710, 36: 2760,
-            37: 2810, 38: 2860, 39: 2910, 40: 2960, 41: 3010, 42: 3060, 43: 3110,
-            44: 3160, 45: 3210, 46: 3275, 47: 3325, 48: 3375, 49: 3425, 50: 3475,
-            51: 3525, 52: 3575, 53: 3625, 54: 3675, 55: 3725, 56: 3775, 57: 3825,
-            58: 3875, 59: 3925, 60: 3975, 61: 4025, 62: 4075, 63: 4125, 64: 4175,
-            65: 4225, 66: 4275, 67: 4325, 68: 4375, 69: 4425, 70: 4475, 71: 4525,
-            72: 4575, 73: 4625, 74: 4675, 75: 4725, 76: 4775, 77: 4825, 78: 4875,
-            79: 4925, 80: 4975, 81: 5025, 82: 5075, 83: 5125, 84: 5175, 85: 5225,
-            86: 5275, 87: 5325, 88: 5375, 89: 5425, 90: 5475, 91: 5525, 92: 5575,
-            93: 5625, 94: 5675, 95: 5725, 96: 5775, 97: 5825, 98: 5875, 99: 5925,
-            100: 5975, 101: 6025, 102: 6075, 103: 6125, 104: 6175, 105: 6225,
-            106: 6275, 107: 6325, 108: 6375, 109: 6425, 110: 6475, 111: 6525,
-            112: 6575, 113: 6625, 114: 6675, 115: 6725, 116: 6775, 117: 6825,
-            118: 6875, 119: 6925, 120: 6975, 121: 7025, 122: 7075, 123: 7125,
-            124: 7175, 125: 7225, 126: 7275, 127: 7325, 128: 7375, 129: 7425,
-            130: 7475, 131: 7525, 132: 7575, 133: 7625, 134: 7675, 135: 7725,
-            136: 7775, 137: 7825, 138: 7875, 139: 7925, 140: 7975, 141: 8025,
-            142: 8075, 143: 8125, 144: 8175, 145: 8225, 146: 8275, 147: 8325,
-            148: 8375, 149: 8425, 150: 8475, 151: 8525, 152: 8575, 153: 8625,
-            154: 8675, 155: 8725, 156: 8775, 157: 8825, 158: 8875, 159: 8925,
-            160: 8975, 161: 9025, 162: 9075, 163: 9125, 164: 9175, 165: 9225,
-            166: 9275, 167: 9325, 168: 9375, 169: 9425, 170: 9475, 171: 9525,
-            172: 9575, 173: 9625, 174: 9675, 175: 9725, 176: 9775, 177: 9825,
-            178: 9875, 179: 9925, 180: 9975, 181: 10025, 182: 10075, 183: 10125,
-            184: 10175, 185: 10225, 186: 10275, 187: 10325, 188: 10375, 189: 10425,
-            190: 10475, 191: 10525, 192: 10575, 193: 10625, 194: 10675, 195: 10725,
-            196: 10775, 197: 10825, 198: 10875, 199: 10925, 200: 11675
-        }
+        # Sesiones de voz abiertas (XP de voz por minuto)
+        self.voice = VoiceTracker()
+        
+        # Cola de anuncios de subida de nivel (los envíos no bloquean la XP)
+        self.announcer = LevelUpAnnouncer(self.build_level_up_embed)
+        
+        # Curva de niveles (tabla fija, ÚNICA FUENTE DE VERDAD) y umbrales que usa la base de datos
+        self.curve = get_curve()
+        self.level_thresholds = self.curve.threshold_list()
+        
+        # Cooldowns por usuario (para evitar spam); las entradas caducadas se barren solas
+        self.user_cooldowns = CooldownStore('levels.message_xp')
+        
+        # Buffer de XP por mensajes (se escribe en lote cada XP_FLUSH_INTERVAL segundos)
+        self.xp_buffer = XPBuffer(self.level_thresholds)
         
-        # XP acumulada por nivel
-        self.cumulative_xp = {}
-        self._calculate_cumulative_xp()
+        # Índice en memoria para rankings y leaderboards (total/semanal/mensual)
+        self.ranking = RankingIndex(self.xp_buffer)
         
-        # Cooldowns por usuario (para evitar spam)
-        self.user_cooldowns = {}
+        # Páginas del leaderboard ya preparadas (se rehacen por TTL o cuando cambia el ranking)
+        self.leaderboards = LeaderboardCache(self.ranking, self.curve)
         
-        # Iniciar tarea de XP automático
+        # Iniciar tareas de XP automático, escritura del buffer y reconciliación del ranking
         self.auto_xp_task.start()
+        self.voice_xp_task.start()
+        self.seed_level_roles_task.start()
+        self.flush_xp_task.start()
+        self.reconcile_ranking_task.start()
     
-    def _calculate_cumulative_xp(self):
-        """Calcula la XP acumulada para cada nivel"""
-        total = 0
-        for level in range(1, 201):
-            if level > 1:
-                total += self.xp_table.get(level - 1, 0)
-            self.cumulative_xp[level] = total
+    async def cog_load(self):
+        """Carga los multiplicadores vigentes y empieza a barrer los caducados"""
+        await self.multipliers.load()
+        self.sweep_multipliers_task.start()
     
-    def cog_unload(self):
-        """Detiene las tareas al descargar el cog"""
+    async def cog_unload(self):
+        """Detiene las tareas al descargar el cog y escribe la XP pendiente"""
         self.auto_xp_task.cancel()
+        self.flush_xp_task.cancel()
+        self.reconcile_ranking_task.cancel()
+        self.sweep_multipliers_task.cancel()
+        self.voice_xp_task.cancel()
+        self.seed_level_roles_task.cancel()
+        await self.voice.flush()
+        await self.announcer.close()
+        await self.xp_buffer.flush()
     
     # ================== EVENTOS ==================
     
@@ -127,39 +137,44 @@ class LevelsSystem(commands.Cog):
         if message.author.bot or not message.guild:
             return
         
-        # Verificar cooldown (60 segundos por defecto)
-        current_time = time.time()
-        user_key = (message.author.id, message.guild.id)
+        # Configuración del servidor en memoria (None mientras se carga: valores antiguos)
+        config = guild_configs.peek(message.guild.id)
+        if config is not None and not config.exists:
+            config = None
         
-        if user_key in self.user_cooldowns:
-            if current_time - self.user_cooldowns[user_key] < 60:
-                return
-        
-        # Actualizar cooldown
-        self.user_cooldowns[user_key] = current_time
-        
-        # Generar XP aleatoria (10-25)
-        base_xp = random.randrange(5, 51, 5)
+        # Canales permitidos/bloqueados: antes de cualquier otra comprobación
+        if config is not None and not config.channel_allowed(message.channel.id):
+            return
         
-        # Aplicar multiplicadores de rol si existen
-        multiplier = 1.0
-        for role in message.author.roles:
-            if role.id in self.xp_multipliers:
-                mult_data = self.xp_multipliers[role.id]
-                if datetime.now() < mult_data['expires']:
-                    multiplier = max(multiplier, mult_data['multiplier'])
-                else:
-                    # Eliminar multiplicador expirado
-                    del self.xp_multipliers[role.id]
+        # Verificar y actualizar cooldown
+        cooldown = config.xp_cooldown if config is not None else LEGACY_XP_COOLDOWN
+        if not self.user_cooldowns.hit((message.author.id, message.guild.id), cooldown):
+            return
         
-        final_xp = int(base_xp * multiplier)
+        final_xp = self.roll_message_xp(message.author, config)
         
-        # Dar XP inmediatamente y verificar level up
-        await self.add_xp_and_check_levelup(message.author, final_xp)
+        # Acumular XP en el buffer y verificar level up sobre el total en memoria
+        try:
+            old_total_xp, new_total_xp = await self.xp_buffer.add(message.author.id, message.guild.id, final_xp)
+            card_cache.invalidate(message.author.id)
+            self.ranking.record_gain(message.guild.id, message.author.id, final_xp)
+            old_level, _, _ = self.get_level_from_total_xp(old_total_xp)
+            new_level, _, _ = self.get_level_from_total_xp(new_total_xp)
+            
+            if new_level > old_level:
+                await self.handle_level_up(message.author, new_level, old_level)
+        except Exception as e:
+            print(f"Error acumulando XP de mensaje: {e}")
         
         # También agregar a usuarios activos para XP adicional
         self.active_users.add((message.author.id, message.guild.id))
     
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        """Recalcula el multiplicador de un miembro cuando cambian sus roles"""
+        if before.roles != after.roles:
+            self.multipliers.invalidate_member(after.guild.id, after.id)
+    
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
         """Registra usuarios activos en canales de voz"""
@@ -169,12 +184,15 @@ class LevelsSystem(commands.Cog):
         # Si se unió a un canal de voz, agregarlo a activos
         if after.channel and not before.channel:
             self.active_users.add((member.id, member.guild.id))
+        
+        # Abrir/cerrar la sesión de voz (la XP de voz se calcula cada minuto)
+        self.voice.update(member, before, after)
     
     # ================== TAREAS AUTOMÁTICAS ==================
     
     @tasks.loop(minutes=1)
     async def auto_xp_task(self):
-        """Tarea que da XP automáticamente cada minuto a usuarios activos"""
+        """Tarea que da XP automáticamente cada minuto a usuarios activos (una sola consulta por vuelta)"""
         if not self.active_users:
             return
         
@@ -182,8 +200,11 @@ class LevelsSystem(commands.Cog):
         users_to_reward = list(self.active_users)
         self.active_users.clear()
         
-        for user_id, guild_id in users_to_reward:
-            try:
+        with metrics.timer('levels.auto_xp_tick'):
+            # Calcular en memoria la XP de cada usuario con los multiplicadores de rol
+            members = {}
+            grants = []
+            for user_id, guild_id in users_to_reward:
                 guild = self.bot.get_guild(guild_id)
                 if not guild:
                     continue
@@ -192,162 +213,266 @@ class LevelsSystem(commands.Cog):
                 if not member or member.bot:
                     continue
                 
-                # Generar XP aleatoria adicional (5-15)
-                bonus_xp = random.randrange(5, 51, 5)
-                
-                # Aplicar multiplicadores de rol
-                multiplier = 1.0
-                for role in member.roles:
-                    if role.id in self.xp_multipliers:
-                        mult_data = self.xp_multipliers[role.id]
-                        if datetime.now() < mult_data['expires']:
-                            multiplier = max(multiplier, mult_data['multiplier'])
-                        else:
-                            del self.xp_multipliers[role.id]
-                
-                final_xp = int(bonus_xp * multiplier)
-                
-                # Dar XP usando la función mejorada que verifica level up
-                await self.add_xp_and_check_levelup(member, final_xp)
-                
+                # Mismos multiplicadores que la XP por mensaje (rol, bonus y servidor)
+                config = guild_configs.peek(guild_id)
+                if config is not None and not config.exists:
+                    config = None
+                multiplier = self.role_multiplier(member, config) * (config.xp_multiplier if config is not None else 1.0)
+                final_xp = int(random.randrange(*LEGACY_XP_RANGE) * multiplier)
+                members[(user_id, guild_id)] = member
+                grants.append((user_id, guild_id, final_xp))
+            
+            try:
+                results = await self.grant_bulk(grants)
+            except Exception as e:
+                print(f"Error dando XP automática a {len(grants)} usuarios: {e}")
+                return
+            
+            level_ups = await self.apply_bulk_grants(results, members)
+            metrics.incr('levels.auto_xp_users', len(results))
+            metrics.incr('levels.auto_xp_level_ups', level_ups)
+    
+    @tasks.loop(minutes=1)
+    async def voice_xp_task(self):
+        """Acumula tiempo y XP de voz de las sesiones abiertas y guarda las sesiones en lote"""
+        with metrics.timer('levels.voice_tick'):
+            grants, members, idle = self.voice.collect(self.bot.get_guild, self.voice_xp_for)
+            try:
+                results = await self.grant_bulk(grants, messages=0)
+                await self.apply_bulk_grants(results, members)
+            except Exception as e:
+                print(f"Error dando XP de voz a {len(grants)} usuarios: {e}")
+            # Sin XP que dar solo se suma el tiempo en voz (no cambia rankings ni leaderboards)
+            try:
+                await add_voice_time(idle)
             except Exception as e:
-                print(f"Error dando XP automática a {user_id}: {e}")
+                print(f"Error guardando tiempo de voz de {len(idle)} usuarios: {e}")
+            await self.voice.flush()
+    
+    @voice_xp_task.before_loop
+    async def before_voice_xp_task(self):
+        """Espera a que el bot esté listo y retoma las sesiones de voz abiertas"""
+        await self.bot.wait_until_ready()
+        try:
+            await self.voice.recover(self.bot.guilds)
+        except Exception as e:
+            print(f"Error recuperando sesiones de voz: {e}")
     
     @auto_xp_task.before_loop
     async def before_auto_xp_task(self):
         """Espera a que el bot esté listo"""
         await self.bot.wait_until_ready()
     
+    @tasks.loop(seconds=MULTIPLIER_SWEEP_SECONDS)
+    async def sweep_multipliers_task(self):
+        """Elimina los multiplicadores de rol caducados"""
+        try:
+            await self.multipliers.sweep()
+        except Exception as e:
+            print(f"Error barriendo multiplicadores caducados: {e}")
+    
+    @tasks.loop(seconds=XP_FLUSH_INTERVAL)
+    async def flush_xp_task(self):
+        """Escribe periódicamente la XP acumulada en el buffer"""
+        await self.xp_buffer.flush()
+    
+    @tasks.loop(minutes=RANKING_RECONCILE_MINUTES)
+    async def reconcile_ranking_task(self):
+        """Carga (primera vuelta) y reconcilia periódicamente el índice de rankings con la base de datos"""
+        await self.ranking.reconcile([guild.id for guild in self.bot.guilds])
+    
+    @reconcile_ranking_task.before_loop
+    async def before_reconcile_ranking_task(self):
+        """Espera a que el bot esté listo"""
+        await self.bot.wait_until_ready()
+    
+    @tasks.loop(count=1)
+    async def seed_level_roles_task(self):
+        """Copia los roles de nivel antiguos a level_roles en los servidores que los tienen y no han configurado otros"""
+        for guild in self.bot.guilds:
+            if not any(guild.get_role(role_id) for role_id in LEGACY_LEVEL_ROLES.values()):
+                continue
+            try:
+                config = await guild_configs.get(guild.id)
+                if config.level_roles:
+                    continue
+                await seed_level_roles(guild.id, LEGACY_LEVEL_ROLES)
+                guild_configs.invalidate(guild.id)
+                print(f"🎭 Roles de nivel antiguos copiados a la base de datos para {guild.name}")
+            except Exception as e:
+                print(f"Error copiando los roles de nivel de {guild.name}: {e}")
+    
+    @seed_level_roles_task.before_loop
+    async def before_seed_level_roles_task(self):
+        """Espera a que el bot esté listo"""
+        await self.bot.wait_until_ready()
+    
     # ================== FUNCIONES AUXILIARES ==================
     
-    def get_level_from_total_xp(self, total_xp: int) -> tuple:
-        """ÚNICA función para calcular nivel desde XP total - USA LA TABLA FIJA"""
-        current_level = 1
-        
-        # Encontrar el nivel actual basado en XP acumulada
-        for level in range(1, 201):
-            if total_xp < self.cumulative_xp.get(level + 1, float('inf')):
-                current_level = level
-                break
-        
-        # XP actual en el nivel
-        current_level_start_xp = self.cumulative_xp.get(current_level, 0)
-        current_xp_in_level = total_xp - current_level_start_xp
-        
-        # XP necesaria para el siguiente nivel
-        next_level_xp = self.xp_table.get(current_level, 0)
+    def role_multiplier(self, member: discord.Member, config: GuildLevelConfig = None) -> float:
+        """Mayor multiplicador entre los temporales por rol y los roles de bonus del servidor (en caché por miembro)"""
+        return self.multipliers.effective(member, config)
+    
+    def voice_xp_for(self, member: discord.Member, seconds: int) -> int:
+        """XP de voz por `seconds` segundos activos (solo si el servidor tiene voice_xp_enabled)"""
+        config = guild_configs.peek(member.guild.id)
+        if config is None or not config.voice_xp_enabled:
+            return 0
+        multiplier = self.role_multiplier(member, config) * config.xp_multiplier
+        return int(config.voice_xp_rate * seconds / 60 * multiplier)
+    
+    async def grant_bulk(self, grants: list, messages: int = 1) -> list:
+        """Concede XP en lote y anota los totales sin que un flush del buffer se cruce"""
+        # Con el flush en curso, su snapshot podría pisar el total recién escrito
+        async with self.xp_buffer.flush_lock:
+            results = await bulk_grant_user_xp(grants, self.level_thresholds, messages=messages)
+            for user_id, guild_id, _, new_xp in results:
+                self.xp_buffer.note_total(user_id, guild_id, new_xp)
+        return results
+    
+    async def apply_bulk_grants(self, results: list, members: dict) -> int:
+        """Actualiza buffer, caché y ranking tras una concesión en lote y anuncia las subidas de nivel"""
+        level_ups = []
+        for user_id, guild_id, old_xp, new_xp in results:
+            card_cache.invalidate(user_id)
+            self.ranking.record_gain(guild_id, user_id, new_xp - old_xp)
+            
+            # El nivel se evalúa sobre el total visible, incluida la XP aún en el buffer
+            pending_xp = self.xp_buffer.pending_xp(user_id, guild_id)
+            old_level, _, _ = self.get_level_from_total_xp(old_xp + pending_xp)
+            new_level, _, _ = self.get_level_from_total_xp(new_xp + pending_xp)
+            if new_level > old_level:
+                level_ups.append((members[(user_id, guild_id)], new_level, old_level))
         
-        return current_level, current_xp_in_level, next_level_xp
+        # Anunciar las subidas de nivel en paralelo, con un máximo simultáneo
+        if level_ups:
+            semaphore = asyncio.Semaphore(LEVEL_UP_CONCURRENCY)
+            
+            async def dispatch(member, new_level, old_level):
+                async with semaphore:
+                    await self.handle_level_up(member, new_level, old_level)
+            
+            await asyncio.gather(*(dispatch(*level_up) for level_up in level_ups), return_exceptions=True)
+        return len(level_ups)
+    
+    def roll_message_xp(self, member: discord.Member, config: GuildLevelConfig = None) -> int:
+        """XP de un mensaje: xp_per_message (±50%) y xp_multiplier del servidor, o el rango antiguo sin configuración"""
+        if config is None:
+            base_xp = random.randrange(*LEGACY_XP_RANGE)
+            guild_multiplier = 1.0
+        else:
+            spread = config.xp_per_message // 2
+            base_xp = random.randint(config.xp_per_message - spread, config.xp_per_message + spread)
+            guild_multiplier = config.xp_multiplier
+        
+        return max(0, int(base_xp * self.role_multiplier(member, config) * guild_multiplier))
+    
+    def get_level_from_total_xp(self, total_xp: int) -> tuple:
+        """(nivel, XP dentro del nivel, XP para el siguiente) según la curva de niveles"""
+        return self.curve.progress(total_xp)
     
     def get_total_xp_for_level(self, level: int) -> int:
         """Obtiene la XP total necesaria para alcanzar un nivel"""
-        return self.cumulative_xp.get(level, 0)
+        return self.curve.total_for_level(level)
     
     async def add_xp_and_check_levelup(self, member: discord.Member, xp_amount: int):
         """Agrega XP a un usuario y verifica si subió de nivel - VERSIÓN CORREGIDA"""
         try:
-            # Obtener datos actuales del usuario
-            user_data = await get_user_level_data(member.id, member.guild.id)
-            
-            # Determinar XP actual (0 si es usuario nuevo)
-            old_total_xp = user_data['xp'] if user_data else 0
-            old_level, _, _ = self.get_level_from_total_xp(old_total_xp)
-            
-            # Agregar XP usando la función de base de datos
-            # Esta función creará el registro si no existe
-            await update_user_xp(member.id, member.guild.id, xp_amount, xp_amount, xp_amount)
-            
-            # Calcular nuevo nivel
-            new_total_xp = old_total_xp + xp_amount
-            new_level, _, _ = self.get_level_from_total_xp(new_total_xp)
+            # Una sola consulta: suma la XP y devuelve la XP anterior y la nueva
+            async with self.xp_buffer.flush_lock:
+                result = await grant_user_xp(member.id, member.guild.id, xp_amount, self.level_thresholds)
+                self.xp_buffer.note_total(member.id, member.guild.id, result['new_xp'])
+            card_cache.invalidate(member.id)
+            self.ranking.record_gain(member.guild.id, member.id, xp_amount)
+            
+            # El nivel se evalúa sobre el total visible, incluida la XP aún en el buffer
+            pending_xp = self.xp_buffer.pending_xp(member.id, member.guild.id)
+            old_level, _, _ = self.get_level_from_total_xp(result['old_xp'] + pending_xp)
+            new_level, _, _ = self.get_level_from_total_xp(result['new_xp'] + pending_xp)
             
-            # Actualizar el nivel en la base de datos si cambió
             if new_level > old_level:
-                await set_user_level(member.id, member.guild.id, new_level)
                 await self.handle_level_up(member, new_level, old_level)
-            else:
-                # Asegurar que el nivel esté actualizado en la base de datos
-                # incluso si no hubo cambio (especialmente importante para usuarios nuevos)
-                await set_user_level(member.id, member.guild.id, new_level)
                 
         except Exception as e:
             print(f"Error en add_xp_and_check_levelup: {e}")
     
     async def handle_level_up(self, member: discord.Member, new_level: int, old_level: int):
-        """Maneja la subida de nivel de un usuario"""
+        """Maneja la subida de nivel de un usuario: asigna el rol y encola el anuncio"""
         try:
-            # Obtener canal de anuncios
-            channel = self.bot.get_channel(self.level_up_channel_id)
+            # Ajustar los roles de nivel (sin llamadas a la API si ya son los correctos)
+            await self.assign_level_role(member, new_level)
+            
+            # Canal de anuncios (el del servidor si lo ha configurado)
+            config = guild_configs.peek(member.guild.id)
+            channel_id = LEGACY_LEVEL_UP_CHANNEL
+            if config is not None and config.exists:
+                if not config.announce_level_up:
+                    return
+                channel_id = config.level_up_channel or channel_id
+            
+            # El canal tiene que ser de este servidor (el antiguo solo existe en el original)
+            channel = member.guild.get_channel(channel_id)
             if not channel:
                 return
-
-            # Verificar si es múltiplo de 10
-            is_milestone = new_level % 10 == 0
-
-            if is_milestone:
-                role = None
-                if new_level in self.level_roles:
-                    role_id = self.level_roles[new_level]
-                    role = member.guild.get_role(role_id)
-
-                embed = discord.Embed(
-                    title="🎉 ¡NIVEL ALCANZADO!",
-                    description=f"Nivel alcanzado: **{new_level}**",
-                    color=0x00ffff
-                )
-
-                # Asignar rol correspondiente
-                await self.assign_level_role(member, new_level)
-
-                # Agregar campo con el rol
-                if role:
-                    embed.add_field(name="🎭 Rol obtenido", value=role.mention, inline=False)
-
-            else:
-                embed = discord.Embed(
-                    title="⬆️ Subida de nivel",
-                    description=f"Nuevo nivel: **{new_level}**",
-                    color=0x0099ff
-                )
-
-            embed.set_thumbnail(url=member.display_avatar.url)
-            embed.add_field(name="Nivel anterior", value=str(old_level), inline=True)
-            embed.add_field(name="Nivel actual", value=str(new_level), inline=True)
-
-            # Solo menciona al usuario fuera del embed
-            await channel.send(content=member.mention, embed=embed)
-
+            
+            self.announcer.enqueue(channel, member, old_level, new_level)
+        
         except Exception as e:
             print(f"Error en handle_level_up: {e}")
     
-    async def assign_level_role(self, member: discord.Member, level: int):
-        """Asigna el rol correspondiente al nivel y elimina el anterior"""
-        try:
-            if level not in self.level_roles:
-                return
-            
-            new_role_id = self.level_roles[level]
-            new_role = member.guild.get_role(new_role_id)
-            
-            if not new_role:
-                print(f"No se encontró el rol {new_role_id} para el nivel {level}")
-                return
-            
-            # Eliminar roles de niveles anteriores
-            roles_to_remove = []
-            for role in member.roles:
-                if role.id in self.level_roles.values() and role.id != new_role_id:
-                    roles_to_remove.append(role)
-            
-            # Remover roles antiguos
-            if roles_to_remove:
-                await member.remove_roles(*roles_to_remove, reason=f"Actualización de nivel a {level}")
-            
-            # Agregar nuevo rol
-            await member.add_roles(new_role, reason=f"Alcanzó el nivel {level}")
+    def build_level_up_embed(self, member: discord.Member, new_level: int, old_level: int) -> discord.Embed:
+        """Embed del anuncio individual de subida de nivel"""
+        # Rol de nivel alcanzado en esta subida (cualquier nivel configurado con !xpc setrole)
+        role_id = self.level_role_index(guild_configs.peek(member.guild.id)).reached(old_level, new_level)
+        
+        if role_id:
+            role = member.guild.get_role(role_id)
             
-            print(f"Asignado rol de nivel {level} a {member.display_name}")
+            embed = discord.Embed(
+                title="🎉 ¡NIVEL ALCANZADO!",
+                description=f"Nivel alcanzado: **{new_level}**",
+                color=0x00ffff
+            )
             
+            # Agregar campo con el rol
+            if role:
+                embed.add_field(name="🎭 Rol obtenido", value=role.mention, inline=False)
+        
+        else:
+            embed = discord.Embed(
+                title="⬆️ Subida de nivel",
+                description=f"Nuevo nivel: **{new_level}**",
+                color=0x0099ff
+            )
+        
+        embed.set_thumbnail(url=member.display_avatar.url)
+        embed.add_field(name="Nivel anterior", value=str(old_level), inline=True)
+        embed.add_field(name="Nivel actual", value=str(new_level), inline=True)
+        return embed
+    
+    def level_role_index(self, config: GuildLevelConfig = None) -> LevelRoleIndex:
+        """Índice ordenado de los roles de nivel del servidor (se reconstruye solo si cambian)"""
+        if config is None:
+            return EMPTY_ROLE_INDEX
+        cached = self.role_indexes.get(config.guild_id)
+        if cached is not None and cached[0] is config.level_roles:
+            return cached[1]
+        index = LevelRoleIndex(config.level_roles)
+        self.role_indexes[config.guild_id] = (config.level_roles, index)
+        return index
+    
+    def target_level_roles(self, config: GuildLevelConfig, level: int) -> frozenset:
+        """Roles de nivel que debe tener un miembro con ese nivel"""
+        stack = config.exists and config.stack_roles
+        return self.level_role_index(config).target(level, stack)
+    
+    async def assign_level_role(self, member: discord.Member, level: int):
+        """Deja al miembro con los roles de su nivel en una sola llamada (quita los de otros niveles)"""
+        try:
+            config = await guild_configs.get(member.guild.id)
+            target = self.target_level_roles(config, level)
+            if await sync_member_roles(member, self.level_role_index(config), target, f"Alcanzó el nivel {level}"):
+                print(f"Roles de nivel {level} actualizados para {member.display_name}")
         except Exception as e:
             print(f"Error asignando rol de nivel: {e}")
     
@@ -370,6 +495,9 @@ class LevelsSystem(commands.Cog):
             return
         
         try:
+            # Escribir la XP pendiente para mostrar datos y ranking al día
+            await self.xp_buffer.flush()
+            
             # Obtener datos del usuario
             user_data = await get_user_level_data(member.id, ctx.guild.id)
             if not user_data:
@@ -391,8 +519,8 @@ class LevelsSystem(commands.Cog):
             total_xp = user_data['xp']
             level, current_xp, next_level_xp = self.get_level_from_total_xp(total_xp)
             
-            # Obtener ranking
-            rank = await get_user_rank(member.id, ctx.guild.id)
+            # Obtener ranking (índice en memoria)
+            rank = await self.ranking.rank(ctx.guild.id, member.id)
             
             # Calcular porcentaje de progreso
             progress_percent = (current_xp / next_level_xp * 100) if next_level_xp > 0 else 100
@@ -439,18 +567,15 @@ class LevelsSystem(commands.Cog):
     @commands.command(name="lb", aliases=["leaderboard", "ranking"])
     @commands.cooldown(1, 30, commands.BucketType.user)
     async def leaderboard(self, ctx, period: str = None):
-        """Ranking global de usuarios por XP"""
+        """Ranking global de usuarios por XP (paginado con botones)"""
         try:
-            # Determinar el período
+            # Determinar el período (las páginas salen de la caché del leaderboard)
             if period is None:
-                title = "🏆 Ranking Global de XP"
-                leaderboard_data = await get_leaderboard(ctx.guild.id, limit=10)
+                title, period = "🏆 Ranking Global de XP", 'total'
             elif period.lower() in ['s', 'semanal', 'semana', 'week', 'weekly']:
-                title = "📅 Top XP - Esta Semana"
-                leaderboard_data = await get_weekly_leaderboard(ctx.guild.id, limit=10)
+                title, period = "📅 Top XP - Esta Semana", 'weekly'
             elif period.lower() in ['m', 'mensual', 'mes', 'month', 'monthly']:
-                title = "📆 Top XP - Este Mes"
-                leaderboard_data = await get_monthly_leaderboard(ctx.guild.id, limit=10)
+                title, period = "📆 Top XP - Este Mes", 'monthly'
             else:
                 embed = discord.Embed(
                     title="⚠️ Período inválido",
@@ -460,7 +585,8 @@ class LevelsSystem(commands.Cog):
                 await ctx.send(embed=embed)
                 return
             
-            if not leaderboard_data:
+            pages = await self.leaderboards.get(ctx.guild, period)
+            if not pages.lines:
                 embed = discord.Embed(
                     title="📊 Ranking vacío",
                     description="No hay datos para mostrar.",
@@ -469,45 +595,13 @@ class LevelsSystem(commands.Cog):
                 await ctx.send(embed=embed)
                 return
             
-            embed = discord.Embed(
-                title=title,
-                color=0x00ffff
-            )
-            
-            # Emojis para las primeras posiciones
-            medals = ["🥇", "🥈", "🥉"]
-            
-            leaderboard_text = ""
-            
-            for i, user_data in enumerate(leaderboard_data, 1):
-                user_id = user_data['user_id']
-                xp = user_data['xp']
-                
-                # Obtener miembro del servidor
-                member = ctx.guild.get_member(user_id)
-                if not member:
-                    continue
-                
-                # Calcular nivel
-                level, _, _ = self.get_level_from_total_xp(xp)
-                
-                # Emoji para posición
-                if i <= 3:
-                    position_emoji = medals[i-1]
-                else:
-                    position_emoji = f"`{i}.`"
-                
-                # Formato de la entrada
-                leaderboard_text += f"{position_emoji} **{member.display_name}** - Nivel {level} ({xp:,} XP)\n"
-            
-            if leaderboard_text:
-                embed.description = leaderboard_text
-            else:
-                embed.description = "No se encontraron usuarios válidos."
-            
-            embed.set_footer(text=f"Mostrando top {len(leaderboard_data)} usuarios")
+            embed = leaderboard_embed(title, pages, 0)
+            if pages.page_count == 1:
+                await ctx.send(embed=embed)
+                return
             
-            await ctx.send(embed=embed)
+            view = LeaderboardView(self.leaderboards, ctx.guild, period, title, ctx.author.id, pages)
+            view.message = await ctx.send(embed=embed, view=view)
             
         except Exception as e:
             print(f"Error en comando leaderboard: {e}")
@@ -554,6 +648,16 @@ class LevelsSystem(commands.Cog):
             value="`!xpc multiplier <rol> <multiplicador> <horas>`",
             inline=False
         )
+        embed.add_field(
+            name="🎭 Roles de Nivel",
+            value="`!xpc roles` · `!xpc setrole <nivel> <rol>` · `!xpc delrole <nivel>`",
+            inline=False
+        )
+        embed.add_field(
+            name="🔄 Resincronizar Roles",
+            value="`!xpc resync`",
+            inline=False
+        )
         embed.add_field(
             name="🔍 Información de Debug",
             value="`!xpinfo <usuario>`",
@@ -561,6 +665,62 @@ class LevelsSystem(commands.Cog):
         )
         await ctx.send(embed=embed)
     
+    @xp_commands.command(name="resync")
+    @commands.has_permissions(manage_guild=True)
+    async def resync_roles_command(self, ctx):
+        """Reconcilia los roles de nivel de todos los miembros a partir de su XP guardada"""
+        if ctx.guild.id in self.resyncing:
+            await ctx.send("⏳ Ya hay una resincronización de roles en curso en este servidor.")
+            return
+        
+        self.resyncing.add(ctx.guild.id)
+        try:
+            await self.xp_buffer.flush()
+            xp_by_user = {user_id: xp for user_id, xp, _, _ in await get_guild_xp_snapshot(ctx.guild.id)}
+            
+            config = await guild_configs.get(ctx.guild.id)
+            index = self.level_role_index(config)
+            if not index.levels:
+                await ctx.send("❌ Este servidor no tiene roles de nivel configurados. Usa `!xpc setrole <nivel> <@rol>`.")
+                return
+            
+            members = [member for member in ctx.guild.members if not member.bot]
+            levels = self.curve.levels_for(xp_by_user.get(member.id, 0) for member in members)
+            targets = {
+                member.id: self.target_level_roles(config, level)
+                for member, level in zip(members, levels)
+            }
+            
+            status = await ctx.send(f"🔄 Revisando roles de nivel de **{len(members)}** miembros...")
+            last_update = [time.monotonic()]
+            
+            async def progress(stats):
+                # Editar el mensaje como mucho cada 5 segundos
+                if time.monotonic() - last_update[0] >= 5:
+                    last_update[0] = time.monotonic()
+                    try:
+                        await status.edit(content=f"🔄 Resincronizando... quedan **{stats['pending']}** miembros")
+                    except discord.HTTPException:
+                        pass  # el progreso es opcional: no interrumpir la resincronización
+            
+            with metrics.timer('levels.resync'):
+                stats = await resync_members(members, index, targets, progress)
+            
+            embed = discord.Embed(
+                title="✅ Roles de nivel resincronizados",
+                color=0x00ff00
+            )
+            embed.add_field(name="Revisados", value=str(stats['checked']), inline=True)
+            embed.add_field(name="Corregidos", value=str(stats['changed']), inline=True)
+            embed.add_field(name="Errores", value=str(stats['failed']), inline=True)
+            await status.edit(content=None, embed=embed)
+        
+        except Exception as e:
+            print(f"Error resincronizando roles: {e}")
+            await ctx.send("❌ Ocurrió un error al resincronizar los roles.")
+        finally:
+            self.resyncing.discard(ctx.guild.id)
+    
     @xp_commands.command(name="add")
     @commands.has_permissions(manage_guild=True)
     async def add_xp_command(self, ctx, member: discord.Member, amount: int):
@@ -625,30 +785,17 @@ class LevelsSystem(commands.Cog):
             return
         
         try:
-            # Obtener XP actual
-            user_data = await get_user_level_data(member.id, ctx.guild.id)
-            if not user_data:
-                # Crear usuario si no existe
-                await update_user_xp(member.id, ctx.guild.id, 0, 0, 0)
-                user_data = await get_user_level_data(member.id, ctx.guild.id)
-                
-                if not user_data:
-                    embed = discord.Embed(
-                        title="❌ Error",
-                        description="Error al crear el registro del usuario.",
-                        color=0xff0000
-                    )
-                    await ctx.send(embed=embed)
-                    return
-            
-            current_xp = user_data['xp']
-            new_xp = max(0, current_xp - amount)
-            
-            await set_user_xp(member.id, ctx.guild.id, new_xp)
-            
-            # Recalcular nivel
-            new_level, _, _ = self.get_level_from_total_xp(new_xp)
-            await set_user_level(member.id, ctx.guild.id, new_level)
+            # Escribir la XP pendiente antes de modificarla
+            await self.xp_buffer.flush()
+            
+            # Quitar XP y recalcular nivel en una sola consulta
+            result = await remove_user_xp(member.id, ctx.guild.id, amount, self.level_thresholds)
+            new_xp = result['new_xp']
+            new_level = result['new_level']
+            self.xp_buffer.note_total(member.id, ctx.guild.id, new_xp)
+            card_cache.invalidate(member.id)
+            self.ranking.set_total(ctx.guild.id, member.id, new_xp)
+            await self.assign_level_role(member, new_level)
             
             embed = discord.Embed(
                 title="✅ XP Removida",
@@ -691,10 +838,14 @@ class LevelsSystem(commands.Cog):
             return
         
         try:
-            await set_user_xp(member.id, ctx.guild.id, amount)
+            await self.xp_buffer.flush()
+            await set_user_total_xp(member.id, ctx.guild.id, amount, self.level_thresholds)
+            self.xp_buffer.note_total(member.id, ctx.guild.id, amount)
+            card_cache.invalidate(member.id)
+            self.ranking.set_total(ctx.guild.id, member.id, amount)
             
             level, current_xp, next_xp = self.get_level_from_total_xp(amount)
-            await set_user_level(member.id, ctx.guild.id, level)
+            await self.assign_level_role(member, level)
             
             embed = discord.Embed(
                 title="✅ XP Establecida",
@@ -740,12 +891,14 @@ class LevelsSystem(commands.Cog):
             # Calcular XP total necesaria para el nivel
             total_xp = self.get_total_xp_for_level(level)
             
-            await set_user_xp(member.id, ctx.guild.id, total_xp)
-            await set_user_level(member.id, ctx.guild.id, level)
+            await self.xp_buffer.flush()
+            await set_user_total_xp(member.id, ctx.guild.id, total_xp, self.level_thresholds)
+            self.xp_buffer.note_total(member.id, ctx.guild.id, total_xp)
+            card_cache.invalidate(member.id)
+            self.ranking.set_total(ctx.guild.id, member.id, total_xp)
             
-            # Asignar rol si es múltiplo de 10
-            if level % 10 == 0:
-                await self.assign_level_role(member, level)
+            # Ajustar los roles de nivel (también quita los de niveles superiores al bajar)
+            await self.assign_level_role(member, level)
             
             embed = discord.Embed(
                 title="✅ Nivel Establecido",
@@ -789,10 +942,8 @@ class LevelsSystem(commands.Cog):
         try:
             expires_at = datetime.now() + timedelta(hours=hours)
             
-            self.xp_multipliers[role.id] = {
-                'multiplier': multiplier,
-                'expires': expires_at
-            }
+            # Guardar el multiplicador (reemplaza el anterior del mismo rol)
+            await self.multipliers.set(role.id, ctx.guild.id, multiplier, int(expires_at.timestamp()))
             
             embed = discord.Embed(
                 title="✅ Multiplicador Aplicado",
@@ -812,6 +963,102 @@ class LevelsSystem(commands.Cog):
             )
             await ctx.send(embed=embed)
     
+    @xp_commands.command(name="roles")
+    @commands.has_permissions(manage_guild=True)
+    async def level_roles_command(self, ctx):
+        """Muestra los roles configurados por nivel en este servidor"""
+        config = await guild_configs.get(ctx.guild.id)
+        index = self.level_role_index(config)
+        if not index.levels:
+            description = "No hay roles de nivel configurados. Usa `!xpc setrole <nivel> <rol>`."
+        else:
+            lines = []
+            for level, role_id in zip(index.levels, index.role_ids):
+                role = ctx.guild.get_role(role_id)
+                lines.append(f"Nivel **{level}** · {role.mention if role else f'`{role_id}` (no existe)'}")
+            description = "\n".join(lines)
+        
+        embed = discord.Embed(
+            title="🎭 Roles de Nivel",
+            description=description,
+            color=0x00ffff
+        )
+        embed.set_footer(text="Acumulativos" if config.exists and config.stack_roles else "Solo el del mayor nivel alcanzado")
+        await ctx.send(embed=embed)
+    
+    @xp_commands.command(name="setrole")
+    @commands.has_permissions(manage_guild=True)
+    async def set_level_role_command(self, ctx, level: int, role: discord.Role):
+        """Asigna un rol a un nivel (reemplaza el que hubiera)"""
+        if level < 1:
+            embed = discord.Embed(
+                title="❌ Error",
+                description="El nivel debe ser mayor a 0.",
+                color=0xff0000
+            )
+            await ctx.send(embed=embed)
+            return
+        
+        if role.is_default() or role.managed or role >= ctx.guild.me.top_role:
+            embed = discord.Embed(
+                title="❌ Error",
+                description=f"No puedo asignar el rol {role.mention} (debe estar por debajo de mi rol más alto).",
+                color=0xff0000
+            )
+            await ctx.send(embed=embed)
+            return
+        
+        try:
+            await guild_configs.set_level_role(ctx.guild.id, level, role.id)
+            embed = discord.Embed(
+                title="✅ Rol de Nivel Configurado",
+                description=f"Al llegar al nivel **{level}** se obtendrá {role.mention}",
+                color=0x00ff00
+            )
+            embed.set_footer(text="Usa !xpc resync para aplicarlo a los miembros actuales")
+            await ctx.send(embed=embed)
+        
+        except Exception as e:
+            print(f"Error configurando rol de nivel: {e}")
+            embed = discord.Embed(
+                title="❌ Error",
+                description="Ocurrió un error al configurar el rol de nivel.",
+                color=0xff0000
+            )
+            await ctx.send(embed=embed)
+    
+    @xp_commands.command(name="delrole")
+    @commands.has_permissions(manage_guild=True)
+    async def remove_level_role_command(self, ctx, level: int):
+        """Quita el rol configurado para un nivel"""
+        try:
+            config = await guild_configs.get(ctx.guild.id)
+            if level not in config.level_roles:
+                embed = discord.Embed(
+                    title="❌ Error",
+                    description=f"El nivel **{level}** no tiene rol configurado.",
+                    color=0xff0000
+                )
+                await ctx.send(embed=embed)
+                return
+            
+            await guild_configs.remove_level_role(ctx.guild.id, level)
+            embed = discord.Embed(
+                title="✅ Rol de Nivel Eliminado",
+                description=f"El nivel **{level}** ya no da ningún rol",
+                color=0x00ff00
+            )
+            await ctx.send(embed=embed)
+        
+        except Exception as e:
+            print(f"Error eliminando rol de nivel: {e}")
+            embed = discord.Embed(
+                title="❌ Error",
+                description="Ocurrió un error al eliminar el rol de nivel.",
+                color=0xff0000
+            )
+            await ctx.send(embed=embed)
+    
     # ================== FUNCIONES DEL PERFIL ==================
     
     def get_user_rank_role(self, member):
@@ -822,248 +1069,33 @@ class LevelsSystem(commands.Cog):
         return "Sin Rango"
     
     async def get_user_avatar(self, user):
-        """Descarga el avatar del usuario"""
-        try:
-            async with aiohttp.ClientSession() as session:
-                avatar_url = user.display_avatar.url
-                async with session.get(avatar_url) as resp:
-                    avatar_data = await resp.read()
-                    return Image.open(io.BytesIO(avatar_data)).convert('RGBA')
-        except:
-            # Avatar por defecto si no se puede descargar
-            return Image.new('RGBA', (128, 128), (100, 100, 100, 255))
-    
-    def get_font(self, size: int, bold: bool = False):
-        """Obtiene una fuente con el tamaño especificado"""
-        try:
-            # Primero intentar cargar la fuente Orbitron específica
-            orbitron_path = "resources/fonts/Orbitron-Medium.ttf"
-            if os.path.exists(orbitron_path):
-                return ImageFont.truetype(orbitron_path, size)
-            
-            # Intentar otras variantes de Orbitron
-            orbitron_variants = [
-                "resources/fonts/Orbitron-Bold.ttf",
-                "resources/fonts/Orbitron-Regular.ttf",
-                "resources/fonts/Orbitron.ttf"
-            ]
-            
-            for variant in orbitron_variants:
-                if os.path.exists(variant):
-                    return ImageFont.truetype(variant, size)
-            
-            # Fallback a fuentes genéricas si Orbitron no está disponible
-            if bold:
-                font_files = ['bold.ttf', 'arial-bold.ttf', 'roboto-bold.ttf', 'font-bold.ttf']
-                for font_file in font_files:
-                    font_path = f"{self.font_path}/{font_file}"
-                    if os.path.exists(font_path):
-                        return ImageFont.truetype(font_path, size)
-            else:
-                font_files = ['regular.ttf', 'arial.ttf', 'roboto.ttf', 'font.ttf']
-                for font_file in font_files:
-                    font_path = f"{self.font_path}/{font_file}"
-                    if os.path.exists(font_path):
-                        return ImageFont.truetype(font_path, size)
-        except Exception as e:
-            print(f"Error cargando fuente: {e}")
-        
-        # Fuente por defecto si no encuentra ninguna personalizada
-        return ImageFont.load_default()
-    
-    def create_rounded_rectangle(self, width: int, height: int, radius: int, color: tuple):
-        """Crea un rectángulo con esquinas redondeadas"""
-        img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
-        
-        draw.rounded_rectangle(
-            [(0, 0), (width, height)],
-            radius=radius,
-            fill=color
-        )
-        
-        return img
-    
-    def create_circle_avatar(self, avatar_img: Image, size: int):
-        """Convierte el avatar en circular"""
-        avatar_img = avatar_img.resize((size, size), Image.Resampling.LANCZOS)
-        
-        # Crear máscara circular
-        mask = Image.new('L', (size, size), 0)
-        draw = ImageDraw.Draw(mask)
-        draw.ellipse((0, 0, size, size), fill=255)
-        
-        # Aplicar máscara
-        result = Image.new('RGBA', (size, size), (0, 0, 0, 0))
-        result.paste(avatar_img, (0, 0))
-        result.putalpha(mask)
-        
-        return result
-    
-    def draw_progress_bar(self, draw, x: int, y: int, width: int, height: int, 
-                         progress: float, bg_color: tuple, fill_color: tuple, radius: int = 15):
-        """Dibuja una barra de progreso con el estilo de la imagen"""
-        # Fondo de la barra (más oscuro)
-        draw.rounded_rectangle(
-            [(x, y), (x + width, y + height)],
-            radius=radius,
-            fill=bg_color
-        )
-        
-        # Barra de progreso (cyan brillante)
-        if progress > 0:
-            progress_width = int(width * progress)
-            if progress_width > radius * 2:
-                draw.rounded_rectangle(
-                    [(x, y), (x + progress_width, y + height)],
-                    radius=radius,
-                    fill=fill_color
-                )
+        """Avatar del usuario en PNG desde la caché compartida (None si falla: se usa uno por defecto)"""
+        return await avatars.fetch(user.display_avatar, PROFILE_AVATAR_SIZE)
     
-    async def create_profile_image(self, user, user_data: dict, balance: float, rank: int):
-        """Crea la imagen del perfil con el diseño exacto y DATOS CORRECTOS"""
-        # Dimensiones exactas especificadas
-        width, height = 820, 950
-        
-        # Crear imagen base con fondo azul oscuro como en la imagen
-        try:
-            # Intentar cargar fondo personalizado
-            background = Image.open(f"{self.bg_path}/perfil.png").resize((width, height))
-        except Exception as e:
-            print(f"No se pudo cargar la imagen de fondo: {e}")
-            # Fondo azul oscuro como en la imagen
-            background = Image.new('RGB', (width, height), (20, 35, 60))  # Color azul oscuro
-            
-        background = background.convert('RGBA')
-        draw = ImageDraw.Draw(background)
-        
-        # Colores exactos de la imagen
-        cyan_bright = (0, 255, 255)  # Cyan brillante
-        cyan_dark = (0, 180, 200)    # Cyan más oscuro
-        dark_blue = (15, 25, 45)     # Azul muy oscuro para fondos
-        darker_blue = (10, 20, 35)   # Azul aún más oscuro
-        white_text = (255, 255, 255) # Texto blanco
-        
-        # ===== USAR ÚNICA FUNCIÓN PARA CALCULAR NIVEL =====
+    async def create_profile_image(self, user, user_data: dict, balance: float, rank: int) -> bytes:
+        """Genera la imagen del perfil (PNG) en el pool de renderizado"""
         total_xp = user_data['xp']
         level, current_xp, next_level_xp = self.get_level_from_total_xp(total_xp)
         
-        print(f"DEBUG: Usuario {user.name} - XP Total: {total_xp}, Nivel: {level}, XP en nivel: {current_xp}/{next_level_xp}")
-        
-        # Obtener rol de rango del usuario
-        user_rank_role = self.get_user_rank_role(user)
-        
-        # Descargar y procesar avatar
-        avatar = await self.get_user_avatar(user)
-        
-        # === LAYOUT ADAPTADO PARA 820x950 ===
-        
-        # Avatar en la parte superior centrado - más grande para la resolución
-        avatar_size = 220
-        avatar_circular = self.create_circle_avatar(avatar, avatar_size)
-        avatar_x = (width - avatar_size) - 542 
-        avatar_y = 49
-        
-        # Borde cyan alrededor del avatar
-        draw.ellipse(
-            [(avatar_x - 5, avatar_y - 5), (avatar_x + avatar_size + 5, avatar_y + avatar_size + 5)],
-            outline=cyan_bright,
-            width=0
-        )
-        
-        background.paste(avatar_circular, (avatar_x, avatar_y), avatar_circular)
-        
-        # Fuentes más grandes para la resolución 820x950
-        font_huge = self.get_font(54, bold=True)    # Para el nombre
-        font_large = self.get_font(40, bold=True)   # Para nivel
-        font_medium = self.get_font(60, bold=True)  # Para textos importantes
-        font_small = self.get_font(20)              # Para detalles
-        font_role = self.get_font(45, bold=True)    # Para el rol de rango
-        
-        # === INFORMACIÓN DEL USUARIO (DEBAJO DEL AVATAR) ===
-        
-        info_y = avatar_y + 40
-        
-        # Nombre del usuario centrado
-        username = user.name
-        if len(username) > 15:
-            username = username[:12] + "..."
-        
-        # Calcular posición centrada para el texto
-        bbox = draw.textbbox((0, 0), username, font=font_huge)
-        text_width = bbox[2] - bbox[0]
-        username_x = (width - text_width) + -190
-
-        draw.text((username_x, info_y + 10), username, font=font_huge, fill=cyan_bright)
-        
-        # Nivel centrado
-        level_text = f"{level}"
-        bbox = draw.textbbox((0, 0), level_text, font=font_role)
-        text_width = bbox[2] - bbox[0]
-        level_x = (width - text_width) -93
-        level_y = info_y + 112
-
-        draw.text((level_x, level_y), level_text, font=font_role, fill=cyan_bright)
-        
-        # Rol de rango a la misma altura del nivel pero 295px más a la izquierda
-        role_x = level_x - 295
-        role_y = level_y - 2
-        
-        # Acortar el texto del rol si es muy largo
-        role_text = user_rank_role
-        if len(role_text) > 12:
-            role_text = role_text[:9] + "..."
-        
-        draw.text((role_x, role_y), role_text, font=font_role, fill=cyan_bright)
-        
-        # === UNA SOLA BARRA DE PROGRESO ===
-        
-        progress_y = info_y + 240
-        
-        # Barra de progreso de XP - USANDO DATOS CORRECTOS
-        progress = current_xp / next_level_xp if next_level_xp > 0 else 1.0
-        
-        bar_width = width - 119
-        bar_height = 46
-        bar_x = 57
-        
-        self.draw_progress_bar(
-            draw, bar_x, progress_y, bar_width, bar_height, progress,
-            bg_color=darker_blue,
-            fill_color=cyan_bright,
-            radius=18
-        )
-        
-        # Texto "EXP" a la izquierda de la experiencia
-        exp_label_x = bar_x
-        exp_label_y = progress_y + bar_height + 15
-        draw.text((exp_label_x, exp_label_y), "EXP", font=font_small, fill=white_text)
-        
-        # Experiencia (750/1000) abajo izquierda de la barra - DATOS CORRECTOS
-        exp_text = f"{current_xp}/{next_level_xp}"
-        exp_text_x = exp_label_x + 60  # Después del texto "EXP"
-        draw.text((exp_text_x, exp_label_y), exp_text, font=font_small, fill=white_text)
-        
-        # === DINERO Y RANK ===
-        
-        money_y = progress_y + bar_height + 367
-        
-        # Dinero
-        money_text = f"{balance:.2f}"
-        bbox = draw.textbbox((0, 0), money_text, font=font_medium)
-        text_width = bbox[2] - bbox[0]
-        money_x = (width - text_width) - 428
-        draw.text((money_x, money_y), money_text, font=font_medium, fill=cyan_bright)
-        
-        # Rank en formato #2
-        rank_text = f"#{rank}"
-        bbox = draw.textbbox((0, 0), rank_text, font=font_medium)
-        text_width = bbox[2] - bbox[0]
-        rank_x = (width - text_width) -150
-        rank_y = money_y + 35
-        draw.text((rank_x, rank_y), rank_text, font=font_medium, fill=cyan_bright)
+        spec = {
+            'username': user.name,
+            'level': level,
+            'current_xp': current_xp,
+            'next_level_xp': next_level_xp,
+            'balance': balance,
+            'rank': rank,
+            'role_text': self.get_user_rank_role(user),
+            'template': CARD_TEMPLATE_VERSION,
+        }
         
-        return background
+        # Si nada ha cambiado desde la última vez, servir la tarjeta ya dibujada
+        digest = card_digest(user.id, user.display_avatar.key, spec)
+        png = card_cache.get(digest)
+        if png is None:
+            spec['avatar'] = await self.get_user_avatar(user)
+            png = await get_render_pool().render('profile_card', render_profile_card, spec)
+            card_cache.put(user.id, digest, png)
+        return png
     
     @commands.command(name="perfil", aliases=["profile", "p"])
     @commands.cooldown(1, 30, commands.BucketType.user)
@@ -1083,6 +1115,9 @@ class LevelsSystem(commands.Cog):
             return
         
         try:
+            # Escribir la XP pendiente para mostrar datos y ranking al día
+            await self.xp_buffer.flush()
+            
             # Obtener datos del usuario
             user_data = await get_user_level_data(member.id, ctx.guild.id)
             if not user_data:
@@ -1103,30 +1138,33 @@ class LevelsSystem(commands.Cog):
             # Obtener balance del usuario
             balance = await get_user_balance(member.id)
             
-            # Obtener ranking del usuario
-            rank = await get_user_rank(member.id, ctx.guild.id)
+            # Obtener ranking del usuario (índice en memoria)
+            rank = await self.ranking.rank(ctx.guild.id, member.id)
             
             # DEBUG: Mostrar datos obtenidos
             total_xp = user_data['xp']
             level, current_xp, next_level_xp = self.get_level_from_total_xp(total_xp)
             print(f"PERFIL DEBUG: {member.name} - XP: {total_xp}, Nivel calculado: {level}")
             
-            # Crear imagen del perfil
-            profile_img = await self.create_profile_image(
+            # Crear imagen del perfil (PNG ya codificado)
+            profile_png = await self.create_profile_image(
                 member, user_data, float(balance), rank
             )
-            
-            # Convertir imagen a bytes
-            img_buffer = io.BytesIO()
-            profile_img.save(img_buffer, format='PNG', quality=95)
-            img_buffer.seek(0)
-            
+
             # Crear archivo de Discord
-            file = discord.File(img_buffer, filename=f"perfil_{member.id}.png")
-            
+            file = discord.File(io.BytesIO(profile_png), filename=f"perfil_{member.id}.png")
+
             # Enviar solo la imagen, sin embed
             await ctx.send(file=file)
-            
+
+        except (RenderBusy, asyncio.TimeoutError):
+            embed = discord.Embed(
+                title="⏳ Ocupado",
+                description="Estoy generando muchas imágenes ahora mismo. Inténtalo de nuevo en unos segundos.",
+                color=0xffaa00
+            )
+            await ctx.send(embed=embed)
+
         except Exception as e:
             print(f"Error en comando perfil: {e}")
             
@@ -1158,6 +1196,7 @@ class LevelsSystem(commands.Cog):
             member = ctx.author
         
         try:
+            await self.xp_buffer.flush()
             user_data = await get_user_level_data(member.id, ctx.guild.id)
             if not user_data:
                 # Crear usuario si no existe
@@ -1180,7 +1219,7 @@ class LevelsSystem(commands.Cog):
             embed.add_field(name="XP en Nivel Actual", value=f"{current_xp:,}", inline=True)
             embed.add_field(name="XP para Siguiente Nivel", value=f"{next_level_xp:,}", inline=True)
             embed.add_field(name="Progreso", value=f"{current_xp}/{next_level_xp}", inline=True)
-            embed.add_field(name="XP Acumulada hasta Nivel", value=f"{self.cumulative_xp.get(level, 0):,}", inline=True)
+            embed.add_field(name="XP Acumulada hasta Nivel", value=f"{self.curve.total_for_level(level):,}", inline=True)
             
             await ctx.send(embed=embed)
             
@@ -0,0 +1,90 @@
+import heapq
+import os
+import time
+from core import metrics
+from database import get_xp_multipliers, save_xp_multiplier, delete_xp_multipliers
+
+# Configuración de los multiplicadores (variables de entorno opcionales)
+MULTIPLIER_SWEEP_SECONDS = float(os.getenv("MULTIPLIER_SWEEP_SECONDS", "30"))   # frecuencia del barrido de caducados
+MULTIPLIER_CACHE_MAX = int(os.getenv("MULTIPLIER_CACHE_MAX", "20000"))          # miembros recordados
+
+
+class MultiplierIndex:
+    """Multiplicadores temporales de XP por rol, persistidos en PostgreSQL.
+
+    `by_role` permite consultar un rol en O(1), el heap ordena las expiraciones
+    para barrerlas en segundo plano y `members` guarda el multiplicador efectivo
+    de cada miembro, así que un mensaje solo hace una búsqueda en un dict.
+    """
+
+    def __init__(self, max_members: int = MULTIPLIER_CACHE_MAX):
+        self.by_role = {}    # {role_id: (multiplicador, expira_en epoch)}
+        self.heap = []       # [(expira_en, role_id)] (entradas obsoletas se descartan al barrer)
+        self.members = {}    # {(guild_id, member_id): (config, multiplicador, válido_hasta)}
+        self.max_members = max_members
+
+        metrics.register_gauge('multipliers.roles', lambda: len(self.by_role))
+        metrics.register_gauge('multipliers.members_cached', lambda: len(self.members))
+
+    async def load(self):
+        """Carga los multiplicadores vigentes de la base de datos"""
+        self.by_role.clear()
+        self.heap.clear()
+        for role_id, multiplier, expires_at in await get_xp_multipliers():
+            self._index(role_id, multiplier, expires_at)
+        self.members.clear()
+
+    def _index(self, role_id: int, multiplier: float, expires_at: int):
+        self.by_role[role_id] = (multiplier, expires_at)
+        heapq.heappush(self.heap, (expires_at, role_id))
+
+    async def set(self, role_id: int, guild_id: int, multiplier: float, expires_at: int):
+        """Aplica (o reemplaza) el multiplicador de un rol hasta `expires_at`"""
+        await save_xp_multiplier(role_id, guild_id, multiplier, expires_at)
+        self._index(role_id, multiplier, expires_at)
+        self.members.clear()
+
+    async def sweep(self) -> list:
+        """Quita los multiplicadores caducados (memoria y base de datos); devuelve sus roles"""
+        now = time.time()
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            expires_at, role_id = heapq.heappop(self.heap)
+            current = self.by_role.get(role_id)
+            # Entrada obsoleta: el rol se reprogramó con otra expiración
+            if current is None or current[1] != expires_at:
+                continue
+            del self.by_role[role_id]
+            expired.append(role_id)
+
+        if expired:
+            self.members.clear()
+            await delete_xp_multipliers(expired)
+        return expired
+
+    def effective(self, member, config=None) -> float:
+        """Mayor multiplicador entre los temporales por rol y los roles de bonus del servidor"""
+        key = (member.guild.id, member.id)
+        cached = self.members.get(key)
+        if cached is not None and cached[0] is config and time.time() < cached[2]:
+            return cached[1]
+
+        bonus_roles = config.bonus_roles if config is not None else {}
+        multiplier = 1.0
+        valid_until = float('inf')
+        for role in member.roles:
+            temporary = self.by_role.get(role.id)
+            if temporary is not None:
+                multiplier = max(multiplier, temporary[0])
+                valid_until = min(valid_until, temporary[1])
+            if role.id in bonus_roles:
+                multiplier = max(multiplier, bonus_roles[role.id])
+
+        if len(self.members) >= self.max_members:
+            self.members.clear()
+        self.members[key] = (config, multiplier, valid_until)
+        return multiplier
+
+    def invalidate_member(self, guild_id: int, member_id: int):
+        """Descarta el multiplicador calculado de un miembro (p. ej. al cambiar sus roles)"""
+        self.members.pop((guild_id, member_id), None)
@@ -0,0 +1,287 @@
+import asyncio
+import os
+from bisect import bisect_left, insort
+from core import metrics
+from database import get_guild_xp_snapshot, get_guild_xp_checksum, get_week_period, get_month_period
+
+# Minutos entre cada reconciliación del índice con PostgreSQL
+RANKING_RECONCILE_MINUTES = float(os.getenv("RANKING_RECONCILE_MINUTES", "10"))
+
+PERIODS = ('total', 'weekly', 'monthly')
+
+
+class SortedBuckets:
+    """Lista ordenada repartida en cubos de tamaño acotado (como sortedcontainers.SortedList).
+
+    Insertar o borrar busca el cubo por bisección sobre los máximos y solo mueve
+    elementos dentro de ese cubo; un árbol de Fenwick sobre los tamaños de los
+    cubos da la posición global en O(log n).
+    """
+
+    LOAD = 512   # tamaño de referencia de un cubo (se parte al doble)
+
+    def __init__(self):
+        self.buckets = []   # [[valores ordenados]]
+        self.maxes = []     # último valor de cada cubo
+        self.tree = []      # Fenwick (base 1) con el tamaño de cada cubo
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    # ────────────── Fenwick ──────────────
+
+    def _rebuild_tree(self):
+        tree = [0] * (len(self.buckets) + 1)
+        for index, bucket in enumerate(self.buckets, 1):
+            tree[index] += len(bucket)
+            parent = index + (index & -index)
+            if parent < len(tree):
+                tree[parent] += tree[index]
+        self.tree = tree
+
+    def _tree_add(self, position: int, delta: int):
+        index = position + 1
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    def _prefix(self, position: int) -> int:
+        """Elementos en los cubos anteriores a `position`"""
+        total = 0
+        while position > 0:
+            total += self.tree[position]
+            position -= position & -position
+        return total
+
+    def _locate(self, index: int) -> tuple:
+        """(cubo, posición dentro del cubo) del elemento global `index`"""
+        position = 0
+        step = 1 << (len(self.tree).bit_length() - 1)
+        while step:
+            following = position + step
+            if following < len(self.tree) and self.tree[following] <= index:
+                position = following
+                index -= self.tree[following]
+            step >>= 1
+        return position, index
+
+    # ────────────── operaciones ──────────────
+
+    def add(self, value):
+        if not self.buckets:
+            self.buckets.append([value])
+            self.maxes.append(value)
+            self._rebuild_tree()
+            self.size = 1
+            return
+
+        position = min(bisect_left(self.maxes, value), len(self.buckets) - 1)
+        bucket = self.buckets[position]
+        insort(bucket, value)
+        self.maxes[position] = bucket[-1]
+        self.size += 1
+
+        if len(bucket) > 2 * self.LOAD:
+            self.buckets[position:position + 1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+            self.maxes[position:position + 1] = [bucket[self.LOAD - 1], bucket[-1]]
+            self._rebuild_tree()
+        else:
+            self._tree_add(position, 1)
+
+    def remove(self, value):
+        position = bisect_left(self.maxes, value)
+        bucket = self.buckets[position]
+        del bucket[bisect_left(bucket, value)]
+        self.size -= 1
+
+        if bucket:
+            self.maxes[position] = bucket[-1]
+            self._tree_add(position, -1)
+        else:
+            del self.buckets[position]
+            del self.maxes[position]
+            self._rebuild_tree()
+
+    def bisect_left(self, value) -> int:
+        position = bisect_left(self.maxes, value)
+        if position == len(self.buckets):
+            return self.size
+        return self._prefix(position) + bisect_left(self.buckets[position], value)
+
+    def slice(self, start: int, stop: int) -> list:
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        position, index = self._locate(start)
+        result = []
+        remaining = stop - start
+        while remaining > 0:
+            chunk = self.buckets[position][index:index + remaining]
+            result.extend(chunk)
+            remaining -= len(chunk)
+            position, index = position + 1, 0
+        return result
+
+
+class GuildRanking:
+    """Ranking ordenado de un servidor para un período (búsquedas y cambios en O(log n))"""
+
+    def __init__(self):
+        self.scores = {}              # {user_id: xp}
+        self.order = SortedBuckets()  # (-xp, user_id) ordenados: la mayor XP primero
+        self.total_xp = 0             # suma de scores (para detectar desviaciones con la BD)
+
+    def set(self, user_id: int, xp: int):
+        """Establece la XP de un usuario y lo recoloca en el ranking"""
+        old_xp = self.scores.get(user_id)
+        if old_xp == xp:
+            return
+        if old_xp is not None:
+            self.order.remove((-old_xp, user_id))
+            self.total_xp -= old_xp
+        self.scores[user_id] = xp
+        self.total_xp += xp
+        self.order.add((-xp, user_id))
+
+    def add(self, user_id: int, xp: int):
+        """Suma XP a un usuario"""
+        self.set(user_id, self.scores.get(user_id, 0) + xp)
+
+    def rank(self, user_id: int) -> int:
+        """Posición del usuario: usuarios con más XP + 1 (igual que get_user_rank)"""
+        xp = self.scores.get(user_id, 0)
+        return self.order.bisect_left((-xp,)) + 1
+
+    def top(self, limit: int, offset: int = 0) -> list:
+        """Devuelve [(user_id, xp)] de los mejores usuarios con XP > 0"""
+        end = self.order.bisect_left((0,))
+        return [(user_id, -neg_xp) for neg_xp, user_id in self.order.slice(offset, min(offset + limit, end))]
+
+    def __len__(self):
+        return len(self.order)
+
+
+class RankingIndex:
+    """Índice en memoria por servidor y período (total/semanal/mensual) para rankings y leaderboards"""
+
+    def __init__(self, xp_buffer):
+        # El buffer de XP se consulta al reconstruir para incluir la XP aún no escrita
+        self.xp_buffer = xp_buffer
+        self.guilds = {}   # {guild_id: {'total': GuildRanking, 'weekly': ..., 'monthly': ...}}
+        self.periods = (get_week_period(), get_month_period())
+        self.versions = {}  # {guild_id: contador de cambios} para invalidar cachés derivadas (leaderboard)
+        self._warm_locks = {}
+
+    def version(self, guild_id: int) -> int:
+        """Cambia cada vez que el ranking del servidor se modifica"""
+        return self.versions.get(guild_id, 0)
+
+    def _touch(self, guild_id: int):
+        self.versions[guild_id] = self.versions.get(guild_id, 0) + 1
+
+    def _check_period_rollover(self):
+        """Vacía los rankings semanal/mensual cuando empieza un nuevo período"""
+        current = (get_week_period(), get_month_period())
+        if current == self.periods:
+            return
+        for guild_id, rankings in self.guilds.items():
+            self._touch(guild_id)
+            if current[0] != self.periods[0]:
+                rankings['weekly'] = GuildRanking()
+            if current[1] != self.periods[1]:
+                rankings['monthly'] = GuildRanking()
+        self.periods = current
+
+    async def warm(self, guild_id: int):
+        """(Re)construye el índice de un servidor desde la base de datos"""
+        lock = self._warm_locks.setdefault(guild_id, asyncio.Lock())
+        async with lock:
+            # Escribir el buffer y bloquear nuevas escrituras mientras se lee la foto
+            await self.xp_buffer.flush()
+            async with self.xp_buffer.flush_lock:
+                rows = await get_guild_xp_snapshot(guild_id)
+
+                rankings = {period: GuildRanking() for period in PERIODS}
+                for user_id, xp, weekly_xp, monthly_xp in rows:
+                    rankings['total'].set(user_id, xp)
+                    rankings['weekly'].set(user_id, weekly_xp)
+                    rankings['monthly'].set(user_id, monthly_xp)
+
+                # XP que llegó al buffer durante la lectura
+                for (user_id, buffered_guild_id), (xp, _) in self.xp_buffer.pending.items():
+                    if buffered_guild_id == guild_id:
+                        for ranking in rankings.values():
+                            ranking.add(user_id, xp)
+
+                self._check_period_rollover()
+                self.guilds[guild_id] = rankings
+                self._touch(guild_id)
+
+    async def _get(self, guild_id: int, period: str) -> GuildRanking:
+        if guild_id not in self.guilds:
+            await self.warm(guild_id)
+        self._check_period_rollover()
+        return self.guilds[guild_id][period if period in PERIODS else 'total']
+
+    def record_gain(self, guild_id: int, user_id: int, xp: int):
+        """Aplica una ganancia de XP a los tres períodos (si el servidor está cargado)"""
+        rankings = self.guilds.get(guild_id)
+        if rankings is None:
+            return
+        self._check_period_rollover()
+        for ranking in rankings.values():
+            ranking.add(user_id, xp)
+        self._touch(guild_id)
+
+    def set_total(self, guild_id: int, user_id: int, total_xp: int):
+        """Registra una XP total fijada por un admin (no afecta a semanal/mensual, como en la BD)"""
+        rankings = self.guilds.get(guild_id)
+        if rankings is not None:
+            rankings['total'].set(user_id, total_xp)
+            self._touch(guild_id)
+
+    async def rank(self, guild_id: int, user_id: int, period: str = 'total') -> int:
+        """Posición del usuario en el ranking del servidor"""
+        return (await self._get(guild_id, period)).rank(user_id)
+
+    async def top(self, guild_id: int, limit: int = 10, period: str = 'total', offset: int = 0) -> list:
+        """Leaderboard del servidor: [{'user_id', 'xp'}] de mayor a menor XP"""
+        ranking = await self._get(guild_id, period)
+        return [{'user_id': user_id, 'xp': xp} for user_id, xp in ranking.top(limit, offset)]
+
+    async def drifted(self, guild_id: int) -> bool:
+        """Compara recuento y sumas de XP con la base de datos (una consulta agregada, sin traer filas)"""
+        await self.xp_buffer.flush()
+        async with self.xp_buffer.flush_lock:
+            checksum = await get_guild_xp_checksum(guild_id)
+            self._check_period_rollover()
+            rankings = self.guilds[guild_id]
+
+            # La XP del buffer ya está en el índice pero aún no en la base de datos
+            pending = [
+                xp for (_, buffered_guild_id), (xp, _) in self.xp_buffer.pending.items()
+                if buffered_guild_id == guild_id
+            ]
+            pending_xp = sum(pending)
+            expected = (
+                len(rankings['total'].scores),
+                rankings['total'].total_xp - pending_xp,
+                rankings['weekly'].total_xp - pending_xp,
+                rankings['monthly'].total_xp - pending_xp,
+            )
+        # Con XP pendiente puede haber usuarios nuevos que aún no tienen fila: no comparar el recuento
+        if pending:
+            return expected[1:] != checksum[1:]
+        return expected != checksum
+
+    async def reconcile(self, guild_ids):
+        """Carga los servidores nuevos y reconstruye solo los que se han desviado de PostgreSQL"""
+        for guild_id in guild_ids:
+            try:
+                if guild_id not in self.guilds or await self.drifted(guild_id):
+                    if guild_id in self.guilds:
+                        metrics.incr('ranking.drift')
+                    await self.warm(guild_id)
+            except Exception as e:
+                print(f"Error reconciliando ranking del servidor {guild_id}: {e}")
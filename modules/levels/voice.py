@@ -0,0 +1,136 @@
+import time
+from core import metrics
+from database import save_voice_sessions, get_open_voice_sessions
+
+
+class VoiceSession:
+    __slots__ = ('user_id', 'guild_id', 'join_time', 'xp_earned', 'last_tick')
+
+    def __init__(self, user_id: int, guild_id: int, join_time: int, xp_earned: int = 0, last_tick: int = None):
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.join_time = join_time
+        self.xp_earned = xp_earned
+        self.last_tick = last_tick if last_tick is not None else join_time
+
+
+class VoiceTracker:
+    """Sesiones de voz abiertas en memoria; la XP y el tiempo se acumulan por minuto y se guardan en lote"""
+
+    def __init__(self):
+        self.sessions = {}   # {(user_id, guild_id): VoiceSession}
+        self.closed = []     # [(user_id, guild_id, join_time, leave_time, xp_earned, last_seen)] sin guardar
+
+        metrics.register_gauge('voice.sessions', lambda: len(self.sessions))
+
+    @staticmethod
+    def is_earning(member) -> bool:
+        """En voz, fuera del canal AFK, sin silenciar/ensordecer y con al menos otra persona"""
+        voice = member.voice
+        if voice is None or voice.channel is None or voice.afk:
+            return False
+        if voice.channel == member.guild.afk_channel:
+            return False
+        if voice.self_mute or voice.self_deaf or voice.mute or voice.deaf:
+            return False
+        return any(not other.bot and other.id != member.id for other in voice.channel.members)
+
+    # ────────────── eventos ──────────────
+
+    def open(self, member, now: int = None):
+        key = (member.id, member.guild.id)
+        if key not in self.sessions:
+            self.sessions[key] = VoiceSession(member.id, member.guild.id, now or int(time.time()))
+
+    def close(self, user_id: int, guild_id: int, now: int = None):
+        session = self.sessions.pop((user_id, guild_id), None)
+        if session is not None:
+            now = now or int(time.time())
+            self.closed.append((user_id, guild_id, session.join_time, now, session.xp_earned, now))
+
+    def update(self, member, before, after):
+        """on_voice_state_update: abre la sesión al entrar y la cierra al salir (moverse de canal la conserva)"""
+        if member.bot:
+            return
+        if after.channel is not None and before.channel is None:
+            self.open(member)
+        elif after.channel is None and before.channel is not None:
+            self.close(member.id, member.guild.id)
+
+    # ────────────── vuelta por minuto ──────────────
+
+    def collect(self, get_guild, xp_for) -> tuple:
+        """Acumula el tiempo desde la última vuelta de cada sesión activa.
+
+        `xp_for(member, segundos)` da la XP de voz de ese miembro. Devuelve
+        ([(user_id, guild_id, xp, segundos)], {(user_id, guild_id): member},
+        [(user_id, guild_id, segundos)]); la última lista son las sesiones que no
+        ganan XP (voz sin XP en el servidor), de las que solo se guarda el tiempo.
+        """
+        now = int(time.time())
+        grants = []
+        members = {}
+        idle = []
+        for key, session in list(self.sessions.items()):
+            elapsed = now - session.last_tick
+            session.last_tick = now
+
+            guild = get_guild(session.guild_id)
+            member = guild.get_member(session.user_id) if guild else None
+            if member is None or member.voice is None:
+                # Se perdió el evento de salida (desconexión, caída del gateway)
+                self.close(session.user_id, session.guild_id, now)
+                continue
+            if elapsed <= 0 or not self.is_earning(member):
+                continue
+
+            xp = xp_for(member, elapsed)
+            if xp <= 0:
+                idle.append((session.user_id, session.guild_id, elapsed))
+                continue
+            session.xp_earned += xp
+            grants.append((session.user_id, session.guild_id, xp, elapsed))
+            members[key] = member
+        return grants, members, idle
+
+    async def flush(self):
+        """Guarda las sesiones cerradas y el progreso de las abiertas con una sola escritura en lote"""
+        now = int(time.time())
+        closed, self.closed = self.closed, []
+        rows = closed + [
+            (s.user_id, s.guild_id, s.join_time, 0, s.xp_earned, now)
+            for s in self.sessions.values()
+        ]
+        try:
+            await save_voice_sessions(rows)
+        except Exception as e:
+            # Conservar las cerradas para el siguiente intento
+            self.closed = closed + self.closed
+            print(f"Error guardando sesiones de voz: {e}")
+
+    async def recover(self, guilds):
+        """Tras un reinicio: retoma las sesiones guardadas de quien sigue en voz y cierra el resto"""
+        now = int(time.time())
+        present = {}
+        for guild in guilds:
+            for channel in list(guild.voice_channels) + list(guild.stage_channels):
+                for member in channel.members:
+                    if not member.bot:
+                        present[(member.id, guild.id)] = member
+
+        resumed = 0
+        for user_id, guild_id, join_time, xp_earned, last_seen in await get_open_voice_sessions():
+            key = (user_id, guild_id)
+            current = self.sessions.get(key)
+            if key in present and (current is None or current.join_time == join_time):
+                # El tiempo sin el bot conectado no cuenta: se acumula desde ahora
+                self.sessions[key] = VoiceSession(user_id, guild_id, join_time, xp_earned, now)
+                resumed += 1
+            elif current is None or current.join_time != join_time:
+                leave_time = last_seen or join_time
+                self.closed.append((user_id, guild_id, join_time, leave_time, xp_earned, leave_time))
+
+        for member in present.values():
+            self.open(member, now)
+
+        print(f"🎙️ Sesiones de voz: {resumed} retomadas, {len(self.sessions)} abiertas")
@@ -0,0 +1,94 @@
+import asyncio
+import os
+from database import get_user_xp, bulk_add_user_xp
+
+# Configuración del buffer (variables de entorno opcionales)
+XP_FLUSH_INTERVAL = float(os.getenv("XP_FLUSH_INTERVAL", "15"))        # segundos entre escrituras
+XP_FLUSH_MAX_PENDING = int(os.getenv("XP_FLUSH_MAX_PENDING", "500"))    # usuarios pendientes antes de forzar escritura
+XP_BUFFER_MAX_KNOWN = int(os.getenv("XP_BUFFER_MAX_KNOWN", "20000"))    # totales recordados en memoria
+
+
+class XPBuffer:
+    """Acumula la XP ganada por (usuario, servidor) y la escribe en lote en la base de datos"""
+
+    def __init__(self, level_thresholds: list, max_pending: int = XP_FLUSH_MAX_PENDING, max_known: int = XP_BUFFER_MAX_KNOWN):
+        # Umbrales de la curva: el nivel se calcula en SQL sobre la XP resultante
+        self.level_thresholds = level_thresholds
+        self.max_pending = max_pending
+        self.max_known = max_known
+
+        # {(user_id, guild_id): [xp, mensajes]} pendientes de escribir
+        self.pending = {}
+        # {(user_id, guild_id): xp} ya escrita (o en vuelo) en la base de datos
+        self.known_totals = {}
+
+        self._lock = asyncio.Lock()
+        self._flush_task = None
+
+    @property
+    def flush_lock(self) -> asyncio.Lock:
+        """Lock que se mantiene durante cada escritura (para leer la BD sin escrituras concurrentes)"""
+        return self._lock
+
+    def pending_xp(self, user_id: int, guild_id: int) -> int:
+        """XP acumulada que aún no se ha escrito"""
+        entry = self.pending.get((user_id, guild_id))
+        return entry[0] if entry else 0
+
+    async def add(self, user_id: int, guild_id: int, xp: int, messages: int = 1) -> tuple:
+        """Suma XP al buffer y devuelve (XP total anterior, XP total nueva)"""
+        key = (user_id, guild_id)
+
+        if key not in self.known_totals:
+            # Solo se consulta la base de datos la primera vez que vemos al usuario
+            persisted = await get_user_xp(user_id, guild_id)
+            self.known_totals.setdefault(key, persisted)
+
+        entry = self.pending.setdefault(key, [0, 0])
+        old_total = self.known_totals[key] + entry[0]
+        entry[0] += xp
+        entry[1] += messages
+
+        if len(self.pending) >= self.max_pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+        return old_total, old_total + xp
+
+    def note_total(self, user_id: int, guild_id: int, total_xp: int):
+        """Registra la XP persistida tras una escritura directa (comandos de admin, etc.)"""
+        self.known_totals[(user_id, guild_id)] = total_xp
+
+    async def flush(self):
+        """Escribe toda la XP pendiente con un único upsert en lote"""
+        async with self._lock:
+            if not self.pending:
+                return
+
+            batch, self.pending = self.pending, {}
+
+            # Se actualizan los totales antes de escribir para que los mensajes que
+            # lleguen durante la escritura calculen el nivel sobre la XP en vuelo
+            entries = []
+            for (user_id, guild_id), (xp, messages) in batch.items():
+                key = (user_id, guild_id)
+                self.known_totals[key] = self.known_totals.get(key, 0) + xp
+                entries.append((user_id, guild_id, xp, messages))
+
+            try:
+                await bulk_add_user_xp(entries, self.level_thresholds)
+            except Exception as e:
+                print(f"Error escribiendo buffer de XP ({len(entries)} usuarios): {e}")
+                # Devolver la XP al buffer para reintentar en la siguiente escritura
+                for (user_id, guild_id), (xp, messages) in batch.items():
+                    key = (user_id, guild_id)
+                    self.known_totals[key] -= xp
+                    entry = self.pending.setdefault(key, [0, 0])
+                    entry[0] += xp
+                    entry[1] += messages
+                return
+
+            # Limitar la memoria: olvidar totales de usuarios sin XP pendiente
+            if len(self.known_totals) > self.max_known:
+                self.known_totals = {
+                    key: total for key, total in self.known_totals.items() if key in self.pending
+                }
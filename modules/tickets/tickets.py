@@ -1,10 +1,9 @@
 import discord
 from discord.ext import commands
-import sqlite3
 import datetime
-import os
 import asyncio
 import json
+import database
 
 # IDs de configuración
 ADMIN_IDS = [1400106792196898889]
@@ -58,7 +57,7 @@ class TicketCategorySelect(discord.ui.Select):
         # Verificar si el usuario ya tiene tickets abiertos (límite de 3)
         tickets_cog = interaction.client.get_cog('Tickets')
         if tickets_cog:
-            open_tickets = tickets_cog.get_user_open_tickets(user.id)
+            open_tickets = await tickets_cog.get_user_open_tickets(user.id)
             if len(open_tickets) >= 3:
                 await interaction.response.send_message(
                     f"❌ **Límite de tickets alcanzado**\n"
@@ -121,7 +120,7 @@ class TicketCategorySelect(discord.ui.Select):
             
             # Registrar en base de datos
             if tickets_cog:
-                tickets_cog.create_ticket_record(
+                await tickets_cog.create_ticket_record(
                     channel_id=ticket_channel.id,
                     user_id=user.id,
                     category=category,
@@ -289,7 +288,7 @@ class TicketControlView(discord.ui.View):
         # Actualizar base de datos
         tickets_cog = interaction.client.get_cog('Tickets')
         if tickets_cog:
-            tickets_cog.update_ticket_claim(self.channel_id, interaction.user.id)
+            await tickets_cog.update_ticket_claim(self.channel_id, interaction.user.id)
         
         # Crear embed de reclamo
         embed = discord.Embed(
@@ -368,7 +367,7 @@ class ConfirmCloseView(discord.ui.View):
         # Actualizar base de datos
         tickets_cog = interaction.client.get_cog('Tickets')
         if tickets_cog:
-            tickets_cog.close_ticket_record(self.channel_id, interaction.user.id)
+            await tickets_cog.close_ticket_record(self.channel_id, interaction.user.id)
         
         # Calcular duración del ticket
         creation_time = channel.created_at
@@ -452,97 +451,41 @@ class ConfirmCloseView(discord.ui.View):
 class Tickets(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.init_database()
 
-    def init_database(self):
-        """Inicializar la base de datos SQLite con esquema mejorado"""
-        if not os.path.exists('tickets.db'):
-            conn = sqlite3.connect('tickets.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE tickets (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    channel_id INTEGER UNIQUE,
-                    user_id INTEGER,
-                    category TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    closed_at TIMESTAMP,
-                    claimed_by INTEGER,
-                    closed_by INTEGER,
-                    status TEXT DEFAULT 'abierto',
-                    priority TEXT DEFAULT 'normal'
-                )
-            ''')
-            
-            # Tabla para mensajes del ticket (opcional, para futuras funciones)
-            cursor.execute('''
-                CREATE TABLE ticket_messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ticket_id INTEGER,
-                    user_id INTEGER,
-                    message_content TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (ticket_id) REFERENCES tickets (id)
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
+    async def cog_load(self):
+        """Migrar una sola vez los tickets del antiguo tickets.db (SQLite) a PostgreSQL"""
+        try:
+            migrated = await database.migrate_sqlite_tickets('tickets.db')
+            if migrated:
+                print(f"✅ {migrated} tickets migrados de tickets.db a PostgreSQL")
+        except Exception as e:
+            print(f"❌ Error migrando tickets.db: {e}")
 
-    def create_ticket_record(self, channel_id, user_id, category, status):
+    async def create_ticket_record(self, channel_id, user_id, category, status):
         """Crear registro de ticket en la base de datos"""
         try:
-            conn = sqlite3.connect('tickets.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO tickets (channel_id, user_id, category, status)
-                VALUES (?, ?, ?, ?)
-            ''', (channel_id, user_id, category, status))
-            conn.commit()
-            conn.close()
+            await database.create_ticket_record(channel_id, user_id, category, status)
         except Exception as e:
             print(f"❌ Error al crear registro de ticket: {e}")
 
-    def update_ticket_claim(self, channel_id, claimed_by):
+    async def update_ticket_claim(self, channel_id, claimed_by):
         """Actualizar quien reclamó el ticket"""
         try:
-            conn = sqlite3.connect('tickets.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE tickets SET claimed_by = ? WHERE channel_id = ?
-            ''', (claimed_by, channel_id))
-            conn.commit()
-            conn.close()
+            await database.update_ticket_claim(channel_id, claimed_by)
         except Exception as e:
             print(f"❌ Error al actualizar reclamo de ticket: {e}")
 
-    def close_ticket_record(self, channel_id, closed_by):
+    async def close_ticket_record(self, channel_id, closed_by):
         """Cerrar ticket en la base de datos"""
         try:
-            conn = sqlite3.connect('tickets.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE tickets 
-                SET status = 'cerrado', closed_at = CURRENT_TIMESTAMP, closed_by = ?
-                WHERE channel_id = ?
-            ''', (closed_by, channel_id))
-            conn.commit()
-            conn.close()
+            await database.close_ticket_record(channel_id, closed_by)
         except Exception as e:
             print(f"❌ Error al cerrar ticket: {e}")
 
-    def get_user_open_tickets(self, user_id):
+    async def get_user_open_tickets(self, user_id):
         """Obtener tickets abiertos de un usuario"""
         try:
-            conn = sqlite3.connect('tickets.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT channel_id, category FROM tickets 
-                WHERE user_id = ? AND status = 'abierto'
-            ''', (user_id,))
-            tickets = cursor.fetchall()
-            conn.close()
-            return tickets
+            return await database.get_user_open_tickets(user_id)
         except Exception as e:
             print(f"❌ Error al obtener tickets del usuario: {e}")
             return []
@@ -643,18 +586,10 @@ class Tickets(commands.Cog):
             return
         
         try:
-            conn = sqlite3.connect('tickets.db')
-            cursor = conn.cursor()
+            stats = await database.get_ticket_stats(user.id if user else None)
             
             if user:
                 # Estadísticas de usuario específico
-                cursor.execute('''
-                    SELECT category, COUNT(*), 
-                           SUM(CASE WHEN status = 'abierto' THEN 1 ELSE 0 END) as abiertos,
-                           SUM(CASE WHEN status = 'cerrado' THEN 1 ELSE 0 END) as cerrados
-                    FROM tickets WHERE user_id = ? GROUP BY category
-                ''', (user.id,))
-                
                 embed = discord.Embed(
                     title=f"📊 Estadísticas de {user.display_name}",
                     description=f"**Usuario:** {user.mention}\n**ID:** `{user.id}`",
@@ -664,20 +599,13 @@ class Tickets(commands.Cog):
                 
             else:
                 # Estadísticas generales
-                cursor.execute('''
-                    SELECT category, COUNT(*), 
-                           SUM(CASE WHEN status = 'abierto' THEN 1 ELSE 0 END) as abiertos,
-                           SUM(CASE WHEN status = 'cerrado' THEN 1 ELSE 0 END) as cerrados
-                    FROM tickets GROUP BY category
-                ''')
-                
                 embed = discord.Embed(
                     title="📊 Estadísticas Generales de Tickets",
                     description="**Resumen completo del sistema de tickets**",
                     color=0x2ecc71
                 )
             
-            results = cursor.fetchall()
+            results = stats['categories']
             
             if not results:
                 embed.add_field(
@@ -731,14 +659,7 @@ class Tickets(commands.Cog):
                 # Estadísticas adicionales si es general
                 if not user:
                     # Top usuarios con más tickets
-                    cursor.execute('''
-                        SELECT user_id, COUNT(*) as total_tickets 
-                        FROM tickets 
-                        GROUP BY user_id 
-                        ORDER BY total_tickets DESC 
-                        LIMIT 5
-                    ''')
-                    top_users = cursor.fetchall()
+                    top_users = stats['top_users']
                     
                     if top_users:
                         top_users_text = ""
@@ -754,15 +675,7 @@ class Tickets(commands.Cog):
                         )
                     
                     # Staff más activo
-                    cursor.execute('''
-                        SELECT claimed_by, COUNT(*) as claims 
-                        FROM tickets 
-                        WHERE claimed_by IS NOT NULL 
-                        GROUP BY claimed_by 
-                        ORDER BY claims DESC 
-                        LIMIT 5
-                    ''')
-                    top_staff = cursor.fetchall()
+                    top_staff = stats['top_staff']
                     
                     if top_staff:
                         top_staff_text = ""
@@ -782,7 +695,6 @@ class Tickets(commands.Cog):
                 icon_url=ctx.author.display_avatar.url
             )
             
-            conn.close()
             await ctx.send(embed=embed)
             
         except Exception as e:
@@ -805,22 +717,16 @@ class Tickets(commands.Cog):
         
         try:
             # Obtener información del ticket de la base de datos
-            conn = sqlite3.connect('tickets.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT user_id, category, claimed_by FROM tickets 
-                WHERE channel_id = ? AND status = 'abierto'
-            ''', (target_channel.id,))
-            ticket_info = cursor.fetchone()
+            ticket = await database.get_ticket(target_channel.id)
             
-            if not ticket_info:
+            if not ticket or ticket[8] != 'abierto':
                 await ctx.send(f"❌ No se encontró información del ticket para {target_channel.mention}")
                 return
             
-            user_id, category, claimed_by = ticket_info
+            user_id, category, claimed_by = ticket[2], ticket[3], ticket[6]
             
             # Cerrar en la base de datos
-            self.close_ticket_record(target_channel.id, ctx.author.id)
+            await self.close_ticket_record(target_channel.id, ctx.author.id)
             
             # Crear embed de cierre forzado
             embed = discord.Embed(
@@ -864,8 +770,6 @@ class Tickets(commands.Cog):
             await asyncio.sleep(5)
             await target_channel.delete(reason=f"Ticket cerrado forzadamente por {ctx.author}")
             
-            conn.close()
-            
         except Exception as e:
             await ctx.send(f"❌ **Error al cerrar ticket:** `{str(e)}`")
 
@@ -880,12 +784,7 @@ class Tickets(commands.Cog):
         target_channel = channel or ctx.channel
         
         try:
-            conn = sqlite3.connect('tickets.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM tickets WHERE channel_id = ?
-            ''', (target_channel.id,))
-            ticket = cursor.fetchone()
+            ticket = await database.get_ticket(target_channel.id)
             
             if not ticket:
                 await ctx.send(f"❌ No se encontró información del ticket para {target_channel.mention}")
@@ -901,9 +800,9 @@ class Tickets(commands.Cog):
             closer = self.bot.get_user(closed_by) if closed_by else None
             
             # Calcular duración
-            created_time = datetime.datetime.fromisoformat(created_at)
+            created_time = created_at
             if closed_at:
-                closed_time = datetime.datetime.fromisoformat(closed_at)
+                closed_time = closed_at
                 duration = closed_time - created_time
             else:
                 duration = datetime.datetime.now() - created_time
@@ -956,7 +855,7 @@ class Tickets(commands.Cog):
                 )
             
             if status == 'cerrado' and closed_at:
-                closed_time = datetime.datetime.fromisoformat(closed_at)
+                closed_time = closed_at
                 embed.add_field(
                     name="🔒 Cerrado",
                     value=f"<t:{int(closed_time.timestamp())}:F>\n<t:{int(closed_time.timestamp())}:R>",
@@ -982,7 +881,6 @@ class Tickets(commands.Cog):
             )
             embed.set_thumbnail(url=user.display_avatar.url if user else None)
             
-            conn.close()
             await ctx.send(embed=embed)
             
         except Exception as e:
@@ -997,15 +895,7 @@ class Tickets(commands.Cog):
             return
         
         try:
-            conn = sqlite3.connect('tickets.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT channel_id, user_id, category, created_at, claimed_by 
-                FROM tickets 
-                WHERE status = 'abierto' 
-                ORDER BY created_at DESC
-            ''')
-            open_tickets = cursor.fetchall()
+            open_tickets = await database.get_open_tickets()
             
             if not open_tickets:
                 embed = discord.Embed(
@@ -1028,8 +918,7 @@ class Tickets(commands.Cog):
                 user = self.bot.get_user(user_id)
                 claimer = self.bot.get_user(claimed_by) if claimed_by else None
                 
-                created_time = datetime.datetime.fromisoformat(created_at)
-                time_ago = datetime.datetime.now() - created_time
+                time_ago = datetime.datetime.now() - created_at
                 time_str = str(time_ago).split('.')[0]
                 
                 channel_mention = channel.mention if channel else f"Canal eliminado ({channel_id})"
@@ -1083,7 +972,6 @@ class Tickets(commands.Cog):
                 icon_url=ctx.author.display_avatar.url
             )
             
-            conn.close()
             await ctx.send(embed=embed)
             
         except Exception as e:
@@ -1163,15 +1051,7 @@ class Tickets(commands.Cog):
         
         # Verificar base de datos
         try:
-            conn = sqlite3.connect('tickets.db')
-            cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM tickets')
-            total_tickets = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM tickets WHERE status = "abierto"')
-            open_tickets = cursor.fetchone()[0]
-            
-            conn.close()
+            total_tickets, open_tickets = await database.count_tickets()
             db_status = "✅ Funcionando"
         except:
             total_tickets = "Error"
@@ -2,10 +2,11 @@ import discord
 from discord.ext import commands
 from datetime import datetime, timezone
 import random
-import aiohttp
 from PIL import Image, ImageDraw
 import io
 import os
+from core.assets import assets
+from core.avatars import avatars
 
 # Configuración de canales
 WELCOME_CHANNEL_ID = 1400106792821981247  # ID del canal de bienvenida específico
@@ -48,17 +49,9 @@ class WelcomeSystem(commands.Cog):
         self.avatar_border_size = 0  # Tamaño del borde en píxeles (0 para sin borde)
         self.avatar_border_color = (255, 255, 255, 255)
 
-    async def download_avatar(self, user):
-        """Descarga el avatar del usuario"""
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(str(user.display_avatar.url)) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    return None
-        except Exception as e:
-            print(f"❌ Error descargando avatar: {e}")
-            return None
+    async def download_avatar(self, user, size: int = 256):
+        """Avatar del usuario en PNG desde la caché compartida (None si falla)"""
+        return await avatars.fetch(user.display_avatar, size)
 
     def create_circular_avatar(self, avatar_bytes, size=None):
         """Crea un avatar circular con borde configurable"""
@@ -135,16 +128,11 @@ class WelcomeSystem(commands.Cog):
                 print(f"⚠️ Imagen de fondo no encontrada: {self.background_image}")
                 return None
             
-            # Cargar imagen de fondo
-            background = Image.open(self.background_image).convert("RGBA")
-            
-            # Redimensionar fondo si es muy grande
+            # Fondo ya redimensionado (máximo 1000px de ancho) desde la caché de recursos
+            background = assets.get_template(
+                self.background_image, max_width=1000, resample=Image.Resampling.LANCZOS
+            )
             bg_width, bg_height = background.size
-            if bg_width > 1000:
-                ratio = 1000 / bg_width
-                new_height = int(bg_height * ratio)
-                background = background.resize((1000, new_height), Image.Resampling.LANCZOS)
-                bg_width, bg_height = background.size
             
             # Descargar avatar del usuario
             avatar_bytes = await self.download_avatar(member)
@@ -211,13 +199,13 @@ class WelcomeSystem(commands.Cog):
                 print(f"✅ Bienvenida con imagen personalizada enviada para {member.display_name}")
             else:
                 # Fallback: imagen de fondo sin avatar superpuesto
-                if os.path.exists(self.background_image):
-                    with open(self.background_image, 'rb') as f:
-                        file = discord.File(f, filename="welcome_bg.png")
-                        embed.set_image(url="attachment://welcome_bg.png")
-                        embed.set_thumbnail(url=member.display_avatar.url)
-                        await channel.send(embed=embed, file=file)
-                        print(f"✅ Bienvenida básica enviada para {member.display_name}")
+                background_bytes = assets.get_file(self.background_image)
+                if background_bytes:
+                    file = discord.File(io.BytesIO(background_bytes), filename="welcome_bg.png")
+                    embed.set_image(url="attachment://welcome_bg.png")
+                    embed.set_thumbnail(url=member.display_avatar.url)
+                    await channel.send(embed=embed, file=file)
+                    print(f"✅ Bienvenida básica enviada para {member.display_name}")
                 else:
                     # Último fallback: solo avatar
                     embed.set_image(url=member.display_avatar.url)
@@ -237,7 +225,7 @@ class WelcomeSystem(commands.Cog):
             base_image_path = "resources/images/welcome-general.png"
             
             try:
-                img = Image.open(base_image_path).convert("RGBA")
+                img = assets.get_template(base_image_path)
             except FileNotFoundError:
                 print(f"❌ No se encontró la imagen base: {base_image_path}")
                 return None
@@ -249,12 +237,7 @@ class WelcomeSystem(commands.Cog):
             user_avatar_bytes = await self.download_avatar(member)
             
             # Descargar logo del servidor
-            server_avatar_bytes = None
-            if member.guild.icon:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(str(member.guild.icon.url)) as response:
-                        if response.status == 200:
-                            server_avatar_bytes = await response.read()
+            server_avatar_bytes = await avatars.fetch(member.guild.icon, 128)
             
             # Tamaño de los avatares circulares
             avatar_size = 65  # Ajusta según el tamaño de tu imagen base